@@ -0,0 +1,141 @@
+"""
+Agg Renderer Module
+Draws the candlestick chart specs with matplotlib's Agg rasterizer, without a browser process
+"""
+import io
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection, PolyCollection
+from matplotlib.ticker import FuncFormatter, MaxNLocator
+
+# Plotly's default colors, so both backends produce the same-looking charts
+INCREASING = '#3D9970'
+DECREASING = '#FF4136'
+VOLUME = '#EF553B'
+GRID = '#E5ECF6'
+
+DPI = 100
+BODY_WIDTH = 0.7  # Fraction of a bar slot filled by its candle body or volume bar
+
+
+def bar_boxes(x, bottom, top, width=BODY_WIDTH):
+    """
+    Rectangle vertices for many bars at once.
+
+    Args:
+        x (np.ndarray): Bar centers
+        bottom (np.ndarray): Lower edges
+        top (np.ndarray): Upper edges
+        width (float): Bar width in x units
+
+    Returns:
+        np.ndarray: (n, 4, 2) vertices for a PolyCollection
+    """
+    left, right = x - width / 2, x + width / 2
+    return np.stack([
+        np.column_stack([left, bottom]),
+        np.column_stack([left, top]),
+        np.column_stack([right, top]),
+        np.column_stack([right, bottom]),
+    ], axis=1)
+
+
+def time_formatter(timestamps):
+    """
+    Tick label formatter mapping bar positions to their times.
+
+    Bars are drawn at consecutive integer positions so nights and weekends
+    take no space; labels show the time, the date and time, or the date
+    depending on what the bars span.
+
+    Args:
+        timestamps (np.ndarray): Bar start times as datetime64 values
+
+    Returns:
+        FuncFormatter: Formatter for the x axis
+    """
+    labels = np.datetime_as_string(np.asarray(timestamps, dtype='datetime64[m]'), unit='m')
+    daily = all(label.endswith('T00:00') for label in labels)
+    one_day = len(set(label[:10] for label in labels)) == 1
+
+    def label(value, _):
+        i = int(round(value))
+        if not 0 <= i < len(labels):
+            return ''
+        if daily:
+            return labels[i][:10]
+        if one_day:
+            return labels[i][11:]
+        return f'{labels[i][5:10]} {labels[i][11:]}'
+
+    return FuncFormatter(label)
+
+
+def style(ax):
+    ax.set_facecolor(GRID)
+    ax.grid(True, color='white', linewidth=1)
+    ax.set_axisbelow(True)
+    for side in ax.spines.values():
+        side.set_visible(False)
+    ax.tick_params(length=0, labelsize=8)
+
+
+def render_figure(spec):
+    """
+    Render a chart spec to encoded image bytes.
+
+    Draws the same layouts as the Plotly backend: candles alone ('candle')
+    or candles over a volume panel ('candle_volume'). Candles and volume
+    bars are drawn as three collections, whatever the number of bars.
+
+    Args:
+        spec (dict): Chart spec (see renderer.build_figure), optionally with format/width/height
+
+    Returns:
+        bytes: Encoded image
+    """
+    data = spec['data']
+    open_, high, low, close = (np.asarray(data[name], dtype=float) for name in ('open', 'high', 'low', 'close'))
+    x = np.arange(len(open_), dtype=float)
+    up = close >= open_
+
+    fig = Figure(figsize=((spec.get('width') or 700) / DPI, (spec.get('height') or 500) / DPI), dpi=DPI)
+    FigureCanvasAgg(fig)
+    if spec['layout'] == 'candle':
+        price_ax = fig.add_subplot()
+        price_ax.set_title(spec['title'], loc='left', fontsize=11)
+        axes = [price_ax]
+    else:
+        price_ax, volume_ax = fig.subplots(
+            2, 1, sharex=True, gridspec_kw={'height_ratios': [0.7, 0.2], 'hspace': 0.15}
+        )
+        price_ax.set_title(spec['title'], fontsize=10)
+        volume_ax.set_title('Volume', fontsize=10)
+        axes = [price_ax, volume_ax]
+        volume = np.nan_to_num(np.asarray(data['volume'], dtype=float))
+        volume_ax.add_collection(PolyCollection(
+            bar_boxes(x, np.zeros_like(volume), volume), facecolors=VOLUME, linewidths=0
+        ))
+        volume_ax.set_ylim(0, max(volume.max(initial=0), 1) * 1.05)
+
+    colors = np.where(up, INCREASING, DECREASING)
+    wicks = np.stack([np.column_stack([x, low]), np.column_stack([x, high])], axis=1)
+    price_ax.add_collection(LineCollection(wicks, colors=colors, linewidths=1))
+    body_low, body_high = np.minimum(open_, close), np.maximum(open_, close)
+    price_ax.add_collection(PolyCollection(
+        bar_boxes(x, body_low, body_high), facecolors=colors, edgecolors=colors, linewidths=0.5
+    ))
+    if len(x):
+        span = np.nanmax(high) - np.nanmin(low) or 1
+        price_ax.set_ylim(np.nanmin(low) - span * 0.05, np.nanmax(high) + span * 0.05)
+
+    for ax in axes:
+        style(ax)
+        ax.set_xlim(-1, max(len(x), 1))
+    axes[-1].xaxis.set_major_locator(MaxNLocator(nbins=6, integer=True))
+    axes[-1].xaxis.set_major_formatter(time_formatter(data['timestamp']))
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format=spec.get('format', 'jpeg'), dpi=DPI, facecolor='white')
+    return buffer.getvalue()
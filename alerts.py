@@ -0,0 +1,429 @@
+"""
+Alerts Module
+Price-level and gap alerts evaluated against the streaming feed, with rate-limited delivery
+"""
+import asyncio
+import bisect
+import json
+import os
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from config import (
+    ALERTS_PATH, ALERTS_PER_USER, ALERT_MESSAGES_PER_SECOND, ALERT_MESSAGE_BURST,
+    ALERT_DELIVERY_INTERVAL, DISCORD_MESSAGE_LIMIT
+)
+from bar_store import eastern
+from bars import RTH_OPEN
+from daily_snapshot import get_daily_snapshot
+from scheduler import RequestScheduler
+from jobs import run_io
+from metrics import metrics
+import streaming
+
+# Price alerts fire once, when price crosses their level; gap alerts fire at most once per session and stay armed
+ALERT_KINDS = ('above', 'below', 'gap_up', 'gap_down')
+GAP_KINDS = ('gap_up', 'gap_down')
+
+
+class Alert:
+    """One user's alert on one ticker."""
+
+    __slots__ = ('id', 'user_id', 'channel_id', 'guild_id', 'ticker', 'kind', 'value', 'last_fired')
+
+    def __init__(self, id, user_id, channel_id, guild_id, ticker, kind, value, last_fired=None):
+        self.id = id
+        self.user_id = user_id
+        self.channel_id = channel_id
+        self.guild_id = guild_id
+        self.ticker = ticker
+        self.kind = kind
+        self.value = value
+        self.last_fired = last_fired  # Session date a gap alert last fired
+
+    @property
+    def key(self):
+        """What makes two alerts duplicates of each other."""
+        return (self.user_id, self.ticker, self.kind, self.value)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def describe(self):
+        """Human-readable summary, e.g. '#12 AAPL above $190.00'."""
+        if self.kind in GAP_KINDS:
+            return f'#{self.id} {self.ticker} gap {self.kind[4:]} of {self.value:g}% or more'
+        return f'#{self.id} {self.ticker} {self.kind} ${self.value:,.2f}'
+
+
+class ThresholdBook:
+    """
+    (level, alert id) pairs of one ticker and alert kind, kept sorted.
+
+    The alerts a price or gap triggers are a contiguous run of the list,
+    found with binary searches, so evaluating a bar costs O(log n + matches)
+    however many alerts the ticker has.
+    """
+
+    def __init__(self):
+        self.entries = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, level, alert_id):
+        bisect.insort(self.entries, (level, alert_id))
+
+    def remove(self, level, alert_id):
+        i = bisect.bisect_left(self.entries, (level, alert_id))
+        if i < len(self.entries) and self.entries[i] == (level, alert_id):
+            del self.entries[i]
+
+    def at_most(self, value):
+        """Entries with level <= value."""
+        return self.entries[:bisect.bisect_right(self.entries, (value, float('inf')))]
+
+    def at_least(self, value):
+        """Entries with level >= value."""
+        return self.entries[bisect.bisect_left(self.entries, (value, float('-inf'))):]
+
+    def crossed_up(self, start, high):
+        """Entries with start < level <= high: the levels a rise from start to high crosses."""
+        return self.entries[
+            bisect.bisect_right(self.entries, (start, float('inf'))):
+            bisect.bisect_right(self.entries, (high, float('inf')))
+        ]
+
+    def crossed_down(self, start, low):
+        """Entries with low <= level < start: the levels a fall from start to low crosses."""
+        return self.entries[
+            bisect.bisect_left(self.entries, (low, float('-inf'))):
+            bisect.bisect_left(self.entries, (start, float('-inf')))
+        ]
+
+
+def chunk_lines(lines, limit=DISCORD_MESSAGE_LIMIT):
+    """
+    Join lines into as few messages as fit the length limit.
+
+    Args:
+        lines (list): Message lines
+        limit (int): Maximum characters per message
+
+    Returns:
+        list: Messages
+    """
+    messages = []
+    current = ''
+    for line in lines:
+        line = line[:limit]
+        if current and len(current) + 1 + len(line) > limit:
+            messages.append(current)
+            current = ''
+        current = f'{current}\n{line}' if current else line
+    if current:
+        messages.append(current)
+    return messages
+
+
+def write_json_atomic(path, payload):
+    """
+    Write JSON to a file so readers never see a partial write.
+
+    Args:
+        path (str): File path
+        payload: JSON-serializable value
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(payload, f)
+    os.replace(tmp_path, path)
+
+
+async def previous_close(ticker, day):
+    """
+    Close of the session before `day`, from the shared grouped-daily snapshot.
+
+    The snapshot must have been fetched after `day` opened, so a split
+    taking effect today is reflected instead of alerting as a huge gap.
+
+    Args:
+        ticker (str): Stock ticker symbol
+        day (date): Session date
+
+    Returns:
+        float: Previous close, or None if the ticker did not trade
+    """
+    for back in range(1, 8):
+        previous = day - timedelta(days=back)
+        if previous.weekday() >= 5:
+            continue
+        snapshot = await get_daily_snapshot(previous, adjusted_for=day)
+        if len(snapshot):  # Market holidays have empty snapshots
+            bar = snapshot.get(ticker)
+            return bar['close'] if bar else None
+    return None
+
+
+class AlertEngine:
+    """
+    Every alert subscription, indexed by ticker and kind in sorted threshold books.
+
+    Streamed bars are queued by a listener and evaluated by one task, which
+    keeps each ticker's last price so price alerts fire only when a bar
+    crosses their level, not when price was already past it when they were
+    added. Triggered alerts are collected per channel for ALERT_DELIVERY_INTERVAL
+    seconds and sent as few messages as possible, through a token bucket
+    so a burst of triggers cannot trip Discord's rate limits. Subscriptions
+    are saved as JSON whenever they changed since the last delivery round.
+    """
+
+    def __init__(self, path=ALERTS_PATH):
+        self.path = path
+        self.alerts = {}
+        self.books = defaultdict(ThresholdBook)
+        self.per_ticker = Counter()
+        self.per_user = defaultdict(set)
+        self.by_key = {}
+        self.next_id = 1
+        self.fired = 0
+        self.delivered = 0
+        self.dirty = False
+        self.outbox = defaultdict(list)
+        self.limiter = RequestScheduler(ALERT_MESSAGES_PER_SECOND, ALERT_MESSAGE_BURST)
+        self._bars = asyncio.Queue()
+        self.last_price = {}
+        self._gap_checked = {}
+        self._tasks = []
+        self._saving = None
+
+    def load(self):
+        """Read saved subscriptions."""
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        for entry in saved['alerts']:
+            self._index(Alert(**entry))
+        self.next_id = max(saved.get('next_id', 1), max(self.alerts, default=0) + 1)
+
+    async def save(self):
+        """
+        Write the subscriptions to disk atomically, off the event loop.
+
+        The snapshot is taken on the loop, so later changes mark the engine
+        dirty again. Writes run one at a time and in order, and a write
+        survives the cancellation of the task that asked for it.
+        """
+        payload = {'next_id': self.next_id, 'alerts': [a.to_dict() for a in self.alerts.values()]}
+        self.dirty = False
+        previous = self._saving
+        self._saving = asyncio.ensure_future(self._write(previous, payload))
+        await asyncio.shield(self._saving)
+
+    async def _write(self, previous, payload):
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        try:
+            await run_io(write_json_atomic, self.path, payload)
+        except Exception as err:
+            self.dirty = True
+            print(f'Could not save alerts to {self.path}: {err}')
+
+    def _index(self, alert):
+        self.alerts[alert.id] = alert
+        self.by_key[alert.key] = alert.id
+        self.books[(alert.ticker, alert.kind)].add(alert.value, alert.id)
+        self.per_ticker[alert.ticker] += 1
+        self.per_user[alert.user_id].add(alert.id)
+
+    def _unindex(self, alert):
+        del self.alerts[alert.id]
+        del self.by_key[alert.key]
+        self.books[(alert.ticker, alert.kind)].remove(alert.value, alert.id)
+        self.per_ticker[alert.ticker] -= 1
+        if not self.per_ticker[alert.ticker]:
+            del self.per_ticker[alert.ticker]
+            self.last_price.pop(alert.ticker, None)  # Bars stop being evaluated, so it would go stale
+        self.per_user[alert.user_id].discard(alert.id)
+
+    def add(self, user_id, channel_id, guild_id, ticker, kind, value):
+        """
+        Subscribe a user to an alert.
+
+        Args:
+            user_id (int): Discord user to mention
+            channel_id (int): Channel the alert is delivered to
+            guild_id (int): Server the alert was created in
+            ticker (str): Stock ticker symbol
+            kind (str): One of ALERT_KINDS
+            value (float): Price level, or gap size in percent for gap alerts
+
+        Returns:
+            tuple: (Alert, whether it was created rather than already present)
+
+        Raises:
+            ValueError: Unknown kind, invalid value or the user's limit is reached
+        """
+        if kind not in ALERT_KINDS:
+            raise ValueError(f'Alert type must be one of {", ".join(ALERT_KINDS)}')
+        if not value > 0:
+            raise ValueError('The level must be a positive number')
+        ticker = ticker.upper()
+        existing = self.by_key.get((user_id, ticker, kind, value))
+        if existing is not None:
+            return self.alerts[existing], False
+        if len(self.per_user[user_id]) >= ALERTS_PER_USER:
+            raise ValueError(f'You already have {ALERTS_PER_USER} alerts, remove one first')
+
+        alert = Alert(self.next_id, user_id, channel_id, guild_id, ticker, kind, value)
+        self.next_id += 1
+        if ticker not in self.last_price:
+            # Record which side of the level price is on now (when the ticker is already streamed)
+            state = streaming.live_session(ticker, datetime.now(eastern).date())
+            if state is not None and state.last_price is not None:
+                self.last_price[ticker] = state.last_price
+        self._index(alert)
+        self.dirty = True
+        return alert, True
+
+    def remove(self, alert_id, user_id):
+        """
+        Delete one of a user's alerts.
+
+        Args:
+            alert_id (int): Alert number
+            user_id (int): User asking; only the owner may remove an alert
+
+        Returns:
+            Alert: The removed alert, or None if the user has no such alert
+        """
+        alert = self.alerts.get(alert_id)
+        if alert is None or alert.user_id != user_id:
+            return None
+        self._unindex(alert)
+        self.dirty = True
+        return alert
+
+    def for_user(self, user_id):
+        """A user's alerts, oldest first."""
+        return [self.alerts[alert_id] for alert_id in sorted(self.per_user[user_id])]
+
+    def on_bar(self, ticker, timestamp, minute, open, high, low, close):
+        """Streaming listener: queue bars of tickers that have alerts."""
+        if ticker in self.per_ticker:
+            self._bars.put_nowait((ticker, timestamp, minute, open, high, low, close))
+
+    async def evaluate(self, ticker, timestamp, minute, open, high, low, close):
+        """
+        Fire the alerts one bar triggers.
+
+        Args:
+            ticker (str): Stock ticker symbol
+            timestamp (int): Bar start, epoch milliseconds
+            minute (int): Eastern minute of day of the bar
+            open, high, low, close (float): Bar prices
+        """
+        day = datetime.fromtimestamp(timestamp / 1000, eastern).date()
+        # Price moved from the last known price (or this bar's open) to its high and low
+        start = self.last_price.get(ticker, open)
+        self.last_price[ticker] = close
+        for level, alert_id in self.books[(ticker, 'above')].crossed_up(start, high):
+            self._fire(self.alerts[alert_id], day, f'traded at ${high:,.2f}')
+        for level, alert_id in self.books[(ticker, 'below')].crossed_down(start, low):
+            self._fire(self.alerts[alert_id], day, f'traded at ${low:,.2f}')
+
+        # Gaps are judged once per session, on the first regular-session bar with the open known
+        has_gap_alerts = any(len(self.books[(ticker, kind)]) for kind in GAP_KINDS)
+        if minute < RTH_OPEN or not has_gap_alerts or self._gap_checked.get(ticker) == day:
+            return
+        state = streaming.live_session(ticker, day)
+        if state is None or state.rth.open is None:
+            return  # Not in the live state yet; retried on the next bar
+        prev_close = await previous_close(ticker, day)  # A failed request is retried on the next bar
+        self._gap_checked[ticker] = day
+        if not prev_close:
+            return
+        gap = (state.rth.open - prev_close) / prev_close * 100
+        detail = f'opened {gap:+.2f}% at ${state.rth.open:,.2f}'
+        for level, alert_id in self.books[(ticker, 'gap_up')].at_most(gap):
+            self._fire(self.alerts[alert_id], day, detail)
+        for level, alert_id in self.books[(ticker, 'gap_down')].at_most(-gap):
+            self._fire(self.alerts[alert_id], day, detail)
+
+    def _fire(self, alert, day, detail):
+        if alert.kind in GAP_KINDS:
+            if alert.last_fired == str(day):
+                return  # Already delivered this session, e.g. before a restart
+            alert.last_fired = str(day)
+        else:
+            self._unindex(alert)
+        self.dirty = True
+        self.fired += 1
+        self.outbox[alert.channel_id].append(f'<@{alert.user_id}> :bell: {alert.describe()}: {detail}')
+
+    async def _evaluate_bars(self):
+        while True:
+            bar = await self._bars.get()
+            try:
+                await self.evaluate(*bar)
+            except Exception as err:
+                print(f'Error evaluating alerts for {bar[0]}: {err}')
+
+    async def _deliver(self, deliver):
+        while True:
+            await asyncio.sleep(ALERT_DELIVERY_INTERVAL)
+            if self.dirty:
+                await self.save()
+            outbox, self.outbox = self.outbox, defaultdict(list)
+            for channel_id, lines in outbox.items():
+                for message in chunk_lines(lines):
+                    await self.limiter.acquire()
+                    try:
+                        await deliver(channel_id, message)
+                        self.delivered += 1
+                    except Exception as err:
+                        print(f'Could not deliver alerts to channel {channel_id}: {err}')
+
+    async def start(self, deliver):
+        """
+        Load subscriptions, stream their tickers and start evaluating and delivering.
+
+        Args:
+            deliver (callable): Coroutine function taking (channel_id, text)
+        """
+        if self._tasks:
+            return
+        self.load()
+        streaming.stream.add_listener(self.on_bar)
+        if self.per_ticker:
+            await streaming.follow(list(self.per_ticker))
+        self._tasks = [
+            asyncio.create_task(self._evaluate_bars()),
+            asyncio.create_task(self._deliver(deliver)),
+        ]
+
+    async def stop(self):
+        """Stop the engine, saving unsaved changes."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.dirty:
+            await self.save()
+        elif self._saving is not None:
+            await self._saving
+
+
+alert_engine = AlertEngine()
+metrics.register_gauge(
+    'alerts', 'Alert subscriptions, tickers with alerts, fired alerts and delivered messages',
+    lambda: [
+        ({'kind': 'subscriptions'}, len(alert_engine.alerts)),
+        ({'kind': 'tickers'}, len(alert_engine.per_ticker)),
+        ({'kind': 'fired'}, alert_engine.fired),
+        ({'kind': 'delivered'}, alert_engine.delivered),
+        ({'kind': 'queued_bars'}, alert_engine._bars.qsize()),
+    ]
+)
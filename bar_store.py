@@ -0,0 +1,316 @@
+"""
+Minute Bar Store Module
+On-disk store of minute bars for closed trading sessions, read before Polygon
+"""
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, date as d, time, timedelta
+import numpy as np
+from pytz import timezone
+from config import BAR_STORE_DIR, BAR_STORE_MAX_BYTES
+from polygon_client import get_client
+from singleflight import coalesce
+from metrics import metrics, span
+
+eastern = timezone('US/Eastern')
+
+# After-hours trading ends at 8:00 PM ET; bars are final after that
+SESSION_END = time(20, 0)
+
+# Regular trading hours end at 4:00 PM ET
+RTH_END = time(16, 0)
+
+# Column layout of stored bars (matches the Polygon client's field names)
+BAR_DTYPE = np.dtype([
+    ('timestamp', '<i8'),
+    ('open', '<f8'),
+    ('high', '<f8'),
+    ('low', '<f8'),
+    ('close', '<f8'),
+    ('volume', '<f8'),
+    ('vwap', '<f8'),
+    ('transactions', '<i8'),
+])
+
+
+def to_bar_array(bars):
+    """
+    Convert bars returned by the Polygon client to a structured NumPy array.
+
+    Args:
+        bars (list): Bars as dicts keyed by BAR_DTYPE field names
+
+    Returns:
+        np.ndarray: Array with dtype BAR_DTYPE
+    """
+    array = np.empty(len(bars), dtype=BAR_DTYPE)
+    for name in BAR_DTYPE.names:
+        fill = 0 if BAR_DTYPE[name].kind == 'i' else np.nan
+        array[name] = [fill if bar.get(name) is None else bar[name] for bar in bars]
+    return array
+
+
+def save_array(path, array):
+    """
+    Write a NumPy array atomically so readers never see a partial file.
+
+    Args:
+        path (str): Destination .npy path
+        array (np.ndarray): Array to write
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def is_session_closed(date, end=SESSION_END):
+    """
+    Check whether a trading day's extended session is over.
+
+    Args:
+        date (str | date): Date in YYYY-MM-DD format
+        end (time): Eastern time the session ends (RTH_END for regular hours)
+
+    Returns:
+        bool: True once no more bars can arrive for the date
+    """
+    if isinstance(date, str):
+        date = d.fromisoformat(date)
+    now = datetime.now(eastern)
+    return date < now.date() or (date == now.date() and now.time() >= end)
+
+
+def session_days(start, end):
+    """
+    Weekdays from start to end inclusive.
+
+    Args:
+        start (str | date): First date
+        end (str | date): Last date
+
+    Returns:
+        list: Dates as YYYY-MM-DD strings
+    """
+    day, end = d.fromisoformat(str(start)), d.fromisoformat(str(end))
+    days = []
+    while day <= end:
+        if day.weekday() < 5:
+            days.append(str(day))
+        day += timedelta(days=1)
+    return days
+
+
+def day_start_ms(day):
+    """Epoch milliseconds of midnight Eastern on a date."""
+    day = d.fromisoformat(str(day))
+    return int(eastern.localize(datetime(day.year, day.month, day.day)).timestamp() * 1000)
+
+
+class MinuteBarStore:
+    """
+    Minute bars partitioned as <root>/<TICKER>/<YYYY-MM-DD>.npy.
+
+    Files are memory-mapped on read. Total size is capped and the least
+    recently read days are evicted first; file mtimes record recency so the
+    order survives restarts.
+    """
+
+    def __init__(self, root=BAR_STORE_DIR, max_bytes=BAR_STORE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._index = OrderedDict()
+        self._size = 0
+        self._scan()
+
+    def _scan(self):
+        """Rebuild the LRU index from the files already on disk."""
+        if not os.path.isdir(self.root):
+            return
+        entries = []
+        for ticker in os.listdir(self.root):
+            folder = os.path.join(self.root, ticker)
+            if not os.path.isdir(folder):
+                continue
+            for name in os.listdir(folder):
+                if name.endswith('.npy'):
+                    stat = os.stat(os.path.join(folder, name))
+                    entries.append((stat.st_mtime, os.path.join(folder, name), stat.st_size))
+        for _, path, size in sorted(entries):
+            self._index[path] = size
+            self._size += size
+
+    def path(self, ticker, date):
+        """Return the file path holding a ticker's bars for a date."""
+        return os.path.join(self.root, ticker.upper(), f'{date}.npy')
+
+    def load(self, ticker, date, touch=True):
+        """
+        Read a stored day of bars.
+
+        Args:
+            ticker (str): Stock ticker symbol
+            date (str): Date in YYYY-MM-DD format
+            touch (bool): Mark the day as recently used
+
+        Returns:
+            np.ndarray: Memory-mapped bars, or None if the day is not stored
+        """
+        path = self.path(ticker, date)
+        try:
+            bars = np.load(path, mmap_mode='r')
+            if touch:
+                os.utime(path)
+        except (FileNotFoundError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        if not touch:
+            return bars
+        with self._lock:
+            if path in self._index:
+                self._index.move_to_end(path)
+        return bars
+
+    def save(self, ticker, date, bars):
+        """
+        Store a day of bars, evicting the least recently used days if needed.
+
+        Args:
+            ticker (str): Stock ticker symbol
+            date (str): Date in YYYY-MM-DD format
+            bars (np.ndarray): Bars with dtype BAR_DTYPE
+        """
+        path = self.path(ticker, date)
+        save_array(path, bars)
+        size = os.path.getsize(path)
+
+        with self._lock:
+            self._size += size - self._index.pop(path, 0)
+            self._index[path] = size
+            while self._size > self.max_bytes and len(self._index) > 1:
+                old_path, old_size = self._index.popitem(last=False)
+                self._size -= old_size
+                try:
+                    os.remove(old_path)
+                except FileNotFoundError:
+                    pass
+
+
+_store = None
+_live_source = None
+
+
+def set_live_source(source):
+    """
+    Serve sessions still in progress from a live feed instead of Polygon's REST API.
+
+    Args:
+        source (callable): Takes (ticker, date) and returns bars with dtype
+            BAR_DTYPE, or None when the feed does not cover them
+    """
+    global _live_source
+    _live_source = source
+
+
+def get_store():
+    """
+    Return the process-wide minute bar store, creating it on first use.
+
+    Returns:
+        MinuteBarStore: Shared store instance
+    """
+    global _store
+    if _store is None:
+        _store = MinuteBarStore()
+    return _store
+
+
+@coalesce('minute_bars')
+async def get_minute_bars(ticker, date, save=True):
+    """
+    Get a day of minute bars, reading the local store before Polygon.
+
+    Days whose session has closed are saved after the first download, so
+    later requests for them never reach the API. A session in progress is
+    read from the live feed when one covers the ticker (see streaming.py).
+    Bulk scans pass save=False so one-off days neither enter the store nor
+    refresh stored days, and cannot evict the days interactive commands reuse.
+
+    Args:
+        ticker (str): Stock ticker symbol
+        date (str | date): Date in YYYY-MM-DD format
+        save (bool): Store a downloaded closed day and mark stored days as used
+
+    Returns:
+        np.ndarray: Bars with dtype BAR_DTYPE
+    """
+    date = str(date)
+    store = get_store()
+    with span('fetch'):
+        bars = store.load(ticker, date, touch=save)
+        if bars is not None:
+            return bars
+        if _live_source is not None and not is_session_closed(date):
+            bars = _live_source(ticker, date)
+            if bars is not None:
+                return bars
+
+        bars = to_bar_array(await get_client().get_aggs(ticker, 1, "minute", date, date))
+        if save and len(bars) and is_session_closed(date):
+            store.save(ticker, date, bars)
+        return bars
+
+
+@coalesce('minute_bar_range')
+async def get_minute_bar_range(ticker, start, end):
+    """
+    Get minute bars for every session from start to end with at most one request.
+
+    Stored days are read locally. The days that are not stored are covered by
+    one paginated request, split at Eastern midnight and saved if closed.
+    A closed weekday with no bars in a response that has bars for other days
+    is a market holiday and is saved empty, so it is not requested again.
+
+    Args:
+        ticker (str): Stock ticker symbol
+        start (str | date): First date (YYYY-MM-DD)
+        end (str | date): Last date (YYYY-MM-DD)
+
+    Returns:
+        np.ndarray: Bars with dtype BAR_DTYPE, oldest first
+    """
+    days = session_days(start, end)
+    store = get_store()
+    with span('fetch'):
+        by_day = {day: store.load(ticker, day) for day in days}
+        missing = [day for day, bars in by_day.items() if bars is None]
+        if missing:
+            fetched = to_bar_array(await get_client().get_aggs(ticker, 1, "minute", missing[0], missing[-1]))
+            starts = np.searchsorted(fetched['timestamp'], [day_start_ms(day) for day in missing])
+            stops = np.searchsorted(fetched['timestamp'], [
+                day_start_ms(d.fromisoformat(day) + timedelta(days=1)) for day in missing
+            ])
+            for day, lo, hi in zip(missing, starts, stops):
+                bars = fetched[lo:hi]
+                if is_session_closed(day) and (len(bars) or len(fetched)):
+                    store.save(ticker, day, bars)
+                by_day[day] = bars
+
+    if not days:
+        return np.empty(0, dtype=BAR_DTYPE)
+    return np.concatenate([by_day[day] for day in days])
+
+
+def store_hits():
+    """Minute bar store (hits, misses) since startup."""
+    store = get_store()
+    return store.hits, store.misses
+
+
+metrics.register_cache('minute_bars', store_hits)
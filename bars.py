@@ -0,0 +1,278 @@
+"""
+Bars Module
+Array-backed minute bars indexed by integer minute of the Eastern trading day
+"""
+from datetime import datetime
+import numpy as np
+from bar_store import eastern, is_session_closed, RTH_END
+
+# Session boundaries in minutes after midnight ET
+RTH_OPEN = 570    # 09:30
+RTH_CLOSE = 960   # 16:00
+
+# Shift applied before bucketing epoch minutes into Eastern days; anything
+# between 4:00 AM and 8:00 PM ET lands on the right day under either offset
+_DAY_SHIFT_MINUTES = 5 * 60
+
+
+def eastern_offset_minutes(timestamp_ms):
+    """Return the Eastern UTC offset, in minutes, at an epoch-ms timestamp."""
+    offset = datetime.fromtimestamp(timestamp_ms / 1000, eastern).utcoffset()
+    return int(offset.total_seconds() // 60)
+
+
+def eastern_minutes(timestamps):
+    """
+    Convert epoch-ms timestamps to Eastern minutes since the epoch.
+
+    The UTC offset only changes overnight, so it is looked up once per day
+    rather than once per bar.
+
+    Args:
+        timestamps (np.ndarray): Epoch milliseconds, ascending
+
+    Returns:
+        np.ndarray: int64 local minutes since 1970-01-01 00:00 ET
+    """
+    minutes = np.asarray(timestamps, dtype=np.int64) // 60000
+    if not len(minutes):
+        return minutes
+    _, first, inverse = np.unique(
+        (minutes - _DAY_SHIFT_MINUTES) // 1440, return_index=True, return_inverse=True
+    )
+    offsets = np.array([eastern_offset_minutes(timestamps[i]) for i in first], dtype=np.int64)
+    return minutes + offsets[inverse]
+
+
+def parse_minute(value):
+    """
+    Parse 'HH:MM' (or 'HH:MM:SS') into minutes after midnight.
+
+    Args:
+        value (str): Clock time
+
+    Returns:
+        int: Minute of day
+    """
+    parts = value.split(':')
+    return int(parts[0]) * 60 + int(parts[1])
+
+
+class MinuteBars:
+    """
+    Column arrays for a run of minute bars, sorted by time.
+
+    `minute` is the int32 Eastern minute of day and `day` the int32 Eastern
+    session date (days since the epoch), so session splits and time-range
+    filters are integer comparisons and binary searches rather than string
+    label lookups. Slicing returns views, not copies.
+    """
+
+    __slots__ = ('timestamp', 'day', 'minute', 'open', 'high', 'low', 'close', 'volume')
+
+    def __init__(self, timestamp, day, minute, open, high, low, close, volume):
+        self.timestamp = timestamp
+        self.day = day
+        self.minute = minute
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+
+    @classmethod
+    def from_records(cls, bars):
+        """
+        Build from a structured array (or anything indexable by column name).
+
+        Args:
+            bars (np.ndarray): Bars with timestamp/open/high/low/close/volume fields
+
+        Returns:
+            MinuteBars: Column view of the bars
+        """
+        local = eastern_minutes(bars['timestamp'])
+        return cls(
+            np.asarray(bars['timestamp']),
+            (local // 1440).astype(np.int32),
+            (local % 1440).astype(np.int32),
+            np.asarray(bars['open']),
+            np.asarray(bars['high']),
+            np.asarray(bars['low']),
+            np.asarray(bars['close']),
+            np.asarray(bars['volume']),
+        )
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def __getitem__(self, index):
+        return MinuteBars(*(getattr(self, name)[index] for name in self.__slots__))
+
+    @property
+    def nbytes(self):
+        """Bytes held by the column arrays."""
+        return sum(getattr(self, name).nbytes for name in self.__slots__)
+
+    def between(self, start, end):
+        """
+        Bars of a single session from start to end, both inclusive.
+
+        Args:
+            start (int | str): Minute of day or 'HH:MM'
+            end (int | str): Minute of day or 'HH:MM'
+
+        Returns:
+            MinuteBars: View of the matching bars
+        """
+        if isinstance(start, str):
+            start = parse_minute(start)
+        if isinstance(end, str):
+            end = parse_minute(end)
+        lo = np.searchsorted(self.minute, start, side='left')
+        hi = np.searchsorted(self.minute, end, side='right')
+        return self[lo:hi]
+
+    def local_times(self):
+        """Bar start times as naive Eastern datetime64 values (for chart axes)."""
+        local = self.day.astype(np.int64) * 1440 + self.minute
+        return local.astype('datetime64[m]')
+
+    def time_label(self, index):
+        """Format a bar's start time as 'YYYY-MM-DD HH:MM:SS-05:00'."""
+        return datetime.fromtimestamp(self.timestamp[index] / 1000, eastern).isoformat(sep=' ')
+
+    def day_bounds(self):
+        """
+        Index ranges of each session date.
+
+        Returns:
+            tuple: (dates as datetime64[D], start indices, stop indices)
+        """
+        if not len(self):
+            return np.array([], dtype='datetime64[D]'), np.array([], int), np.array([], int)
+        starts = np.flatnonzero(np.r_[True, self.day[1:] != self.day[:-1]])
+        stops = np.r_[starts[1:], len(self)]
+        return self.day[starts].astype('datetime64[D]'), starts, stops
+
+    def session_ranges(self, start, stop):
+        """
+        Per-day index ranges of bars with start <= minute < stop.
+
+        One binary search over the (day, minute) key covers every day at once.
+
+        Args:
+            start (int): First minute of day to include
+            stop (int): Minute of day to stop before
+
+        Returns:
+            tuple: (start indices, stop indices), one entry per session date
+        """
+        _, day_starts, _ = self.day_bounds()
+        key = self.day.astype(np.int64) * 1440 + self.minute
+        day_keys = self.day[day_starts].astype(np.int64) * 1440
+        return np.searchsorted(key, day_keys + start), np.searchsorted(key, day_keys + stop)
+
+
+def segment_stats(bars, starts, stops):
+    """
+    OHLCV plus first high/low positions for many [start, stop) segments at once.
+
+    Args:
+        bars (MinuteBars): Source bars
+        starts (np.ndarray): Segment start indices
+        stops (np.ndarray): Segment stop indices (exclusive)
+
+    Returns:
+        dict: Arrays keyed by open/high/low/close/volume/high_index/low_index;
+        empty segments hold NaN (prices, volume) or -1 (indices)
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    counts = np.asarray(stops, dtype=np.int64) - starts
+    k = len(starts)
+    stats = {name: np.full(k, np.nan) for name in ('open', 'high', 'low', 'close', 'volume')}
+    stats['high_index'] = np.full(k, -1, dtype=np.int64)
+    stats['low_index'] = np.full(k, -1, dtype=np.int64)
+
+    filled = np.flatnonzero(counts > 0)
+    if not len(filled):
+        return stats
+    starts, counts = starts[filled], counts[filled]
+
+    # Gather the segments into one contiguous run so every reduction is a single reduceat
+    offsets = np.r_[0, np.cumsum(counts)[:-1]]
+    index = np.arange(counts.sum()) + np.repeat(starts - offsets, counts)
+    segment = np.repeat(np.arange(len(starts)), counts)
+    high, low = bars.high[index], bars.low[index]
+
+    seg_high = np.maximum.reduceat(high, offsets)
+    seg_low = np.minimum.reduceat(low, offsets)
+    at_high = np.flatnonzero(high == seg_high[segment])
+    at_low = np.flatnonzero(low == seg_low[segment])
+
+    stats['open'][filled] = bars.open[starts]
+    stats['close'][filled] = bars.close[starts + counts - 1]
+    stats['high'][filled] = seg_high
+    stats['low'][filled] = seg_low
+    stats['volume'][filled] = np.add.reduceat(bars.volume[index], offsets)
+    stats['high_index'][filled] = index[at_high[np.unique(segment[at_high], return_index=True)[1]]]
+    stats['low_index'][filled] = index[at_low[np.unique(segment[at_low], return_index=True)[1]]]
+    return stats
+
+
+def summarize_sessions(bars):
+    """
+    Build one premarket/regular/after-hours summary per session date in one pass.
+
+    Args:
+        bars (MinuteBars): Bars covering one or more session dates
+
+    Returns:
+        list: (date, summary) pairs; summary is None when the regular session
+        has not closed yet by the clock, or had no trades
+    """
+    dates, day_starts, day_stops = bars.day_bounds()
+    if not len(dates):
+        return []
+
+    # Split every day at 09:30 and 16:00
+    rth_starts, ah_starts = bars.session_ranges(RTH_OPEN, RTH_CLOSE)
+
+    starts = np.concatenate([day_starts, rth_starts, ah_starts])
+    stops = np.concatenate([rth_starts, ah_starts, day_stops])
+    stats = segment_stats(bars, starts, stops)
+
+    n = len(dates)
+    pm, rth, ah = slice(0, n), slice(n, 2 * n), slice(2 * n, 3 * n)
+    # Polygon omits minutes without trades, so an illiquid ticker may have no 15:59 bar
+    closed = (ah_starts > rth_starts) & np.array([is_session_closed(str(date), RTH_END) for date in dates])
+
+    def extended(prefix, part, i):
+        if stats['high_index'][part][i] < 0:
+            return {f'{prefix} {name}': None for name in ('high', 'low', 'volume', 'high time', 'low time')}
+        return {
+            f'{prefix} high': stats['high'][part][i],
+            f'{prefix} low': stats['low'][part][i],
+            f'{prefix} volume': stats['volume'][part][i],
+            f'{prefix} high time': bars.time_label(stats['high_index'][part][i]),
+            f'{prefix} low time': bars.time_label(stats['low_index'][part][i]),
+        }
+
+    summaries = []
+    for i in range(n):
+        if not closed[i]:
+            summaries.append((dates[i], None))
+            continue
+        summary = {
+            'open': stats['open'][rth][i],
+            'close': stats['close'][rth][i],
+            'high': stats['high'][rth][i],
+            'low': stats['low'][rth][i],
+            'high time': bars.time_label(stats['high_index'][rth][i]),
+            'low time': bars.time_label(stats['low_index'][rth][i]),
+            'rth volume': stats['volume'][rth][i],
+        }
+        summary.update(extended('pm', pm, i))
+        summary.update(extended('ah', ah, i))
+        summaries.append((dates[i], summary))
+    return summaries
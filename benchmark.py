@@ -0,0 +1,360 @@
+"""
+Benchmark Module
+Offline latency, throughput and memory benchmarks against a local fake Polygon server
+
+Usage:
+    python benchmark.py [--iterations 20] [--concurrency 4] [--only NAME ...]
+                        [--latency MS] [--fixtures DIR] [--json PATH] [--workers N]
+
+Each scenario runs a data function or a slash-command handler (through a
+fake Discord context) against fake_polygon.py, started in a subprocess on a
+free port. Minute bars and daily history go to a temporary directory, so
+every run starts cold unless --tickers makes iterations repeat tickers.
+With --workers N the slash commands' jobs run on N `worker.py` processes
+behind the bot's job queue instead of in the benchmark process.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+import aiohttp
+import numpy as np
+from pytz import timezone
+from tabulate import tabulate
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Guilds the fake contexts rotate through, so per-guild fairness is exercised
+BENCHMARK_GUILDS = [1, 2, 3, 4]
+
+
+class FakeContext:
+    """Stand-in for a slash-command context that records what the bot replies."""
+
+    def __init__(self, guild_id):
+        self.guild_id = guild_id
+        self.messages = []
+        self.uploads = []
+
+    async def defer(self, *args, **kwargs):
+        pass
+
+    async def respond(self, content=None, *, file=None, **kwargs):
+        if content is not None:
+            self.messages.append(content)
+        if file is not None:
+            self.uploads.append(file.fp.getbuffer().nbytes)
+
+    send = respond
+
+
+class Scenario:
+    """
+    One benchmarked operation.
+
+    Args:
+        name (str): Name shown in the report
+        run (callable): Coroutine function taking (ctx, ticker)
+        check (callable): Takes (ctx, result) and says whether the run succeeded
+    """
+
+    def __init__(self, name, run, check):
+        self.name = name
+        self.run = run
+        self.check = check
+
+
+def uploaded(ctx, result):
+    return bool(ctx.uploads)
+
+
+def replied(text):
+    return lambda ctx, result: any(text in message for message in ctx.messages)
+
+
+async def chart_timeframes(bot_module, ctx, ticker, date):
+    """Chart one ticker at 5-minute, 15-minute, 1-hour and daily bars, as a user flipping timeframes would."""
+    for timeframe, unit in (('minute', '5'), ('minute', '15'), ('hour', '1'), ('day', '1')):
+        await bot_module.chart.callback(ctx, ticker, timeframe, unit, date, None)
+
+
+def build_scenarios(bot_module, date, gap_percent):
+    """
+    Scenarios covering the data functions and every slash-command handler.
+
+    Args:
+        bot_module (module): The imported main module
+        date (str): Closed session date (YYYY-MM-DD)
+        gap_percent (int): Gap threshold for the gap statistics scenarios
+
+    Returns:
+        list: Scenario objects
+    """
+    from stock_data import get_ticker_data, get_ticker_range_data
+    from gap_data import get_gap_data
+    from candle_chart import make_candle_chart, make_daily_candle_chart, timespan_candle_chart
+
+    # Stays inside the bot's MAX_DAYS_HISTORICAL window after a weekend
+    week_start = str(datetime.fromisoformat(date).date() - timedelta(days=4))
+    return [
+        Scenario('get_ticker_data',
+                 lambda ctx, t: get_ticker_data(t, date),
+                 lambda ctx, result: not result.empty),
+        Scenario('get_ticker_range_data',
+                 lambda ctx, t: get_ticker_range_data(t, week_start, date),
+                 lambda ctx, result: len(result) > 1),
+        Scenario('get_gap_data',
+                 lambda ctx, t: get_gap_data(t, gap_percent),
+                 lambda ctx, result: result is not None),
+        Scenario('make_candle_chart',
+                 lambda ctx, t: make_candle_chart(t, date, '09:30', '11:00'),
+                 lambda ctx, result: bool(result)),
+        Scenario('make_daily_candle_chart',
+                 lambda ctx, t: make_daily_candle_chart(t, date),
+                 lambda ctx, result: bool(result)),
+        Scenario('timespan_candle_chart',
+                 lambda ctx, t: timespan_candle_chart(t, 5, 'minute', date),
+                 lambda ctx, result: bool(result)),
+        Scenario('/stock_data',
+                 lambda ctx, t: bot_module.stock_data.callback(ctx, t, date, None),
+                 uploaded),
+        Scenario('/stock_data range',
+                 lambda ctx, t: bot_module.stock_data.callback(ctx, t, week_start, date),
+                 uploaded),
+        Scenario('/timerange_candle_stick_chart',
+                 lambda ctx, t: bot_module.timerange_candle_stick_chart.callback(ctx, t, '09:30', '11:00', date),
+                 uploaded),
+        Scenario('/daily_candle_stick_chart',
+                 lambda ctx, t: bot_module.daily_candle_stick_chart.callback(ctx, t, date),
+                 uploaded),
+        Scenario('/chart',
+                 lambda ctx, t: bot_module.chart.callback(ctx, t, 'minute', '5', date, None),
+                 uploaded),
+        Scenario('/chart more_data',
+                 lambda ctx, t: bot_module.chart.callback(ctx, t, 'minute', '1', date, 'yes'),
+                 uploaded),
+        Scenario('/chart timeframes',
+                 lambda ctx, t: chart_timeframes(bot_module, ctx, t, date),
+                 lambda ctx, result: len(ctx.uploads) == 4),
+        Scenario('/gap_stats',
+                 lambda ctx, t: bot_module.gap_stats.callback(ctx, t, str(gap_percent)),
+                 replied('Avg. HOD')),
+        Scenario('/gap_screen',
+                 lambda ctx, t: bot_module.gap_screen.callback(ctx, gap_percent, 5, 'up'),
+                 lambda ctx, result: any('```' in message for message in ctx.messages) or bool(ctx.uploads)),
+    ]
+
+
+def last_closed_session():
+    """Most recent weekday before today in New York."""
+    day = datetime.now(timezone('US/Eastern')).date() - timedelta(days=1)
+    while day.weekday() >= 5:
+        day -= timedelta(days=1)
+    return str(day)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def upstream_stats(session, base_url):
+    async with session.get(f'{base_url}/_stats') as response:
+        return await response.json()
+
+
+async def start_fake_polygon(args):
+    """
+    Launch fake_polygon.py in a subprocess and wait until it answers.
+
+    Returns:
+        tuple: (subprocess.Popen, base URL)
+    """
+    port = free_port()
+    command = [sys.executable, os.path.join(HERE, 'fake_polygon.py'), 'serve',
+               '--port', str(port), '--latency', str(args.latency)]
+    if args.fixtures:
+        command += ['--fixtures', args.fixtures]
+    server = subprocess.Popen(command)
+    base_url = f'http://127.0.0.1:{port}'
+
+    async with aiohttp.ClientSession() as session:
+        for _ in range(100):
+            try:
+                await upstream_stats(session, base_url)
+                return server, base_url
+            except aiohttp.ClientConnectionError:
+                await asyncio.sleep(0.1)
+    server.terminate()
+    raise RuntimeError('fake Polygon server did not start')
+
+
+async def run_once(scenario, iteration, ticker):
+    """Run one iteration and return (seconds, succeeded, bytes uploaded)."""
+    ctx = FakeContext(BENCHMARK_GUILDS[iteration % len(BENCHMARK_GUILDS)])
+    started = time.perf_counter()
+    try:
+        result = await scenario.run(ctx, ticker)
+        ok = scenario.check(ctx, result)
+    except Exception as err:
+        print(f'{scenario.name} #{iteration} failed: {type(err).__name__}: {err}')
+        ok = False
+    return time.perf_counter() - started, ok, sum(ctx.uploads)
+
+
+async def run_scenario(scenario, prefix, args):
+    """
+    Run a scenario args.iterations times, at most args.concurrency at once.
+
+    Every iteration is its own task so the handlers' context variables
+    (current guild, request priority) do not leak between iterations.
+
+    Returns:
+        tuple: (latencies in seconds, failures, bytes uploaded, wall seconds)
+    """
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited(iteration):
+        async with semaphore:
+            return await run_once(scenario, iteration, f'{prefix}{iteration % args.tickers}')
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*[asyncio.create_task(limited(i)) for i in range(args.iterations)])
+    wall = time.perf_counter() - started
+    latencies = [seconds for seconds, _, _ in results]
+    failures = sum(not ok for _, ok, _ in results)
+    return latencies, failures, sum(size for _, _, size in results), wall
+
+
+async def measure(scenario, prefix, args, session, base_url):
+    """
+    Run one scenario and summarize it.
+
+    Returns:
+        dict: Latency percentiles, throughput, upstream traffic and peak memory
+    """
+    before = await upstream_stats(session, base_url)
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    latencies, failures, upload_bytes, wall = await run_scenario(scenario, prefix, args)
+    peak = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else None
+    after = await upstream_stats(session, base_url)
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {
+        'command': scenario.name,
+        'runs': len(latencies),
+        'errors': failures,
+        'p50_ms': round(p50, 1),
+        'p95_ms': round(p95, 1),
+        'p99_ms': round(p99, 1),
+        'throughput_per_s': round(len(latencies) / wall, 2),
+        'upstream_calls': after['requests'] - before['requests'],
+        'upstream_mb': round((after['bytes'] - before['bytes']) / 1e6, 2),
+        'uploaded_kb': round(upload_bytes / 1e3, 1),
+        'peak_mb': round(peak / 1e6, 1) if peak is not None else None,
+    }
+
+
+async def benchmark(args):
+    server, base_url = await start_fake_polygon(args)
+    data_dir = tempfile.TemporaryDirectory(prefix='stockbot-bench-')
+    rows = []
+    date = args.date or last_closed_session()
+    try:
+        # config.py reads the environment at import time, so set it before importing the bot
+        os.environ['POLYGON_BASE_URL'] = base_url
+        os.environ.setdefault('POLYGON_API_KEY', 'benchmark')
+        os.environ['BAR_STORE_DIR'] = os.path.join(data_dir.name, 'minute_bars')
+        os.environ['DAILY_HISTORY_DIR'] = os.path.join(data_dir.name, 'daily')
+        os.environ['DAILY_SNAPSHOT_DIR'] = os.path.join(data_dir.name, 'snapshots')
+        os.environ['GAP_INDEX_PATH'] = os.path.join(data_dir.name, 'gap_index.npy')
+        os.environ['REFERENCE_CACHE_PATH'] = os.path.join(data_dir.name, 'reference.json')
+        if args.workers:
+            os.environ['JOB_QUEUE_ADDRESS'] = f'127.0.0.1:{free_port()}'
+            os.environ['JOB_QUEUE_AUTHKEY'] = secrets.token_hex(16)
+        bot_module = importlib.import_module('main')
+        import jobs
+        from polygon_client import close_client
+        from candle_chart import make_daily_candle_chart
+
+        scenarios = build_scenarios(bot_module, date, args.gap_percent)
+        if args.only:
+            scenarios = [scenario for scenario in scenarios if scenario.name.strip('/') in args.only]
+
+        jobs.start()
+        workers = []
+        try:
+            # Bring the render workers up before anything is timed
+            await make_daily_candle_chart('WARMUP', date)
+            if args.workers:
+                worker = importlib.import_module('worker')
+                worker.start_dispatcher()
+                workers = [subprocess.Popen([sys.executable, os.path.join(HERE, 'worker.py')])
+                           for _ in range(args.workers)]
+                await asyncio.gather(*[worker.run_job('daily_candle_chart', f'WARMUP{i}', date)
+                                       for i in range(args.workers * 4)])
+            if not args.no_memory:
+                tracemalloc.start()
+            async with aiohttp.ClientSession() as session:
+                for index, scenario in enumerate(scenarios):
+                    rows.append(await measure(scenario, f'S{index}T', args, session, base_url))
+        finally:
+            tracemalloc.stop()
+            # Let fetches still in flight (e.g. background HOD/LOD lookups) finish before closing the client
+            importlib.import_module('gap_index').stop_extreme_minutes()
+            background = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            await asyncio.gather(*background, return_exceptions=True)
+            for process in workers:
+                process.terminate()
+                process.wait()
+            if args.workers:
+                importlib.import_module('worker').stop_dispatcher()
+            await close_client()
+            jobs.shutdown()
+    finally:
+        server.terminate()
+        server.wait()
+        data_dir.cleanup()
+
+    print(f'\nsession {date}, {args.iterations} iterations, concurrency {args.concurrency}, '
+          f'upstream latency {args.latency} ms')
+    print(tabulate(rows, headers='keys', tablefmt='github'))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'date': date, 'args': vars(args), 'results': rows}, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the bot against a local fake Polygon server')
+    parser.add_argument('--iterations', type=int, default=20, help='Runs per scenario')
+    parser.add_argument('--concurrency', type=int, default=4, help='Runs in flight at once')
+    parser.add_argument('--tickers', type=int, default=1_000_000,
+                        help='Distinct tickers per scenario (fewer than iterations exercises caches)')
+    parser.add_argument('--only', nargs='+', help='Scenario names to run (leading / optional)')
+    parser.add_argument('--date', help='Session date (default: last weekday)')
+    parser.add_argument('--gap-percent', type=int, default=5, help='Threshold for the gap scenarios')
+    parser.add_argument('--latency', type=float, default=0.0, help='Simulated upstream latency (ms)')
+    parser.add_argument('--fixtures', help='Directory of recorded Polygon responses')
+    parser.add_argument('--no-memory', action='store_true', help='Skip tracemalloc (lower overhead)')
+    parser.add_argument('--json', help='Write results to this file for later comparison')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Run slash-command jobs on this many worker.py processes (default: in process)')
+    args = parser.parse_args()
+    if args.only:
+        args.only = [name.strip('/') for name in args.only]
+    asyncio.run(benchmark(args))
+
+
+if __name__ == '__main__':
+    main()
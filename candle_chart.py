@@ -2,54 +2,87 @@
 Candlestick Chart Module
 Generates candlestick charts using Plotly and Polygon.io data
 """
-from polygon import RESTClient
-import pandas as pd
-import plotly.graph_objects as go
-import plotly.io as pio
-from plotly.subplots import make_subplots
-from datetime import time, datetime, timedelta
-from config import POLYGON_API_KEY, CHART_OUTPUT_FILE, DAILY_CHART_OUTPUT_FILE
-
-# Configure Kaleido for chart rendering
-pio.kaleido.scope.chromium_args = tuple(
-    [arg for arg in pio.kaleido.scope.chromium_args if arg != "--disable-dev-shm-usage"]
-)
-
-
-def multiple_timestamp_to_time(df):
+from config import CHART_WIDTH, CHART_HEIGHT
+from bar_store import get_minute_bars
+from bars import MinuteBars, RTH_OPEN, RTH_CLOSE
+from resample import get_chart_bars, fit_bars
+from jobs import run_cpu
+from renderer import render_figure
+from chart_cache import chart_key, cached_chart
+from singleflight import coalesce
+from metrics import span, timed
+
+
+@coalesce('chart_data')
+async def get_data(ticker, date):
     """
-    Convert Unix timestamps to Eastern Time and create time indices.
+    Fetch minute-level stock data for charting.
 
     Args:
-        df (pd.DataFrame): DataFrame with 'timestamp' column in Unix milliseconds
+        ticker (str): Stock ticker symbol
+        date (str): Date in YYYY-MM-DD format
+
+    Returns:
+        MinuteBars: Minute-level OHLCV data
     """
-    df.timestamp = pd.to_datetime(df.timestamp, unit='ms').dt.tz_localize('UTC').dt.tz_convert('US/Eastern')
-    df['t_index_only'] = df.timestamp.dt.time
-    df.timestamp = df.timestamp.astype(str)
-    df.t_index_only = df.t_index_only.astype(str)
-    df['timestamp_idx'] = df.t_index_only
-    df.set_index('timestamp_idx', inplace=True)
+    minute_aggs = await get_minute_bars(ticker, date)
+    with span('transform'):
+        return MinuteBars.from_records(minute_aggs)
 
 
-def get_data(ticker, date):
+def minute_chart_bars(ticker, date, minute_data):
     """
-    Fetch minute-level stock data for charting.
+    Fit a day's minute bars to the chart width and title the chart with the bar size.
+
+    Charts never carry more candles than the image is pixels wide; longer
+    ranges use the smallest standard bar size that fits (see resample.fit_bars),
+    so render time and payload stay flat.
 
     Args:
         ticker (str): Stock ticker symbol
         date (str): Date in YYYY-MM-DD format
+        minute_data (MinuteBars): Minute bars to plot
 
     Returns:
-        pd.DataFrame: Minute-level OHLCV data
+        tuple: (title, bars)
+    """
+    bars, multiplier, timespan = fit_bars(minute_data, 1, 'minute', CHART_WIDTH)
+    if multiplier == 1 and timespan == 'minute':
+        return f'{ticker} - {date}', bars
+    return f'{ticker} - {date} ({multiplier} {timespan})', bars
+
+
+def chart_spec(layout, title, bars):
     """
-    client = RESTClient(POLYGON_API_KEY)
-    aggs = client.get_aggs(ticker, 1, "minute", date, date)
-    minute_data = pd.DataFrame(aggs)
-    multiple_timestamp_to_time(minute_data)
-    return minute_data
+    Build the figure spec shipped to the render workers.
 
+    Args:
+        layout (str): 'candle_volume' (candles over volume) or 'candle'
+        title (str): Chart title
+        bars (MinuteBars): Bars to plot
 
-def make_candle_chart(ticker, date, time1, time2):
+    Returns:
+        dict: Spec accepted by renderer.render_figure
+    """
+    return {
+        'layout': layout,
+        'title': title,
+        'format': 'jpeg',
+        'width': CHART_WIDTH,
+        'height': CHART_HEIGHT,
+        'data': {
+            'timestamp': bars.local_times(),
+            'open': bars.open,
+            'high': bars.high,
+            'low': bars.low,
+            'close': bars.close,
+            'volume': bars.volume,
+        },
+    }
+
+
+@timed('make_candle_chart')
+async def make_candle_chart(ticker, date, time1, time2):
     """
     Create candlestick chart for a specific time range.
 
@@ -58,112 +91,73 @@ def make_candle_chart(ticker, date, time1, time2):
         date (str): Date in YYYY-MM-DD format
         time1 (str): Start time in HH:MM format
         time2 (str): End time in HH:MM format
+
+    Returns:
+        bytes: JPEG image
     """
-    minute_data = get_data(ticker, date)
-    data = minute_data.loc[time1:time2]
-
-    # Create candlestick and volume subplot
-    fig = make_subplots(
-        rows=2, cols=1,
-        shared_xaxes=True,
-        vertical_spacing=0.03,
-        subplot_titles=(f'{ticker} - {date}', 'Volume'),
-        row_width=[0.2, 0.7]
-    )
-
-    # Add candlestick chart
-    fig.add_trace(
-        go.Candlestick(
-            x=data['timestamp'],
-            open=data['open'],
-            high=data['high'],
-            low=data['low'],
-            close=data['close'],
-            name='OHLC'
-        ),
-        row=1, col=1
-    )
-
-    # Add volume bars
-    fig.add_trace(
-        go.Bar(x=data['timestamp'], y=data['volume'], name='Volume'),
-        row=2, col=1
-    )
-
-    # Update layout
-    fig.update(layout_xaxis_rangeslider_visible=False)
-    fig.write_image(CHART_OUTPUT_FILE)
-
-
-def make_daily_candle_chart(ticker, date):
+    async def render():
+        minute_data = await get_data(ticker, date)
+        with span('transform'):
+            title, bars = minute_chart_bars(ticker, date, minute_data.between(time1, time2))
+        spec = chart_spec('candle_volume', title, bars)
+        return await run_cpu(render_figure, spec)
+
+    return await cached_chart(chart_key('range', ticker, date, (time1, time2)), date, render)
+
+
+@timed('make_daily_candle_chart')
+async def make_daily_candle_chart(ticker, date):
     """
     Create full-day candlestick chart (9:30 AM - 4:00 PM ET).
 
     Args:
         ticker (str): Stock ticker symbol
         date (str): Date in YYYY-MM-DD format
+
+    Returns:
+        bytes: JPEG image
     """
-    minute_data = get_data(ticker, date)
-    data = minute_data.loc['09:30:00':'16:00:00']
-
-    # Create candlestick and volume subplot
-    fig = make_subplots(
-        rows=2, cols=1,
-        shared_xaxes=True,
-        vertical_spacing=0.03,
-        subplot_titles=(f'{ticker} - {date}', 'Volume'),
-        row_width=[0.2, 0.7]
-    )
-
-    # Add candlestick chart
-    fig.add_trace(
-        go.Candlestick(
-            x=data['timestamp'],
-            open=data['open'],
-            high=data['high'],
-            low=data['low'],
-            close=data['close'],
-            name='OHLC'
-        ),
-        row=1, col=1
-    )
-
-    # Add volume bars
-    fig.add_trace(
-        go.Bar(x=data['timestamp'], y=data['volume'], name='Volume'),
-        row=2, col=1
-    )
-
-    # Update layout
-    fig.update(layout_xaxis_rangeslider_visible=False)
-    fig.write_image(DAILY_CHART_OUTPUT_FILE)
-
-
-def timespan_candle_chart(ticker, time1, time2, date):
+    async def render():
+        minute_data = await get_data(ticker, date)
+        with span('transform'):
+            title, bars = minute_chart_bars(ticker, date, minute_data.between(RTH_OPEN, RTH_CLOSE))
+        spec = chart_spec('candle_volume', title, bars)
+        return await run_cpu(render_figure, spec)
+
+    return await cached_chart(chart_key('daily', ticker, date), date, render)
+
+
+@timed('timespan_candle_chart')
+async def timespan_candle_chart(ticker, multiplier, timespan, date, more_data=False):
     """
-    Create candlestick chart for custom timespan.
+    Create candlestick chart with multiplier x timespan bars.
+
+    Bars are resampled locally from one base series (see resample.py), so
+    charts of the same ticker at different timeframes share their data.
+    When the timeframe gives more bars than the chart is pixels wide, the
+    next standard size that fits is drawn and named in the title.
 
     Args:
         ticker (str): Stock ticker symbol
-        time1 (str): Start time in HH:MM format
-        time2 (str): End time in HH:MM format
-        date (str): Date in YYYY-MM-DD format
+        multiplier (int): Timespans per bar
+        timespan (str): 'minute', 'hour', 'day' or 'week'
+        date (str): Date in YYYY-MM-DD format (last session shown)
+        more_data (bool): Show a longer lookback
+
+    Returns:
+        bytes: JPEG image
+
+    Raises:
+        ValueError: If the timespan or multiplier is invalid, or there are no bars
     """
-    minute_data = get_data(ticker, date)
-    data = minute_data.loc[time1:time2]
-
-    # Create candlestick chart
-    fig = go.Figure(
-        data=[
-            go.Candlestick(
-                x=data['timestamp'],
-                open=data['open'],
-                high=data['high'],
-                low=data['low'],
-                close=data['close']
-            )
-        ]
-    )
-
-    fig.update_layout(title=f'{ticker} - {date} ({time1} to {time2})')
-    fig.write_image(CHART_OUTPUT_FILE)
+    async def render():
+        bars, drawn_multiplier, drawn_timespan = await get_chart_bars(
+            ticker, multiplier, timespan, date, more_data, max_bars=CHART_WIDTH
+        )
+        if not len(bars):
+            raise ValueError(f'No bars for {ticker} on {date}')
+        spec = chart_spec('candle', f'{ticker} - {date} ({drawn_multiplier} {drawn_timespan})', bars)
+        return await run_cpu(render_figure, spec)
+
+    key = chart_key('timespan', ticker, date, multiplier=multiplier, timespan=timespan, more_data=more_data)
+    return await cached_chart(key, date, render)
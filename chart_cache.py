@@ -0,0 +1,126 @@
+"""
+Chart Cache Module
+Byte-bounded LRU cache of rendered chart images keyed by request parameters
+"""
+import time
+from collections import OrderedDict
+from config import CHART_CACHE_MAX_BYTES, CHART_CACHE_LIVE_TTL
+from bar_store import is_session_closed
+from metrics import metrics
+
+
+def chart_key(kind, ticker, date, time_range=None, multiplier=None, timespan=None, more_data=False):
+    """
+    Build the cache key for a chart request.
+
+    Args:
+        kind (str): Chart kind ('range', 'daily', 'timespan', ...)
+        ticker (str): Stock ticker symbol
+        date (str | date): Session date the chart ends on
+        time_range (tuple): (start, end) clock times, if any
+        multiplier (int): Bar size multiplier, if any
+        timespan (str): Bar timespan (minute/hour/day/week), if any
+        more_data (bool): Whether the extended lookback was requested
+
+    Returns:
+        tuple: Hashable cache key
+    """
+    return (kind, ticker.upper(), str(date), time_range, multiplier, timespan, bool(more_data))
+
+
+class ChartCache:
+    """
+    LRU cache of encoded images bounded by their total size in bytes.
+
+    Charts of closed sessions never change, so they stay until evicted.
+    Charts that include the current session expire after a short TTL.
+    `sizeof` measures an entry, so the cache can hold chart data as well as images.
+    """
+
+    def __init__(self, max_bytes=CHART_CACHE_MAX_BYTES, live_ttl=CHART_CACHE_LIVE_TTL, sizeof=len):
+        self.max_bytes = max_bytes
+        self.live_ttl = live_ttl
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+
+    @property
+    def size(self):
+        """Total bytes of cached images."""
+        return self._size
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Look up a cached image.
+
+        Args:
+            key (tuple): Key from chart_key
+
+        Returns:
+            bytes: Cached image, or None on a miss or expired entry
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+            self._discard(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, image, date):
+        """
+        Cache an image, evicting least recently used entries past the byte cap.
+
+        Args:
+            key (tuple): Key from chart_key
+            image (bytes): Encoded image
+            date (str | date): Session date the chart ends on (sets the TTL)
+        """
+        size = self.sizeof(image)
+        if size > self.max_bytes:
+            return
+        expires = None if is_session_closed(str(date)) else time.monotonic() + self.live_ttl
+        self._discard(key)
+        self._entries[key] = (image, expires, size)
+        self._size += size
+        while self._size > self.max_bytes:
+            _, (_, _, old_size) = self._entries.popitem(last=False)
+            self._size -= old_size
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry[2]
+
+
+chart_cache = ChartCache()
+metrics.register_cache('charts', lambda: (chart_cache.hits, chart_cache.misses))
+metrics.register_gauge('chart_cache_bytes', 'Bytes of cached chart images',
+                       lambda: [({}, chart_cache.size)])
+
+
+async def cached_chart(key, date, render):
+    """
+    Return a cached chart, or render it and cache the result.
+
+    Args:
+        key (tuple): Key from chart_key
+        date (str | date): Session date the chart ends on
+        render (callable): Coroutine function producing the image bytes
+
+    Returns:
+        bytes: Encoded image
+    """
+    image = chart_cache.get(key)
+    if image is None:
+        image = await render()
+        chart_cache.put(key, image, date)
+    return image
@@ -9,6 +9,98 @@ DISCORD_TOKEN = os.getenv("TOKEN")
 
 # Polygon API Configuration
 POLYGON_API_KEY = os.getenv("POLYGON_API_KEY")
+POLYGON_BASE_URL = os.getenv("POLYGON_BASE_URL", "https://api.polygon.io")
+
+# Polygon HTTP Client (shared connection pool)
+POLYGON_MAX_CONNECTIONS = int(os.getenv("POLYGON_MAX_CONNECTIONS", "20"))  # Keep-alive pool size
+POLYGON_MAX_CONCURRENCY = int(os.getenv("POLYGON_MAX_CONCURRENCY", "10"))  # Requests in flight at once
+POLYGON_TIMEOUT = float(os.getenv("POLYGON_TIMEOUT", "15"))  # Seconds per request
+
+# Polygon Rate Limiting (shared by every command)
+POLYGON_RATE_LIMIT = float(os.getenv("POLYGON_RATE_LIMIT", "0"))  # Requests per second, 0 = no fixed ceiling
+POLYGON_RATE_BURST = float(os.getenv("POLYGON_RATE_BURST", "5"))  # Requests allowed back to back
+POLYGON_MAX_RETRIES = int(os.getenv("POLYGON_MAX_RETRIES", "4"))  # Retries after a 429, connection error or timeout
+
+# Job Execution (blocking work kept off the Discord event loop)
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", "2"))  # Warm processes rendering charts
+IO_WORKERS = int(os.getenv("IO_WORKERS", "8"))  # Threads for pandas/export work
+MAX_PENDING_JOBS = int(os.getenv("MAX_PENDING_JOBS", "64"))  # Queued jobs per pool
+MAX_PENDING_JOBS_PER_GUILD = int(os.getenv("MAX_PENDING_JOBS_PER_GUILD", "8"))  # Queued jobs per guild
+
+# Worker Tier (the bot enqueues command jobs for `python worker.py` processes)
+JOB_QUEUE_ADDRESS = os.getenv("JOB_QUEUE_ADDRESS", "")  # host:port of the job queue, empty = run jobs in the bot
+JOB_QUEUE_AUTHKEY = os.getenv("JOB_QUEUE_AUTHKEY", "").encode()  # Secret shared by the bot and workers, required with an address
+JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT", "120"))  # Seconds the bot waits for a job's result
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "4"))  # Jobs a worker process runs at once
+
+# Chart Render Workers
+RENDER_TIMEOUT = float(os.getenv("RENDER_TIMEOUT", "30"))  # Seconds before a render worker is restarted
+RENDER_HEALTH_INTERVAL = float(os.getenv("RENDER_HEALTH_INTERVAL", "30"))  # Seconds between worker pings
+RENDER_MAX_JOBS_PER_WORKER = int(os.getenv("RENDER_MAX_JOBS_PER_WORKER", "500"))  # Recycle to cap memory
+
+# Rendered Chart Cache
+CHART_CACHE_MAX_BYTES = int(os.getenv("CHART_CACHE_MAX_MB", "64")) * 1024 * 1024
+CHART_CACHE_LIVE_TTL = float(os.getenv("CHART_CACHE_LIVE_TTL", "60"))  # Seconds for charts of the current session
+
+# Chart Images
+CHART_BACKEND = os.getenv("CHART_BACKEND", "plotly")  # 'plotly' (Kaleido) or 'matplotlib' (Agg, no browser)
+CHART_WIDTH = int(os.getenv("CHART_WIDTH", "700"))  # Pixels; also the most candles drawn per chart (coarser bars beyond that)
+CHART_HEIGHT = int(os.getenv("CHART_HEIGHT", "500"))  # Pixels
+
+# Chart Timeframes (/chart bars are resampled locally from minute or daily bars)
+CHART_SESSIONS = int(os.getenv("CHART_SESSIONS", "1"))  # Sessions in a minute/hour chart
+CHART_MORE_SESSIONS = int(os.getenv("CHART_MORE_SESSIONS", "5"))  # Sessions with more_data
+CHART_DAYS = int(os.getenv("CHART_DAYS", "180"))  # Calendar days in a day/week chart
+CHART_MORE_DAYS = int(os.getenv("CHART_MORE_DAYS", "1825"))  # Calendar days with more_data
+RESAMPLE_CACHE_MAX_BYTES = int(os.getenv("RESAMPLE_CACHE_MAX_MB", "64")) * 1024 * 1024
+
+# Local Data Store (minute bars for closed sessions)
+BAR_STORE_DIR = os.getenv("BAR_STORE_DIR", "data/minute_bars")
+BAR_STORE_MAX_BYTES = int(os.getenv("BAR_STORE_MAX_MB", "512")) * 1024 * 1024
+DAILY_HISTORY_DIR = os.getenv("DAILY_HISTORY_DIR", "data/daily")
+DAILY_HISTORY_DAYS = 5000  # Calendar days downloaded the first time a ticker is analyzed
+
+# Grouped Daily Snapshots (every ticker's daily bar per date)
+DAILY_SNAPSHOT_DIR = os.getenv("DAILY_SNAPSHOT_DIR", "data/snapshots")
+DAILY_SNAPSHOT_CACHE = int(os.getenv("DAILY_SNAPSHOT_CACHE", "16"))  # Dates kept in memory
+DAILY_SNAPSHOT_CATCHUP = 5  # Most sessions a stored history is extended by from snapshots
+
+# Ticker Reference Data (market cap, shares outstanding)
+REFERENCE_CACHE_PATH = os.getenv("REFERENCE_CACHE_PATH", "data/reference.json")
+REFERENCE_TTL = float(os.getenv("REFERENCE_TTL_HOURS", "24")) * 3600  # Seconds before details are refetched
+WATCHLIST = os.getenv("WATCHLIST", "").replace(",", " ").upper().split()  # Tickers warmed at startup
+
+# Multi-Ticker Requests (/stock_data)
+STOCK_DATA_CONCURRENCY = int(os.getenv("STOCK_DATA_CONCURRENCY", "8"))  # Tickers fetched at once
+STOCK_DATA_TICKER_TIMEOUT = float(os.getenv("STOCK_DATA_TICKER_TIMEOUT", "30"))  # Seconds before a ticker is skipped
+
+# Real-time Streaming (Polygon websocket aggregates)
+STREAM_URL = os.getenv("STREAM_URL", "wss://socket.polygon.io/stocks")
+STREAM_TICKERS = os.getenv("STREAM_TICKERS", "").replace(",", " ").upper().split()  # Empty disables streaming
+STREAM_FEED = os.getenv("STREAM_FEED", "AM")  # AM = minute aggregates, A = second aggregates
+
+# Alerts (/alert, delivered from the streaming feed)
+ALERTS_PATH = os.getenv("ALERTS_PATH", "data/alerts.json")
+ALERTS_PER_USER = int(os.getenv("ALERTS_PER_USER", "50"))
+ALERT_MESSAGES_PER_SECOND = float(os.getenv("ALERT_MESSAGES_PER_SECOND", "2"))  # Across all channels
+ALERT_MESSAGE_BURST = 5  # Alert messages sent back to back before the rate applies
+ALERT_DELIVERY_INTERVAL = 2  # Seconds triggered alerts are collected per channel before sending
+
+# Gap Statistics
+GAP_FETCH_CONCURRENCY = int(os.getenv("GAP_FETCH_CONCURRENCY", "8"))  # Gap days fetched at once
+GAP_FETCH_RETRIES = int(os.getenv("GAP_FETCH_RETRIES", "3"))  # Attempts per gap day
+
+# Gap Index (/gap_screen)
+GAP_UNIVERSE = os.getenv("GAP_UNIVERSE", "").replace(",", " ").upper().split()  # Empty indexes every ticker
+GAP_INDEX_PATH = os.getenv("GAP_INDEX_PATH", "data/gap_index.npy")
+GAP_INDEX_DAYS = int(os.getenv("GAP_INDEX_DAYS", "20"))  # Sessions kept in the index
+GAP_INDEX_TIMES_PERCENT = float(os.getenv("GAP_INDEX_TIMES_PERCENT", "10"))  # Gaps whose HOD/LOD minute is looked up
+GAP_INDEX_TIMES_RETRIES = int(os.getenv("GAP_INDEX_TIMES_RETRIES", "5"))  # Failed HOD/LOD lookups of a gap day before giving up
+GAP_SCREEN_LIMIT = 25  # Rows shown by /gap_screen
+
+# Metrics
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # Port for Prometheus /metrics, 0 = disabled
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", "1000"))  # Recent samples kept per latency histogram
 
 # Discord Guild IDs (servers where bot is active)
 GUILD_IDS = [
@@ -24,8 +116,11 @@ TIMEZONE = 'EST'
 
 # Data Limits
 MAX_DAYS_HISTORICAL = 7  # Maximum days in the past for stock data
+DISCORD_MESSAGE_LIMIT = 2000  # Characters Discord accepts per message
 
-# File Outputs
-EXCEL_OUTPUT_FILE = 'stock_data.xlsx'
-CHART_OUTPUT_FILE = 'timeframe_chart.jpeg'
-DAILY_CHART_OUTPUT_FILE = 'daily_chart.jpeg'
+# Attachment Names (outputs are built in memory, never written to disk)
+EXCEL_FILENAME = 'stock_data.xlsx'
+CHART_FILENAME = 'timeframe_chart.jpeg'
+DAILY_CHART_FILENAME = 'daily_chart.jpeg'
+STATS_FILENAME = 'bot_stats.txt'
+GAP_SCREEN_FILENAME = 'gap_screen.txt'
@@ -0,0 +1,127 @@
+"""
+Daily History Module
+Persisted per-ticker daily bars with gap columns, extended incrementally
+"""
+import os
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from config import DAILY_HISTORY_DIR, DAILY_HISTORY_DAYS, DAILY_SNAPSHOT_CATCHUP
+from polygon_client import get_client
+from bar_store import eastern, is_session_closed, save_array, session_days
+from daily_snapshot import get_daily_bars
+from singleflight import coalesce
+from metrics import span
+
+# Column layout of stored daily history
+HISTORY_DTYPE = np.dtype([
+    ('date', 'datetime64[D]'),
+    ('open', '<f8'),
+    ('high', '<f8'),
+    ('low', '<f8'),
+    ('close', '<f8'),
+    ('volume', '<f8'),
+    ('prev_close', '<f8'),
+    ('gap', '<f8'),
+    ('gap_percent', '<f8'),
+])
+
+
+def history_path(ticker):
+    """Return the file path holding a ticker's daily history."""
+    return os.path.join(DAILY_HISTORY_DIR, f'{ticker.upper()}.npy')
+
+
+def load_history(ticker):
+    """
+    Read a ticker's stored daily history.
+
+    Args:
+        ticker (str): Stock ticker symbol
+
+    Returns:
+        np.ndarray: Rows with dtype HISTORY_DTYPE, or None if nothing is stored
+    """
+    try:
+        return np.load(history_path(ticker))
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def build_history(day_aggs, last_close=np.nan):
+    """
+    Convert daily bars to history rows with previous close and gap columns.
+
+    Args:
+        day_aggs (list): Daily bars as returned by the Polygon client
+        last_close (float): Close of the session before the first bar, if known
+
+    Returns:
+        np.ndarray: Rows with dtype HISTORY_DTYPE
+    """
+    rows = np.empty(len(day_aggs), dtype=HISTORY_DTYPE)
+    if not len(day_aggs):
+        return rows
+
+    timestamps = pd.to_datetime([bar['timestamp'] for bar in day_aggs], unit='ms', utc=True)
+    rows['date'] = timestamps.tz_convert(eastern).date
+    for name in ('open', 'high', 'low', 'close', 'volume'):
+        rows[name] = [bar[name] for bar in day_aggs]
+
+    rows['prev_close'] = np.r_[last_close, rows['close'][:-1]]
+    rows['gap'] = rows['open'] - rows['prev_close']
+    rows['gap_percent'] = rows['gap'] / rows['prev_close'] * 100
+    return rows
+
+
+@coalesce('daily_history')
+async def get_daily_history(ticker):
+    """
+    Get a ticker's full daily history, fetching only sessions not yet stored.
+
+    The first call downloads DAILY_HISTORY_DAYS of bars. Later calls request
+    from the last stored session onward; that overlapping session is compared
+    with the stored one so a split (which rewrites adjusted prices) triggers a
+    full rebuild instead of a history with a fake gap in it. Only closed
+    sessions are persisted, but today's partial bar is included in the result.
+    A history only a few closed sessions behind is caught up from the shared
+    grouped-daily snapshots instead of a request of its own; those snapshots
+    are refetched if they predate the newest session's open, so the
+    overlapping close reflects any split since and the check still holds.
+
+    Args:
+        ticker (str): Stock ticker symbol
+
+    Returns:
+        np.ndarray: Rows with dtype HISTORY_DTYPE, oldest first
+    """
+    client = get_client()
+    today = datetime.now(eastern).date()
+    stored = load_history(ticker)
+
+    fresh = None
+    with span('fetch'):
+        if stored is not None and len(stored):
+            last = stored[-1]
+            day_aggs = None
+            days = session_days(last['date'], today)
+            if len(days) <= DAILY_SNAPSHOT_CATCHUP + 1 and is_session_closed(days[-1]):
+                day_aggs = await get_daily_bars(ticker, days, adjusted_for=days[-1])
+            if day_aggs is None:
+                day_aggs = await client.get_aggs(ticker, 1, "day", str(last['date']), today)
+            fresh = build_history(day_aggs, last['prev_close'])
+            if len(fresh) and fresh['date'][0] == last['date'] and np.isclose(fresh['close'][0], last['close']):
+                history = np.concatenate([stored[:-1], fresh])
+            else:
+                fresh = None
+
+        if fresh is None:
+            start = today - timedelta(days=DAILY_HISTORY_DAYS)
+            history = build_history(await client.get_aggs(ticker, 1, "day", start, today))
+
+    keep = len(history)
+    if keep and not is_session_closed(str(history['date'][-1])):
+        keep -= 1
+    if fresh is None or keep > len(stored):
+        save_array(history_path(ticker), history[:keep])
+    return history
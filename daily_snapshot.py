@@ -0,0 +1,255 @@
+"""
+Daily Snapshot Module
+Grouped-daily bars for every ticker on a date, stored as a ticker-sorted columnar table
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+import numpy as np
+from config import DAILY_SNAPSHOT_DIR, DAILY_SNAPSHOT_CACHE
+from polygon_client import get_client
+from bar_store import is_session_closed, save_array, day_start_ms
+from bars import RTH_OPEN
+from singleflight import coalesce
+from metrics import metrics, span
+
+# Column layout of a stored snapshot, one row per ticker sorted by ticker
+SNAPSHOT_DTYPE = np.dtype([
+    ('ticker', '<U16'),
+    ('open', '<f8'),
+    ('high', '<f8'),
+    ('low', '<f8'),
+    ('close', '<f8'),
+    ('volume', '<f8'),
+    ('vwap', '<f8'),
+    ('transactions', '<i8'),
+])
+PRICE_FIELDS = SNAPSHOT_DTYPE.names[1:]
+
+
+def to_snapshot_array(bars):
+    """
+    Convert grouped-daily bars to a ticker-sorted structured array.
+
+    Args:
+        bars (list): Bars as returned by PolygonClient.get_grouped_daily
+
+    Returns:
+        np.ndarray: Rows with dtype SNAPSHOT_DTYPE, sorted by ticker
+    """
+    table = np.empty(len(bars), dtype=SNAPSHOT_DTYPE)
+    table['ticker'] = [bar['ticker'] for bar in bars]
+    for name in PRICE_FIELDS:
+        fill = 0 if SNAPSHOT_DTYPE[name].kind == 'i' else np.nan
+        table[name] = [fill if bar.get(name) is None else bar[name] for bar in bars]
+    table.sort(order='ticker')
+    return table
+
+
+class DailySnapshot:
+    """
+    Every ticker's daily bar for one date.
+
+    Rows are sorted by ticker, so lookups are binary searches and a whole
+    column (all closes, all volumes) is one contiguous array for screeners.
+    Prices are split-adjusted as of `fetched_at` (epoch seconds).
+    """
+
+    def __init__(self, date, table, fetched_at=None):
+        self.date = str(date)
+        self.table = table
+        self.fetched_at = time.time() if fetched_at is None else fetched_at
+
+    def __len__(self):
+        return len(self.table)
+
+    def adjusted_for(self, date):
+        """
+        Whether the prices reflect every split in effect by a session.
+
+        Polygon adjusts past bars for a split from its ex-date, so a snapshot
+        fetched before that session opened may still hold pre-split prices.
+
+        Args:
+            date (str | date): Session date in YYYY-MM-DD format
+
+        Returns:
+            bool: True if the snapshot was fetched after the session's regular open
+        """
+        return self.fetched_at >= day_start_ms(date) / 1000 + RTH_OPEN * 60
+
+    @property
+    def tickers(self):
+        """Ticker symbols, sorted."""
+        return self.table['ticker']
+
+    def positions(self, tickers):
+        """
+        Row positions of many tickers at once.
+
+        Args:
+            tickers (list): Ticker symbols
+
+        Returns:
+            np.ndarray: Row index per ticker, -1 where the ticker is absent
+        """
+        wanted = np.asarray([ticker.upper() for ticker in tickers], dtype=SNAPSHOT_DTYPE['ticker'])
+        if not len(self.table):
+            return np.full(len(wanted), -1)
+        found = np.minimum(np.searchsorted(self.table['ticker'], wanted), len(self.table) - 1)
+        return np.where(self.table['ticker'][found] == wanted, found, -1)
+
+    def get(self, ticker):
+        """
+        One ticker's daily bar.
+
+        Args:
+            ticker (str): Stock ticker symbol
+
+        Returns:
+            dict: Bar keyed like the Polygon client's aggregates (with a
+                midnight Eastern timestamp), or None if the ticker is absent
+        """
+        position = self.positions([ticker])[0]
+        if position < 0:
+            return None
+        row = self.table[position]
+        bar = {name: row[name].item() for name in PRICE_FIELDS}
+        bar['timestamp'] = day_start_ms(self.date)
+        return bar
+
+
+class SnapshotStore:
+    """
+    Snapshots of closed sessions kept as <root>/<YYYY-MM-DD>.npy, with the
+    most recently used ones also held in memory.
+    """
+
+    def __init__(self, root=DAILY_SNAPSHOT_DIR, cached_dates=DAILY_SNAPSHOT_CACHE):
+        self.root = root
+        self.cached_dates = cached_dates
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+
+    def path(self, date):
+        """Return the file path holding a date's snapshot."""
+        return os.path.join(self.root, f'{date}.npy')
+
+    def load(self, date):
+        """
+        Read a stored snapshot.
+
+        Args:
+            date (str): Date in YYYY-MM-DD format
+
+        Returns:
+            DailySnapshot: The snapshot, or None if it is not stored
+        """
+        snapshot = self._memory.get(date)
+        if snapshot is None:
+            path = self.path(date)
+            try:
+                snapshot = DailySnapshot(date, np.load(path), os.path.getmtime(path))
+            except (FileNotFoundError, ValueError):
+                self.misses += 1
+                return None
+            self._remember(snapshot)
+        self._memory.move_to_end(date)
+        self.hits += 1
+        return snapshot
+
+    def save(self, snapshot):
+        """Store a closed session's snapshot on disk and in memory."""
+        save_array(self.path(snapshot.date), snapshot.table)
+        self._remember(snapshot)
+
+    def _remember(self, snapshot):
+        self._memory[snapshot.date] = snapshot
+        while len(self._memory) > self.cached_dates:
+            self._memory.popitem(last=False)
+
+
+snapshot_store = SnapshotStore()
+metrics.register_cache('daily_snapshots', lambda: (snapshot_store.hits, snapshot_store.misses))
+
+
+@coalesce('daily_snapshot')
+async def get_daily_snapshot(date, adjusted_for=None):
+    """
+    Get every ticker's daily bar for a date with one grouped-daily request.
+
+    Snapshots of closed sessions are stored and reused. A stored snapshot is
+    requested again (and replaced) only when a caller needs its prices
+    adjusted for splits up to a later session than it was fetched for.
+
+    Args:
+        date (str | date): Date in YYYY-MM-DD format
+        adjusted_for (str | date): Later session whose splits the prices must reflect
+
+    Returns:
+        DailySnapshot: Ticker-sorted daily bars (empty on market holidays)
+    """
+    date = str(date)
+    snapshot = snapshot_store.load(date)
+    if snapshot is not None and (adjusted_for is None or snapshot.adjusted_for(adjusted_for)):
+        return snapshot
+
+    with span('fetch'):
+        bars = await get_client().get_grouped_daily(date)
+    snapshot = DailySnapshot(date, to_snapshot_array(bars))
+    if len(snapshot) and is_session_closed(date):
+        snapshot_store.save(snapshot)
+    return snapshot
+
+
+async def get_daily_bar(ticker, date):
+    """
+    Get one ticker's daily bar, from the shared snapshot when possible.
+
+    Closed sessions are read from the grouped snapshot, which one request
+    fills for every ticker. The session in progress, or a ticker missing from
+    the snapshot, falls back to a per-ticker request.
+
+    Args:
+        ticker (str): Stock ticker symbol
+        date (str | date): Date in YYYY-MM-DD format
+
+    Returns:
+        dict: Daily bar keyed like the Polygon client's aggregates, or None
+    """
+    date = str(date)
+    if is_session_closed(date):
+        bar = (await get_daily_snapshot(date)).get(ticker)
+        if bar is not None:
+            return bar
+
+    with span('fetch'):
+        bars = await get_client().get_aggs(ticker, 1, "day", date, date)
+    return bars[0] if bars else None
+
+
+async def get_daily_bars(ticker, dates, adjusted_for=None):
+    """
+    Get one ticker's daily bars for several closed sessions from snapshots.
+
+    Args:
+        ticker (str): Stock ticker symbol
+        dates (list): Dates in YYYY-MM-DD format
+        adjusted_for (str | date): Later session whose splits the prices must reflect
+
+    Returns:
+        list: Daily bars, oldest first, skipping market holidays; None if a
+            snapshot with data is missing the ticker (use a per-ticker request)
+    """
+    snapshots = await asyncio.gather(*[get_daily_snapshot(date, adjusted_for) for date in dates])
+    bars = []
+    for snapshot in snapshots:
+        if not len(snapshot):
+            continue
+        bar = snapshot.get(ticker)
+        if bar is None:
+            return None
+        bars.append(bar)
+    return bars
@@ -0,0 +1,380 @@
+"""
+Fake Polygon Module
+Local stand-in for the Polygon.io REST API serving recorded or synthetic data
+
+Usage:
+    python fake_polygon.py serve [--port 8900] [--fixtures DIR] [--latency MS]
+                                 [--replay-date YYYY-MM-DD] [--replay-from HH:MM] [--replay-speed N]
+    python fake_polygon.py record --fixtures DIR PATH [PATH ...]
+
+Point the bot at it with POLYGON_BASE_URL=http://127.0.0.1:<port>. The
+websocket feed at ws://127.0.0.1:<port>/stocks replays the synthetic minute
+bars of one session (default today) on a clock running N market minutes per
+second, starting at --replay-from; point STREAM_URL at it to test streaming.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+import zlib
+from datetime import datetime, date as d, timedelta
+import numpy as np
+from aiohttp import web
+from pytz import timezone
+
+eastern = timezone('US/Eastern')
+
+# Extended session covered by synthetic minute bars (4:00 AM - 8:00 PM ET)
+SESSION_START_MINUTE = 4 * 60
+SESSION_MINUTES = 16 * 60
+
+# Size of the synthetic market returned by the grouped-daily endpoint
+UNIVERSE_SIZE = 5000
+
+
+def fixture_name(path):
+    """
+    File name a recorded response is stored under.
+
+    Args:
+        path (str): Request path, e.g. /v3/reference/tickers/AAPL
+
+    Returns:
+        str: Fixture file name
+    """
+    return path.strip('/').replace('/', '__') + '.json'
+
+
+def seed_for(*parts):
+    """Stable RNG seed for a ticker/date combination (hash() is salted per process)."""
+    return zlib.crc32('|'.join(str(part) for part in parts).encode())
+
+
+def trading_days(start, end):
+    """Weekdays between start and end inclusive (holidays are not modelled)."""
+    day = start
+    while day <= end:
+        if day.weekday() < 5:
+            yield day
+        day += timedelta(days=1)
+
+
+def base_price(ticker):
+    return 20 + seed_for(ticker) % 300
+
+
+def daily_bars(ticker, start, end):
+    """
+    Synthetic daily bars with occasional opening gaps.
+
+    Each day is generated from its own seed, so any window of the series is
+    identical no matter which range was requested.
+    """
+    bars = []
+    base = base_price(ticker)
+    for day in trading_days(start, end):
+        rng = np.random.default_rng(seed_for(ticker, day))
+        level = base * (1 + 0.3 * np.sin(day.toordinal() / 40))
+        gap = rng.normal(0, 0.005) + (rng.random() < 0.02) * rng.normal(0, 0.12)
+        open_ = level * (1 + gap)
+        close = open_ * (1 + rng.normal(0, 0.01))
+        timestamp = int(eastern.localize(datetime(day.year, day.month, day.day)).timestamp() * 1000)
+        bars.append({
+            'o': round(open_, 4),
+            'h': round(max(open_, close) * (1 + rng.random() * 0.02), 4),
+            'l': round(min(open_, close) * (1 - rng.random() * 0.02), 4),
+            'c': round(close, 4),
+            'v': float(rng.integers(500_000, 5_000_000)),
+            'vw': round((open_ + close) / 2, 4),
+            't': timestamp,
+            'n': int(rng.integers(1_000, 50_000)),
+        })
+    return bars
+
+
+def minute_bars(ticker, start, end):
+    """Synthetic minute bars (a random walk) for every extended session in the window."""
+    bars = []
+    base = base_price(ticker)
+    for day in trading_days(start, end):
+        rng = np.random.default_rng(seed_for(ticker, day, 'minute'))
+        midnight = eastern.localize(datetime(day.year, day.month, day.day))
+        first = int(midnight.timestamp() * 1000) + SESSION_START_MINUTE * 60_000
+        closes = base * np.exp(np.cumsum(rng.normal(0, 0.001, SESSION_MINUTES)))
+        opens = np.concatenate([[base], closes[:-1]])
+        spread = np.abs(rng.normal(0, 0.0008, SESSION_MINUTES)) * closes
+        highs = np.maximum(opens, closes) + spread
+        lows = np.minimum(opens, closes) - spread
+        volumes = rng.integers(100, 20_000, SESSION_MINUTES)
+        for i in range(SESSION_MINUTES):
+            bars.append({
+                'o': round(float(opens[i]), 4),
+                'h': round(float(highs[i]), 4),
+                'l': round(float(lows[i]), 4),
+                'c': round(float(closes[i]), 4),
+                'v': float(volumes[i]),
+                'vw': round(float(closes[i]), 4),
+                't': first + i * 60_000,
+                'n': int(volumes[i] // 50),
+            })
+    return bars
+
+
+def universe():
+    """Synthetic ticker symbols making up the whole market (AAA, AAB, ...)."""
+    letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    return [letters[i // 676] + letters[i // 26 % 26] + letters[i % 26] for i in range(UNIVERSE_SIZE)]
+
+
+def ticker_details(ticker):
+    """Synthetic reference details for a ticker."""
+    shares = 10_000_000 + seed_for(ticker, 'shares') % 1_000_000_000
+    return {
+        'ticker': ticker,
+        'name': f'{ticker} Synthetic Corp',
+        'market': 'stocks',
+        'weighted_shares_outstanding': shares,
+        'market_cap': shares * base_price(ticker),
+    }
+
+
+class Replay:
+    """
+    One session's synthetic bars played back on an accelerated clock.
+
+    REST minute bars of the replay date stop at the clock, and the websocket
+    sends each aggregate once the clock passes its end, like the live feed.
+    """
+
+    def __init__(self, day, start_minute=9 * 60 + 30, speed=60.0):
+        self.day = day
+        self.midnight_ms = int(eastern.localize(datetime(day.year, day.month, day.day)).timestamp() * 1000)
+        self.start_ms = self.midnight_ms + start_minute * 60_000
+        self.speed = speed
+        self.started = time.monotonic()
+        self._events = {}
+
+    def now_ms(self):
+        """Current replay time, epoch milliseconds."""
+        return self.start_ms + (time.monotonic() - self.started) * self.speed * 60_000
+
+    def events(self, feed, ticker):
+        """
+        Websocket aggregates for a ticker's session, in the order they are sent.
+
+        Minute aggregates ('AM') map one to one to the synthetic bars. Second
+        aggregates ('A') split each bar in two halves that merge back into it.
+        """
+        key = (feed, ticker)
+        if key not in self._events:
+            events = []
+            accumulated = 0
+            bars = minute_bars(ticker, self.day, self.day)
+            for bar in bars:
+                accumulated += bar['v']
+                common = {'sym': ticker, 'av': accumulated, 'op': bars[0]['o'], 'vw': bar['vw'], 'a': bar['vw']}
+                if feed == 'A':
+                    first = bar['v'] // 2
+                    events.append({**common, 'ev': 'A', 'o': bar['o'], 'h': bar['h'], 'l': bar['l'], 'c': bar['o'],
+                                   'v': first, 'z': 50, 's': bar['t'], 'e': bar['t'] + 30_000})
+                    events.append({**common, 'ev': 'A', 'o': bar['o'], 'h': max(bar['o'], bar['c']),
+                                   'l': min(bar['o'], bar['c']), 'c': bar['c'], 'v': bar['v'] - first,
+                                   'z': 50, 's': bar['t'] + 30_000, 'e': bar['t'] + 60_000})
+                else:
+                    events.append({**common, 'ev': 'AM', 'o': bar['o'], 'h': bar['h'], 'l': bar['l'], 'c': bar['c'],
+                                   'v': bar['v'], 'z': 50, 's': bar['t'], 'e': bar['t'] + 60_000})
+            self._events[key] = events
+        return self._events[key]
+
+
+class FakePolygon:
+    """
+    aiohttp application answering the Polygon endpoints the bot uses.
+
+    A request is answered from a recorded fixture when one exists for its
+    path, otherwise from deterministic synthetic data. Optional latency
+    simulates the network round trip to the real API.
+    """
+
+    def __init__(self, fixtures_dir=None, latency=0.0, replay=None):
+        self.fixtures_dir = fixtures_dir
+        self.latency = latency
+        self.replay = replay or Replay(datetime.now(eastern).date())
+        self.requests = 0
+        self.bytes_sent = 0
+        self.universe = universe()
+        self.seen = set()
+
+    def app(self):
+        """
+        Build the web application.
+
+        Returns:
+            web.Application: Routes for aggregates, grouped daily bars, ticker details,
+                the websocket feed and stats
+        """
+        app = web.Application()
+        app.router.add_get('/v2/aggs/ticker/{ticker}/range/{multiplier}/{timespan}/{start}/{end}', self.aggs)
+        app.router.add_get('/v2/aggs/grouped/locale/us/market/stocks/{date}', self.grouped)
+        app.router.add_get('/v3/reference/tickers/{ticker}', self.details)
+        app.router.add_get('/stocks', self.stream)
+        app.router.add_get('/_stats', self.stats)
+        return app
+
+    async def _respond(self, request, synthesize):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        body = self._fixture(request.path)
+        if body is None:
+            body = json.dumps(synthesize())
+        self.bytes_sent += len(body)
+        return web.Response(text=body, content_type='application/json')
+
+    def _fixture(self, path):
+        if self.fixtures_dir is None:
+            return None
+        try:
+            with open(os.path.join(self.fixtures_dir, fixture_name(path))) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    async def aggs(self, request):
+        info = request.match_info
+        ticker = info['ticker']
+        self.seen.add(ticker)
+        start = d.fromisoformat(info['start'])
+        end = d.fromisoformat(info['end'])
+
+        def synthesize():
+            if info['timespan'] == 'minute':
+                results = minute_bars(ticker, start, end)
+                if start <= self.replay.day <= end:
+                    # The replayed session only has the bars its clock has passed
+                    now = self.replay.now_ms()
+                    results = [bar for bar in results
+                               if bar['t'] < self.replay.midnight_ms or bar['t'] + 60_000 <= now]
+            else:
+                results = daily_bars(ticker, start, end)
+            return {'ticker': ticker, 'status': 'OK', 'resultsCount': len(results), 'results': results}
+
+        return await self._respond(request, synthesize)
+
+    async def grouped(self, request):
+        day = d.fromisoformat(request.match_info['date'])
+
+        def synthesize():
+            # Tickers already asked about are included so the bot finds them in the snapshot
+            results = []
+            for ticker in sorted(set(self.universe) | self.seen):
+                for bar in daily_bars(ticker, day, day):
+                    results.append({'T': ticker, **bar})
+            return {'status': 'OK', 'resultsCount': len(results), 'results': results}
+
+        return await self._respond(request, synthesize)
+
+    async def details(self, request):
+        ticker = request.match_info['ticker']
+        return await self._respond(request, lambda: {'status': 'OK', 'results': ticker_details(ticker)})
+
+    async def stream(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        await ws.send_json([{'ev': 'status', 'status': 'connected', 'message': 'Connected Successfully'}])
+
+        # (feed, ticker) -> index of the next event to send
+        subscriptions = {}
+
+        async def send_due():
+            while True:
+                now = self.replay.now_ms()
+                due = []
+                for (feed, ticker), position in subscriptions.items():
+                    events = self.replay.events(feed, ticker)
+                    while position < len(events) and events[position]['e'] <= now:
+                        due.append(events[position])
+                        position += 1
+                    subscriptions[(feed, ticker)] = position
+                if due:
+                    await ws.send_json(due)
+                await asyncio.sleep(0.05)
+
+        sender = asyncio.create_task(send_due())
+        try:
+            async for message in ws:
+                if message.type != web.WSMsgType.TEXT:
+                    continue
+                body = json.loads(message.data)
+                channels = [channel.split('.', 1) for channel in body.get('params', '').split(',') if '.' in channel]
+                if body.get('action') == 'auth':
+                    await ws.send_json([{'ev': 'status', 'status': 'auth_success', 'message': 'authenticated'}])
+                elif body.get('action') == 'subscribe':
+                    now = self.replay.now_ms()
+                    for feed, ticker in channels:
+                        self.seen.add(ticker)
+                        # Start after what the REST API already returns for the session
+                        events = self.replay.events(feed, ticker)
+                        subscriptions[(feed, ticker)] = sum(event['e'] <= now for event in events)
+                elif body.get('action') == 'unsubscribe':
+                    for feed, ticker in channels:
+                        subscriptions.pop((feed, ticker), None)
+        finally:
+            sender.cancel()
+        return ws
+
+    async def stats(self, request):
+        return web.json_response({'requests': self.requests, 'bytes': self.bytes_sent})
+
+
+async def record(paths, fixtures_dir):
+    """
+    Save live Polygon responses as fixtures (needs POLYGON_API_KEY).
+
+    Args:
+        paths (list): Request paths, optionally with a query string
+        fixtures_dir (str): Directory the fixtures are written to
+    """
+    from polygon_client import get_client, close_client
+
+    os.makedirs(fixtures_dir, exist_ok=True)
+    client = get_client()
+    try:
+        for path in paths:
+            body = await client._get(path)
+            with open(os.path.join(fixtures_dir, fixture_name(path.split('?')[0])), 'w') as f:
+                json.dump(body, f)
+            print(f'recorded {path}')
+    finally:
+        await close_client()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[2])
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help='Serve fixtures and synthetic data')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8900)
+    serve.add_argument('--fixtures', help='Directory of recorded responses')
+    serve.add_argument('--latency', type=float, default=0.0, help='Added latency per request (ms)')
+    serve.add_argument('--replay-date', help='Session replayed on the websocket feed (default today)')
+    serve.add_argument('--replay-from', default='09:30', help='Replay clock start (HH:MM ET)')
+    serve.add_argument('--replay-speed', type=float, default=60.0, help='Market minutes replayed per second')
+    rec = commands.add_parser('record', help='Record live responses as fixtures')
+    rec.add_argument('--fixtures', required=True)
+    rec.add_argument('paths', nargs='+')
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        asyncio.run(record(args.paths, args.fixtures))
+    else:
+        hours, minutes = map(int, args.replay_from.split(':'))
+        replay_date = d.fromisoformat(args.replay_date) if args.replay_date else datetime.now(eastern).date()
+        replay = Replay(replay_date, hours * 60 + minutes, args.replay_speed)
+        fake = FakePolygon(args.fixtures, args.latency / 1000, replay)
+        web.run_app(fake.app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    main()
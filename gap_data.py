@@ -1,97 +1,100 @@
-from polygon import RESTClient
+import asyncio
+import aiohttp
+import numpy as np
 import pandas as pd
-from datetime import datetime, timedelta
+from datetime import timedelta
 pd.options.mode.chained_assignment = None
 from tabulate import tabulate
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_random_exponential
+from config import GAP_FETCH_CONCURRENCY, GAP_FETCH_RETRIES
+from polygon_client import PolygonError
+from bar_store import get_minute_bars
+from daily_history import get_daily_history
+from bars import MinuteBars, segment_stats, RTH_OPEN, RTH_CLOSE
+from jobs import run_io
+from scheduler import current_priority, BULK
+from metrics import timed
+
+def is_transient_error(err):
+    if isinstance(err, PolygonError):
+        return err.status >= 500
+    return isinstance(err, (aiohttp.ClientError, asyncio.TimeoutError))
+
+#retry timeouts/connection errors/5xx with jittered exponential backoff
+@retry(
+    retry=retry_if_exception(is_transient_error),
+    stop=stop_after_attempt(GAP_FETCH_RETRIES),
+    wait=wait_random_exponential(multiplier=0.5, max=8),
+    reraise=True
+)
+async def fetch_gap_day(ticker, day, semaphore, save=True):
+    async with semaphore:
+        return await get_minute_bars(ticker, day, save=save)
+
+async def get_average_hod_lod_times(ticker, df):
+    #fetch every gap day's minute bars concurrently, at most GAP_FETCH_CONCURRENCY at a time,
+    #as bulk requests so interactive lookups are admitted ahead of them
+    semaphore = asyncio.Semaphore(GAP_FETCH_CONCURRENCY)
+    priority = current_priority.set(BULK)
+    try:
+        minute_bars = await asyncio.gather(
+            *[fetch_gap_day(ticker, str(day), semaphore) for day in df.date]
+        )
+    finally:
+        current_priority.reset(priority)
+    return await run_io(hod_lod_average_times, minute_bars)
+
+def hod_lod_average_times(minute_bars):
+    #stack all days into one set of bar arrays
+    minute_bars = [bars for bars in minute_bars if len(bars)]
+    if not minute_bars:
+        raise ValueError('no intraday data for the gap days')
+    bars = MinuteBars.from_records(np.concatenate(minute_bars))
+
+    #first minute of each day's regular-session (09:30 - 16:00) high/low
+    starts, stops = bars.session_ranges(RTH_OPEN, RTH_CLOSE + 1)
+    stats = segment_stats(bars, starts, stops)
+    found = stats['high_index'] >= 0
+    if not found.any():
+        raise ValueError('no regular-session bars for the gap days')
+    hod_minutes = bars.minute[stats['high_index'][found]]
+    lod_minutes = bars.minute[stats['low_index'][found]]
+
+    return format_avg_time(hod_minutes.mean() * 60), format_avg_time(lod_minutes.mean() * 60)
+
+def format_avg_time(seconds):
+    avg_time = str(timedelta(seconds = seconds))
+    avg_time = avg_time[:5]
+    if avg_time[-1] == ':':
+        avg_time = avg_time[:4]
+    return avg_time
+
+@timed('get_gap_data')
+async def get_gap_data(ticker, percent):
+    #stored daily history with the gap columns already computed
+    history = await get_daily_history(ticker)
+
+    #the pandas work runs on the io pool so it doesn't block the event loop
+    gap_data = await run_io(find_gap_days, history, percent)
 
-def multiple_timestamp_to_date(df):
-    df.timestamp = pd.to_datetime(df.timestamp, unit='ms').dt.tz_localize('UTC').dt.tz_convert('US/Eastern')
-    df['date'] = df.timestamp.dt.date
-    df.timestamp = df.timestamp.dt.time
-    
-    
-    df['date_idx'] = df.date
-    df.set_index('date_idx', inplace=True)
-
-def multiple_timestamp_to_time(df):
-    df.timestamp = pd.to_datetime(df.timestamp, unit='ms').dt.tz_localize('UTC').dt.tz_convert('US/Eastern')
-    df.timestamp = df.timestamp.dt.time
-    df['timestamp_idx'] = df.timestamp.astype(str)
-    df.set_index('timestamp_idx', inplace=True)
-
-def get_average_hod_lod_times(ticker, df):
-    client = RESTClient("VxaBiHSENdZfJj1Ljm9dpoH5x7LYX1JF")
-    hod_df = pd.DataFrame()
-    lod_df = pd.DataFrame()
-    for i in range(len(df)):
-        minute_data = client.get_aggs(ticker, 1, "minute", df.iloc[i].date, df.iloc[i].date)
-        minute_data = pd.DataFrame(minute_data)
-        multiple_timestamp_to_time(minute_data)
-        minute_data = minute_data.loc['09:30:00':'16:00:00']
-        hod = minute_data[minute_data.high == df.iloc[i].high]
-        lod = minute_data[minute_data.low == df.iloc[i].low]
-        hod_df = pd.concat([hod_df, hod], ignore_index=True)
-        lod_df = pd.concat([lod_df, lod], ignore_index=True)
-
-    
-    hod_times_in_secs = []
-    lod_times_in_secs = []
-
-    for i in range(len(hod_df)):
-        hod_timestamp = hod_df.iloc[i].timestamp
-        hod_seconds = hod_timestamp.hour * 3600 + hod_timestamp.minute * 60
-        hod_times_in_secs.append(hod_seconds)
-
-    for i in range(len(lod_df)):
-        lod_timestamp = lod_df.iloc[i].timestamp
-        lod_seconds = lod_timestamp.hour * 3600 + lod_timestamp.minute * 60
-        lod_times_in_secs.append(lod_seconds)
-
-    hod_avg_time_sec = sum(hod_times_in_secs) / len(hod_times_in_secs)
-    lod_avg_time_sec = sum(lod_times_in_secs) / len(lod_times_in_secs)
-
-    avg_hod_time = str(timedelta(seconds = hod_avg_time_sec))
-    avg_hod_time = avg_hod_time[:5]
-    if avg_hod_time[-1] == ':':
-        avg_hod_time = avg_hod_time[:4]
-
-    avg_lod_time = str(timedelta(seconds = lod_avg_time_sec))
-    avg_lod_time = avg_lod_time[:5]
-    if avg_lod_time[-1] == ':':
-        avg_lod_time = avg_lod_time[:4]
-    
-    return avg_hod_time, avg_lod_time
-
-def get_gap_data(ticker, percent):
-    client = RESTClient("VxaBiHSENdZfJj1Ljm9dpoH5x7LYX1JF")
-    date2 = datetime.today()
-    date1 = (date2 - timedelta(days=5000)).date()
-    date2 = date2.date()
-
-    day_data = client.get_aggs(ticker, 1, "day", date1, date2)
-    day_data = pd.DataFrame(day_data)
-
-    multiple_timestamp_to_date(day_data)
-    day_data = day_data[['open', 'close', 'low', 'high', 'date']]
-    day_data['prev_close'] = day_data.close.shift(1)
-    day_data = day_data[1:]
+    #find the hod and lod times avgerage
+    avg_hod_time, avg_lod_time = await get_average_hod_lod_times(ticker, gap_data)
 
-    day_data['gap'] = day_data.open - day_data.prev_close
-    day_data['gap_percent'] = (day_data.open - day_data.prev_close)/day_data.prev_close
-    day_data.gap_percent *= 100
+    return await run_io(summarize_gap_days, gap_data, avg_hod_time, avg_lod_time)
 
+def find_gap_days(history, percent):
     #filter out the gap data that are above a certain gap percentage
-    gap_data = day_data[day_data.gap_percent > percent]
+    gap_data = pd.DataFrame(history[history['gap_percent'] > percent])
+    gap_data['date'] = gap_data.date.dt.date
+    return gap_data
 
+def summarize_gap_days(gap_data, avg_hod_time, avg_lod_time):
     #find the high/low compared to open percentage (then average these values)
     gap_data['high_percent'] = (gap_data.high - gap_data.open)/gap_data.open*100
     gap_data['low_percent'] = (gap_data.low - gap_data.open)/gap_data.open*100
     high_percent_avg = round(gap_data.high_percent.sum()/len(gap_data), 2)
     low_percent_avg = round(gap_data.low_percent.sum()/len(gap_data), 2)
 
-    #find the hod and lod times avgerage
-    avg_hod_time, avg_lod_time = get_average_hod_lod_times(ticker, gap_data)
-
     #find the average gap in dollars and gap percentage
     avg_gap = round((gap_data.gap.sum()/len(gap_data)),2)
     avg_gap_percent = round((gap_data.gap_percent.sum()/len(gap_data)),2)
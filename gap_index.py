@@ -0,0 +1,325 @@
+"""
+Gap Index Module
+Precomputed gap statistics for every ticker in the universe, sorted by gap size for /gap_screen
+"""
+import asyncio
+from collections import Counter
+from datetime import datetime, timedelta
+import numpy as np
+from tabulate import tabulate
+from config import (
+    GAP_UNIVERSE, GAP_INDEX_PATH, GAP_INDEX_DAYS, GAP_INDEX_TIMES_PERCENT, GAP_INDEX_TIMES_RETRIES,
+    GAP_FETCH_CONCURRENCY
+)
+from bar_store import eastern, is_session_closed, save_array, session_days
+from bars import MinuteBars, segment_stats, RTH_OPEN, RTH_CLOSE
+from daily_snapshot import get_daily_snapshot
+from gap_data import fetch_gap_day
+from jobs import run_io
+from singleflight import coalesce
+from scheduler import backoff_delay, current_priority, BULK
+from metrics import metrics, span
+
+# Column layout of the index, one row per ticker and session, sorted by gap_percent
+GAP_INDEX_DTYPE = np.dtype([
+    ('ticker', '<U16'),
+    ('date', 'datetime64[D]'),
+    ('gap_percent', '<f8'),
+    ('high_percent', '<f8'),   # High vs. open
+    ('low_percent', '<f8'),    # Low vs. open
+    ('close_percent', '<f8'),  # Close vs. open (sign is the close direction)
+    ('hod_minute', '<i2'),     # Eastern minute of day of the regular-session high, -1 if unknown
+    ('lod_minute', '<i2'),
+])
+
+# HOD/LOD lookups saved to disk at a time
+TIMES_BATCH = GAP_FETCH_CONCURRENCY * 8
+
+
+def gap_rows(snapshot, previous, universe=GAP_UNIVERSE):
+    """
+    Index rows for one session from its snapshot and the prior session's.
+
+    Args:
+        snapshot (DailySnapshot): The session's daily bars
+        previous (DailySnapshot): The prior session's daily bars
+        universe (list): Tickers to include; empty includes every ticker
+
+    Returns:
+        np.ndarray: Rows with dtype GAP_INDEX_DTYPE (HOD/LOD minutes unknown), unsorted
+    """
+    table = snapshot.table
+    if universe:
+        positions = snapshot.positions(universe)
+        table = table[np.unique(positions[positions >= 0])]
+    prev_positions = previous.positions(table['ticker'])
+    table = table[prev_positions >= 0]
+    prev_close = previous.table['close'][prev_positions[prev_positions >= 0]]
+
+    rows = np.empty(len(table), dtype=GAP_INDEX_DTYPE)
+    rows['ticker'] = table['ticker']
+    rows['date'] = snapshot.date
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rows['gap_percent'] = (table['open'] - prev_close) / prev_close * 100
+        rows['high_percent'] = (table['high'] - table['open']) / table['open'] * 100
+        rows['low_percent'] = (table['low'] - table['open']) / table['open'] * 100
+        rows['close_percent'] = (table['close'] - table['open']) / table['open'] * 100
+    rows['hod_minute'] = -1
+    rows['lod_minute'] = -1
+    return rows[np.isfinite(rows['gap_percent']) & np.isfinite(rows['close_percent'])]
+
+
+def extreme_minutes(minute_bars):
+    """
+    Minute of day of each session's first regular-session high and low.
+
+    Args:
+        minute_bars (list): One day of bars (BAR_DTYPE) per session
+
+    Returns:
+        tuple: (HOD minutes, LOD minutes) arrays, -1 where a day has no regular-session bars
+    """
+    hod = np.full(len(minute_bars), -1, dtype=np.int16)
+    lod = np.full(len(minute_bars), -1, dtype=np.int16)
+    for i, day in enumerate(minute_bars):
+        if not len(day):
+            continue
+        bars = MinuteBars.from_records(day)
+        starts, stops = bars.session_ranges(RTH_OPEN, RTH_CLOSE + 1)
+        stats = segment_stats(bars, starts[:1], stops[:1])
+        if stats['high_index'][0] >= 0:
+            hod[i] = bars.minute[stats['high_index'][0]]
+            lod[i] = bars.minute[stats['low_index'][0]]
+    return hod, lod
+
+
+def format_minute(minute):
+    return '-' if minute < 0 else f'{minute // 60:02d}:{minute % 60:02d}'
+
+
+def format_screen(rows):
+    """
+    Plain-text table of screened gaps.
+
+    Args:
+        rows (np.ndarray): Index rows, in display order
+
+    Returns:
+        str: Table with ticker, date, gap, high/low/close vs. open and HOD/LOD times
+    """
+    table = [
+        [row['ticker'], str(row['date']), f"{row['gap_percent']:+.1f}%",
+         f"{row['high_percent']:+.1f}%", f"{row['low_percent']:+.1f}%",
+         f"{row['close_percent']:+.1f}%", format_minute(row['hod_minute']), format_minute(row['lod_minute'])]
+        for row in rows
+    ]
+    return tabulate(table, headers=['ticker', 'date', 'gap', 'high', 'low', 'close', 'HOD', 'LOD'])
+
+
+class GapIndex:
+    """
+    Gap rows for the last GAP_INDEX_DAYS sessions of every ticker in the universe.
+
+    Rows are kept sorted by gap percent, so "gapped more than X%" is one
+    binary search and the biggest gappers are the ends of the array. The
+    index is saved as .npy and extended one session at a time.
+    """
+
+    def __init__(self, path=GAP_INDEX_PATH):
+        self.path = path
+        self._rows = None
+        self.attempted = set()  # (ticker, date) pairs whose HOD/LOD lookup is done or given up
+        self.failures = Counter()  # (ticker, date) pairs to failed HOD/LOD lookups
+
+    @property
+    def rows(self):
+        """Index rows sorted by gap percent, read from disk on first use."""
+        if self._rows is None:
+            try:
+                self._rows = np.load(self.path)
+            except (FileNotFoundError, ValueError):
+                self._rows = np.empty(0, dtype=GAP_INDEX_DTYPE)
+        return self._rows
+
+    def sessions(self):
+        """Indexed session dates, oldest first."""
+        return np.unique(self.rows['date'])
+
+    def replace(self, rows):
+        """Store a new set of rows, sorting them by gap percent."""
+        self._rows = rows[np.argsort(rows['gap_percent'], kind='stable')]
+
+    def save(self):
+        """Write the index to disk atomically."""
+        save_array(self.path, self.rows)
+
+    def screen(self, percent, days=1, direction='up'):
+        """
+        Find the sessions that gapped at least `percent` in the latest `days` sessions.
+
+        Args:
+            percent (float): Minimum gap size in percent
+            days (int): Number of most recent indexed sessions to search
+            direction (str): 'up' for gap ups, 'down' for gap downs
+
+        Returns:
+            np.ndarray: Matching rows, biggest gap first
+        """
+        rows = self.rows
+        if direction == 'down':
+            matches = rows[:np.searchsorted(rows['gap_percent'], -abs(percent), side='right')]
+        else:
+            matches = rows[np.searchsorted(rows['gap_percent'], abs(percent), side='left'):][::-1]
+
+        sessions = self.sessions()
+        if len(sessions) > days:
+            matches = matches[matches['date'] >= sessions[-days]]
+        return matches
+
+    def missing_times(self):
+        """Positions of big gaps whose HOD/LOD minute has not been looked up yet."""
+        rows = self.rows
+        candidates = np.flatnonzero(
+            (np.abs(rows['gap_percent']) >= GAP_INDEX_TIMES_PERCENT) & (rows['hod_minute'] < 0)
+        )
+        return [i for i in candidates if (rows['ticker'][i], str(rows['date'][i])) not in self.attempted]
+
+
+universe_index = GapIndex()
+metrics.register_gauge(
+    'gap_index_rows', 'Ticker sessions held in the gap index',
+    lambda: [({}, len(universe_index.rows))]
+)
+
+
+def recent_sessions(days):
+    """The last `days` + 1 closed weekdays, oldest first (one extra for the first previous close)."""
+    today = datetime.now(eastern).date()
+    weekdays = session_days(today - timedelta(days=(days + 1) * 7 // 5 + 7), today)
+    return [day for day in weekdays if is_session_closed(day)][-(days + 1):]
+
+
+@coalesce('gap_index')
+async def update_gap_index(days=GAP_INDEX_DAYS):
+    """
+    Add every closed session missing from the index and drop sessions that aged out.
+
+    Daily bars come from grouped snapshots, so a session costs one request
+    no matter how many tickers the universe holds. Each new session's
+    previous closes come from a snapshot fetched after it opened, so a split
+    on that day is not indexed as a gap. Big gaps' HOD/LOD minutes are looked
+    up afterwards in the background (see fill_extreme_minutes).
+
+    Args:
+        days (int): Sessions to keep
+
+    Returns:
+        GapIndex: The updated index
+    """
+    dates = recent_sessions(days)
+    priority = current_priority.set(BULK)
+    indexed = set(str(date) for date in universe_index.sessions())
+    try:
+        snapshots = await asyncio.gather(*[get_daily_snapshot(date) for date in dates])
+        snapshots = [snapshot for snapshot in snapshots if len(snapshot)]  # Market holidays are empty
+        pairs = [
+            (previous, snapshot) for previous, snapshot in zip(snapshots, snapshots[1:])
+            if snapshot.date not in indexed
+        ]
+        previous_closes = await asyncio.gather(*[
+            get_daily_snapshot(previous.date, adjusted_for=snapshot.date) for previous, snapshot in pairs
+        ])
+    finally:
+        current_priority.reset(priority)
+
+    keep = np.array([snapshot.date for snapshot in snapshots[1:]], dtype='datetime64[D]')
+    with span('transform'):
+        fresh = [
+            gap_rows(snapshot, previous)
+            for previous, (_, snapshot) in zip(previous_closes, pairs)
+        ]
+        rows = universe_index.rows
+        stale = ~np.isin(rows['date'], keep)
+        if fresh or stale.any():
+            universe_index.replace(np.concatenate([rows[~stale], *fresh]))
+            universe_index.save()
+
+    if universe_index.missing_times():
+        schedule_extreme_minutes()
+    return universe_index
+
+
+async def fill_extreme_minutes():
+    """
+    Look up the HOD/LOD minute of every big gap in the index.
+
+    Minute bars are fetched at bulk priority, at most GAP_FETCH_CONCURRENCY
+    at once, and the index is saved after every batch so progress survives
+    a restart. The days are not kept in the minute bar store: most belong to
+    tickers nobody charts, and they would evict the days commands reuse.
+
+    A day is done once its bars arrive, even if it has no regular-session
+    bars. Failed lookups stay pending and are retried after a backoff, up
+    to GAP_INDEX_TIMES_RETRIES times.
+    """
+    semaphore = asyncio.Semaphore(GAP_FETCH_CONCURRENCY)
+    priority = current_priority.set(BULK)
+    attempt = 0
+    try:
+        while True:
+            pending = universe_index.missing_times()[:TIMES_BATCH]
+            if not pending:
+                return
+            rows = universe_index.rows
+            keys = [(rows['ticker'][i], str(rows['date'][i])) for i in pending]
+            results = await asyncio.gather(
+                *[fetch_gap_day(ticker, day, semaphore, save=False) for ticker, day in keys],
+                return_exceptions=True
+            )
+            fetched, minute_bars = [], []
+            for key, result in zip(keys, results):
+                if isinstance(result, Exception):
+                    universe_index.failures[key] += 1
+                    if universe_index.failures[key] < GAP_INDEX_TIMES_RETRIES:
+                        continue
+                    print(f'Giving up on HOD/LOD times of {key[0]} {key[1]}: {result}')
+                else:
+                    fetched.append(key)
+                    minute_bars.append(result)
+                universe_index.attempted.add(key)
+                universe_index.failures.pop(key, None)
+            keys = fetched
+            hod, lod = await run_io(extreme_minutes, minute_bars)
+
+            # The rows may have been re-sorted by an update meanwhile, so match them by key
+            rows = universe_index.rows
+            found = {key: (h, l) for key, h, l in zip(keys, hod, lod) if h >= 0}
+            for i in np.flatnonzero(np.isin(rows['ticker'], [ticker for ticker, _ in found]) & (rows['hod_minute'] < 0)):
+                times = found.get((rows['ticker'][i], str(rows['date'][i])))
+                if times is not None:
+                    rows['hod_minute'][i], rows['lod_minute'][i] = times
+            universe_index.save()
+
+            if len(fetched) < len(results):
+                await asyncio.sleep(backoff_delay(attempt))
+                attempt += 1
+            else:
+                attempt = 0
+    finally:
+        current_priority.reset(priority)
+
+
+_times_task = None
+
+
+def schedule_extreme_minutes():
+    """Start fill_extreme_minutes in the background unless it is already running."""
+    global _times_task
+    if _times_task is None or _times_task.done():
+        _times_task = asyncio.create_task(fill_extreme_minutes())
+
+
+def stop_extreme_minutes():
+    """Cancel the background HOD/LOD lookup (on shutdown)."""
+    if _times_task is not None:
+        _times_task.cancel()
@@ -0,0 +1,197 @@
+"""
+Job Execution Module
+Runs blocking work off the Discord event loop with per-guild fairness
+"""
+import asyncio
+import contextvars
+import functools
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from config import CPU_WORKERS, IO_WORKERS, MAX_PENDING_JOBS, MAX_PENDING_JOBS_PER_GUILD
+from renderer import RenderPool
+from metrics import metrics, span
+
+# Guild the current command runs for; set by each slash-command handler
+current_guild = contextvars.ContextVar('current_guild', default=None)
+
+
+class JobQueueFull(Exception):
+    """Raised when a guild, or the bot as a whole, has too many jobs waiting."""
+
+
+class JobLane:
+    """
+    Bounded, guild-fair queue in front of an executor.
+
+    Each guild gets its own FIFO. Whenever a worker frees up the lane takes
+    the next job from the guild at the front of the rotation and moves that
+    guild to the back, so one guild queueing a batch of charts cannot starve
+    the others.
+    """
+
+    def __init__(self, name, executor_factory, workers, max_pending, max_pending_per_guild):
+        self.name = name
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_pending_per_guild = max_pending_per_guild
+        self._executor_factory = executor_factory
+        self._executor = None
+        self._queues = OrderedDict()
+        self._pending = 0
+        self._active = 0
+
+    @property
+    def pending(self):
+        """Number of jobs waiting for a worker."""
+        return self._pending
+
+    @property
+    def active(self):
+        """Number of jobs currently running."""
+        return self._active
+
+    def submit(self, guild, fn, args):
+        """
+        Queue a job and return an asyncio future for its result.
+
+        Args:
+            guild (int): Guild the job runs for (None for DMs)
+            fn (callable): Blocking function to run
+            args (tuple): Positional arguments for fn
+
+        Returns:
+            asyncio.Future: Resolves with fn's return value
+
+        Raises:
+            JobQueueFull: If the lane or the guild's queue is at capacity
+        """
+        queue = self._queues.get(guild)
+        if self._pending >= self.max_pending:
+            raise JobQueueFull(f'{self.name} queue is full ({self._pending} jobs waiting)')
+        if queue is not None and len(queue) >= self.max_pending_per_guild:
+            raise JobQueueFull(f'{self.name} queue for guild {guild} is full')
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queues.setdefault(guild, deque()).append((future, fn, args))
+        self._pending += 1
+        self._pump(loop)
+        return future
+
+    def _pump(self, loop):
+        """Start queued jobs while workers are free, rotating between guilds."""
+        while self._active < self.workers and self._queues:
+            guild, queue = next(iter(self._queues.items()))
+            future, fn, args = queue.popleft()
+            self._pending -= 1
+            if queue:
+                self._queues.move_to_end(guild)
+            else:
+                del self._queues[guild]
+
+            if future.cancelled():
+                continue
+
+            self.start()
+            self._active += 1
+            job = loop.run_in_executor(self._executor, fn, *args)
+            job.add_done_callback(functools.partial(self._finish, loop, future))
+
+    def _finish(self, loop, future, job):
+        """Hand a finished job's outcome to its caller and start the next one."""
+        self._active -= 1
+        if not future.cancelled():
+            if job.cancelled():
+                future.cancel()
+            elif job.exception() is not None:
+                future.set_exception(job.exception())
+            else:
+                future.set_result(job.result())
+        self._pump(loop)
+
+    def start(self):
+        """Create the executor now rather than on the first job."""
+        if self._executor is None:
+            self._executor = self._executor_factory(self.workers)
+
+    def shutdown(self):
+        """Stop the executor without waiting for running jobs."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+# CPU-bound work (chart rendering) runs in warm render processes; short
+# blocking work (pandas reductions, spreadsheet export) runs on threads.
+cpu_lane = JobLane(
+    'render',
+    lambda workers: RenderPool(workers),
+    CPU_WORKERS, MAX_PENDING_JOBS, MAX_PENDING_JOBS_PER_GUILD
+)
+io_lane = JobLane(
+    'io',
+    lambda workers: ThreadPoolExecutor(max_workers=workers, thread_name_prefix='stockbot-io'),
+    IO_WORKERS, MAX_PENDING_JOBS, MAX_PENDING_JOBS_PER_GUILD
+)
+
+
+async def run_cpu(fn, *args):
+    """
+    Run a CPU-bound, picklable function in the warm render process pool.
+
+    Args:
+        fn (callable): Module-level function to run
+        *args: Picklable positional arguments
+
+    Returns:
+        Any: fn's return value
+    """
+    with span('render'):
+        return await cpu_lane.submit(current_guild.get(), fn, args)
+
+
+async def run_io(fn, *args):
+    """
+    Run a blocking function on the I/O thread pool.
+
+    Args:
+        fn (callable): Function to run
+        *args: Positional arguments
+
+    Returns:
+        Any: fn's return value
+    """
+    with span('transform'):
+        return await io_lane.submit(current_guild.get(), fn, args)
+
+
+def lane_status():
+    """Jobs waiting and running in each lane, as (labels, value) metric samples."""
+    return [
+        ({'lane': lane.name, 'state': state}, count)
+        for lane in (cpu_lane, io_lane)
+        for state, count in (('pending', lane.pending), ('active', lane.active))
+    ]
+
+
+def render_status():
+    """Render pool health, as (labels, value) metric samples."""
+    if cpu_lane._executor is None:
+        return []
+    return [({'state': state}, count) for state, count in cpu_lane._executor.status().items()]
+
+
+metrics.register_gauge('jobs', 'Jobs waiting and running per pool', lane_status)
+metrics.register_gauge('render_workers', 'Render worker processes and restarts', render_status)
+
+
+def start():
+    """Start both worker pools so render workers are warm before the first command."""
+    cpu_lane.start()
+    io_lane.start()
+
+
+def shutdown():
+    """Shut down both worker pools."""
+    cpu_lane.shutdown()
+    io_lane.shutdown()
@@ -2,48 +2,131 @@
 Discord Stock Bot
 Real-time stock market data bot with candlestick charts and gap analysis
 """
-import os
+import asyncio
+import io
+import sys
+import traceback
 import discord
 from discord.ext import commands
 from discord.commands import Option
-from candle_chart import make_daily_candle_chart, timespan_candle_chart, make_candle_chart
-from stock_data import get_ticker_data
-from gap_data import get_gap_data
+from polygon_client import close_client
+import reference_data
+import streaming
+from alerts import alert_engine, ALERT_KINDS
+import jobs
+from jobs import current_guild, JobQueueFull
+import worker
+from worker import run_job
+from metrics import metrics, span
 from datetime import datetime, date as d
-import pandas as pd
 from pytz import timezone
-from config import DISCORD_TOKEN, GUILD_IDS, TIMEZONE, MAX_DAYS_HISTORICAL, EXCEL_OUTPUT_FILE
+from config import (
+    DISCORD_TOKEN, GUILD_IDS, TIMEZONE, MAX_DAYS_HISTORICAL, DISCORD_MESSAGE_LIMIT, METRICS_PORT,
+    GAP_INDEX_DAYS, GAP_SCREEN_LIMIT, STREAM_TICKERS, JOB_QUEUE_ADDRESS,
+    EXCEL_FILENAME, CHART_FILENAME, DAILY_CHART_FILENAME, STATS_FILENAME, GAP_SCREEN_FILENAME
+)
 
 tz = timezone(TIMEZONE)
 
-intents = discord.Intents.default()
-bot = commands.Bot(intents=intents)
+BUSY_MESSAGE = ':hourglass: The bot is busy right now, please try again in a moment.'
+
+# The chart, stock data and gap modules pull in pandas. Commands reach them
+# through worker.run_job (in this process, or on the worker tier when
+# JOB_QUEUE_ADDRESS is set) or import them on first use, so the bot connects
+# without paying for them.
+
+
+class StockBot(commands.Bot):
+    """Bot that starts background work once connected and releases it (pools, workers, endpoints) on shutdown."""
+
+    async def on_ready(self):
+        """Event handler for bot startup."""
+        import gap_index
+        if JOB_QUEUE_ADDRESS:
+            worker.start_dispatcher()
+        else:
+            jobs.start()
+        await metrics.start_server(METRICS_PORT)
+        asyncio.create_task(reference_data.warm_up())
+        asyncio.create_task(gap_index.update_gap_index())
+        if STREAM_TICKERS:
+            streaming.start(STREAM_TICKERS)
+        await alert_engine.start(self.deliver_alert)
+        print(f'We have logged in as {self.user}')
+
+    async def deliver_alert(self, channel_id, text):
+        """Send triggered alerts to the channel they were created in."""
+        channel = self.get_channel(channel_id) or await self.fetch_channel(channel_id)
+        await channel.send(text)
+
+    async def on_application_command_error(self, ctx, error):
+        """Tell users to retry when the job pools are saturated, and never leave a command unanswered."""
+        metrics.record_command_error(ctx.command.qualified_name)
+        original = getattr(error, 'original', error)
+        if isinstance(original, JobQueueFull):
+            await ctx.respond(BUSY_MESSAGE)
+            return
+        traceback.print_exception(type(error), error, error.__traceback__)
+        try:
+            await ctx.respond(':x: Something went wrong with this command, please try again later.')
+        except discord.HTTPException as err:
+            print(f'Could not report the error to the user: {err}')
+
+    async def close(self):
+        import gap_index
+        gap_index.stop_extreme_minutes()
+        worker.stop_dispatcher()
+        await alert_engine.stop()
+        await streaming.stream.stop()
+        await metrics.stop_server()
+        await close_client()
+        jobs.shutdown()
+        await super().close()
+
+
+def format_failures(failures):
+    """
+    Describe the tickers a multi-ticker request could not fetch.
+
+    Args:
+        failures (list): (ticker, reason) pairs
+
+    Returns:
+        str: e.g. 'XYZ (data not found), ABC (timed out)'
+    """
+    return ', '.join(f'{ticker} ({reason})' for ticker, reason in failures)
 
 
-def df_to_excel(dfs):
+def image_file(image, filename):
     """
-    Combine multiple DataFrames and export to Excel.
+    Wrap rendered image bytes as a Discord attachment.
 
     Args:
-        dfs (list): List of pandas DataFrames to combine
+        image (bytes): Encoded image
+        filename (str): Attachment name shown in Discord
+
+    Returns:
+        discord.File: Attachment backed by an in-memory buffer
     """
-    combined_df = pd.concat(dfs)
-    if os.path.exists(EXCEL_OUTPUT_FILE):
-        os.remove(EXCEL_OUTPUT_FILE)
-    combined_df.to_excel(EXCEL_OUTPUT_FILE, index=False)
+    return discord.File(io.BytesIO(image), filename=filename)
 
 
-@bot.event
-async def on_ready():
-    """Event handler for bot startup."""
-    print(f'We have logged in as {bot.user}')
+async def begin_command_metrics(ctx):
+    """Attribute the command's fetch/transform/render/upload time to it."""
+    metrics.begin_command(ctx.command.qualified_name)
 
 
-@bot.slash_command(name="stock_data", description='Get Stock Data in Excel')
+async def end_command_metrics(ctx):
+    """Record the command's total latency."""
+    metrics.end_command()
+
+
+@discord.slash_command(name="stock_data", description='Get Stock Data in Excel')
 async def stock_data(
     ctx,
     ticker: Option(str, description="Stock Symbols (separate with space)", required=True),
-    date: Option(str, description='(YYYY-MM-DD)', required=False)
+    date: Option(str, description='(YYYY-MM-DD)', required=False),
+    end_date: Option(str, description='Range end (YYYY-MM-DD), one row per trading day', required=False)
 ):
     """
     Fetch and export stock data for multiple tickers to Excel.
@@ -51,12 +134,17 @@ async def stock_data(
     Args:
         ticker: Space-separated stock symbols
         date: Date in YYYY-MM-DD format (defaults to today)
+        end_date: Optional last date; every trading day from date to end_date gets a row
     """
-    DATAFRAMES = []
+    current_guild.set(ctx.guild_id)
 
     if date is None:
         date = str(datetime.now(tz).date())
 
+    if end_date is not None and end_date < date:
+        await ctx.respond(":x: End date must not be before the start date")
+        return
+
     # Validate date is within allowed range
     time_between = d.today() - d(
         int(date.split("-")[0]),
@@ -69,30 +157,32 @@ async def stock_data(
         return
 
     tickers = ticker.split()
-    await ctx.send(f"Stocks: {tickers}, Date: {date}")
+    if end_date is None:
+        await ctx.send(f"Stocks: {tickers}, Date: {date}")
+    else:
+        await ctx.send(f"Stocks: {tickers}, Dates: {date} to {end_date}")
     await ctx.defer()
 
-    # Fetch data for each ticker
-    for ticker_symbol in tickers:
-        try:
-            response = get_ticker_data(ticker=ticker_symbol, date=date)
-        except Exception as err:
-            print(f"Error fetching {ticker_symbol}: {err}")
-            await ctx.respond(f'Data not found, {ticker_symbol}')
-            return
+    # Fetch every ticker concurrently and export to Excel; failures are reported, not fatal
+    workbook, failures = await run_job('stock_data', tickers, date, end_date)
 
-        if response.empty:
+    if workbook is None:
+        reasons = {reason for _, reason in failures}
+        if reasons == {'bot busy'}:
+            await ctx.respond(BUSY_MESSAGE)
+        elif reasons == {'market not closed yet'}:
             await ctx.respond('Please wait until market close...')
-            return
-
-        DATAFRAMES.append(response)
+        else:
+            await ctx.respond(f':x: No data for {format_failures(failures)}')
+        return
 
-    # Export to Excel and send file
-    df_to_excel(DATAFRAMES)
-    await ctx.respond(file=discord.File(EXCEL_OUTPUT_FILE))
+    with span('upload'):
+        await ctx.respond(file=discord.File(io.BytesIO(workbook), filename=EXCEL_FILENAME))
+    if failures:
+        await ctx.send(f':warning: Missing from the spreadsheet: {format_failures(failures)}')
 
 
-@bot.slash_command(
+@discord.slash_command(
     guild_ids=GUILD_IDS,
     description='Get Candle Stick Chart with Timeframe'
 )
@@ -106,16 +196,27 @@ async def timerange_candle_stick_chart(
     """
     Generate candlestick chart for a specific intraday time range.
     """
+    current_guild.set(ctx.guild_id)
     if date is None:
         date = str(datetime.now(tz).date())
 
     tickers = ticker.split()
+    await ctx.defer()
     for t in tickers:
-        make_candle_chart(t, date, time1, time2)
-        await ctx.respond(file=discord.File('timeframe_chart.jpeg'))
+        try:
+            image = await run_job('candle_chart', t, date, time1, time2)
+        except JobQueueFull:
+            await ctx.respond(BUSY_MESSAGE)
+            return
+        except Exception as err:
+            print(f"Error generating chart for {t}: {err}")
+            await ctx.respond(f'Data not found, {t}')
+            continue
+        with span('upload'):
+            await ctx.respond(file=image_file(image, CHART_FILENAME))
 
 
-@bot.slash_command(
+@discord.slash_command(
     guild_ids=GUILD_IDS,
     description='Get Daily Candle Stick Chart'
 )
@@ -127,19 +228,31 @@ async def daily_candle_stick_chart(
     """
     Generate full-day candlestick chart.
     """
+    current_guild.set(ctx.guild_id)
     if date is None:
         date = str(datetime.now(tz).date())
 
     tickers = ticker.split()
+    await ctx.defer()
     for t in tickers:
-        make_daily_candle_chart(t, date)
+        try:
+            image = await run_job('daily_candle_chart', t, date)
+        except JobQueueFull:
+            await ctx.respond(BUSY_MESSAGE)
+            return
+        except Exception as err:
+            print(f"Error generating chart for {t}: {err}")
+            await ctx.respond(f'Data not found, {t}')
+            continue
+        with span('upload'):
+            await ctx.respond(file=image_file(image, DAILY_CHART_FILENAME))
 
 
-@bot.slash_command(name="chart", description='Candle Stick Chart with Time Intervals')
+@discord.slash_command(name="chart", description='Candle Stick Chart with Time Intervals')
 async def chart(
     ctx,
     ticker: Option(str, description="Stock Symbols (separate with space)", required=True),
-    timeframe: Option(str, description='minute/hour/day/week', required=True),
+    timeframe: Option(str, description='Bar timespan', choices=['minute', 'hour', 'day', 'week'], required=True),
     unit: Option(str, description='number of timespans', required=True),
     date: Option(str, description='YYYY-MM-DD', default=None),
     more_data: Option(str, description='yes/no', required=False)
@@ -147,6 +260,7 @@ async def chart(
     """
     Generate customized candlestick charts with various time intervals.
     """
+    current_guild.set(ctx.guild_id)
     if date is None:
         date_obj = datetime.now(tz=tz)
     else:
@@ -164,9 +278,10 @@ async def chart(
 
     for idx, t in enumerate(tickers):
         try:
-            ticker_result, date_copy, mult, ts = timespan_candle_chart(
-                t, multiplier, timespan, date=date_obj, more_data=more
-            )
+            image = await run_job('timespan_chart', t, multiplier, timespan, str(date_obj.date()), more)
+        except JobQueueFull:
+            await ctx.respond(BUSY_MESSAGE)
+            return
         except Exception as err:
             print(f"Error generating chart for {t}: {err}")
             await ctx.respond(f'Data not found, {t}')
@@ -175,12 +290,12 @@ async def chart(
         if idx == 0:
             await ctx.respond('Charts:')
 
-        chart_filename = f'{ticker_result}-{date_copy}-{mult}{ts}.jpeg'
-        await ctx.send(file=discord.File(chart_filename))
-        os.remove(chart_filename)
+        chart_filename = f'{t}-{date_obj.date()}-{multiplier}{timespan}.jpeg'
+        with span('upload'):
+            await ctx.send(file=image_file(image, chart_filename))
 
 
-@bot.slash_command(name="gap_stats", description='Get Gap Stats Above Certain Percentage')
+@discord.slash_command(name="gap_stats", description='Get Gap Stats Above Certain Percentage')
 async def gap_stats(
     ctx,
     ticker: Option(str, description="Stock Symbol", required=True),
@@ -189,30 +304,35 @@ async def gap_stats(
     """
     Analyze gap statistics for stocks with gaps above a certain percentage.
     """
+    current_guild.set(ctx.guild_id)
     percent_value = int(percent)
     await ctx.defer()
 
     try:
-        results = get_gap_data(ticker, percent_value)
+        results = await run_job('gap_stats', ticker, percent_value)
         await ctx.respond(f"Ticker: {ticker} | Percent: {percent_value}")
+    except JobQueueFull:
+        await ctx.respond(BUSY_MESSAGE)
+        return
     except Exception as err:
         print(f"Error getting gap data: {err}")
         await ctx.respond("No Data Found")
         return
 
     # Extract gap statistics
-    dates = results['dates'].iloc[0]
-    count = results['count'].iloc[0]
-    avg_gap = results['avg_gap'].iloc[0]
-    close_greater_open = results['close_greater_open'].iloc[0]
-    close_lesser_open = results['close_lesser_open'].iloc[0]
-    avg_hod = results['avg_hod'].iloc[0]
-    avg_lod = results['avg_lod'].iloc[0]
-    avg_high_low = results['avg_high_low'].iloc[0]
-    avg_green_performance = results['avg_green_performance'].iloc[0]
-    avg_red_performance = results['avg_red_performance'].iloc[0]
-
-    await ctx.send(f"""
+    dates = results['dates']
+    count = results['count']
+    avg_gap = results['avg_gap']
+    close_greater_open = results['close_greater_open']
+    close_lesser_open = results['close_lesser_open']
+    avg_hod = results['avg_hod']
+    avg_lod = results['avg_lod']
+    avg_high_low = results['avg_high_low']
+    avg_green_performance = results['avg_green_performance']
+    avg_red_performance = results['avg_red_performance']
+
+    with span('upload'):
+        await ctx.send(f"""
 ----------------------------------------
 *Dates*:  {dates}
 ----------------------------------------
@@ -237,5 +357,159 @@ async def gap_stats(
     """)
 
 
-# Start the bot
-bot.run(DISCORD_TOKEN)
+@discord.slash_command(name="gap_screen", description='Tickers that gapped beyond a percentage in recent sessions')
+async def gap_screen(
+    ctx,
+    percent: Option(float, description='Minimum gap size in percent', required=True),
+    days: Option(int, description=f'Sessions to search, 1 = latest (max {GAP_INDEX_DAYS})', default=1),
+    direction: Option(str, description='Gap direction', choices=['up', 'down'], default='up')
+):
+    """
+    Screen the precomputed gap index for the biggest gaps across the ticker universe.
+
+    Args:
+        percent: Minimum gap size in percent
+        days: Number of most recent sessions to search
+        direction: 'up' for gap ups, 'down' for gap downs
+    """
+    import gap_index
+    current_guild.set(ctx.guild_id)
+    if not 1 <= days <= GAP_INDEX_DAYS:
+        await ctx.respond(f':x: Days must be between 1 and {GAP_INDEX_DAYS}')
+        return
+    await ctx.defer()
+
+    try:
+        index = await gap_index.update_gap_index()
+    except JobQueueFull:
+        await ctx.respond(BUSY_MESSAGE)
+        return
+    except Exception as err:
+        print(f"Error updating gap index: {err}")
+        await ctx.respond("No Data Found")
+        return
+
+    matches = index.screen(percent, days, direction)
+    if not len(matches):
+        await ctx.respond(f'No gaps {direction} of {percent}% or more in the last {days} session(s)')
+        return
+
+    title = f'Gaps {direction} >= {percent}% in the last {days} session(s): {len(matches)}'
+    if len(matches) > GAP_SCREEN_LIMIT:
+        title += f' (top {GAP_SCREEN_LIMIT})'
+    table = gap_index.format_screen(matches[:GAP_SCREEN_LIMIT])
+    message = f'{title}\n```\n{table}\n```'
+    with span('upload'):
+        if len(message) <= DISCORD_MESSAGE_LIMIT:
+            await ctx.respond(message)
+        else:
+            await ctx.respond(title, file=discord.File(io.BytesIO(table.encode()), filename=GAP_SCREEN_FILENAME))
+
+
+alert = discord.SlashCommandGroup("alert", "Price and gap alerts")
+
+
+@alert.command(name="add", description='Get pinged when a ticker crosses a price or gaps past a percentage')
+async def alert_add(
+    ctx,
+    ticker: Option(str, description="Stock Symbol", required=True),
+    kind: Option(str, description='above/below a price, or gap_up/gap_down at the open', choices=list(ALERT_KINDS), required=True),
+    value: Option(float, description='Price level, or gap size in percent', required=True)
+):
+    """
+    Subscribe to a price-level or gap alert, delivered in this channel.
+
+    Args:
+        ticker: Stock symbol
+        kind: 'above', 'below', 'gap_up' or 'gap_down'
+        value: Price level, or gap size in percent for gap alerts
+    """
+    try:
+        entry, created = alert_engine.add(ctx.author.id, ctx.channel_id, ctx.guild_id, ticker, kind, value)
+    except ValueError as err:
+        await ctx.respond(f':x: {err}', ephemeral=True)
+        return
+    await streaming.follow([entry.ticker])
+    status = 'Alert set' if created else 'You already have this alert'
+    await ctx.respond(f':bell: {status}: {entry.describe()}', ephemeral=True)
+
+
+@alert.command(name="list", description='Show your alerts')
+async def alert_list(ctx):
+    """
+    List the caller's alerts with their numbers.
+    """
+    entries = alert_engine.for_user(ctx.author.id)
+    if not entries:
+        await ctx.respond('You have no alerts', ephemeral=True)
+        return
+    lines = [entry.describe() for entry in entries]
+    await ctx.respond(f'Your alerts ({len(entries)}):\n' + '\n'.join(lines)[:DISCORD_MESSAGE_LIMIT - 30], ephemeral=True)
+
+
+@alert.command(name="remove", description='Remove one of your alerts')
+async def alert_remove(
+    ctx,
+    number: Option(int, description='Alert number from /alert list', required=True)
+):
+    """
+    Delete one of the caller's alerts.
+
+    Args:
+        number: Alert number shown by /alert list
+    """
+    entry = alert_engine.remove(number, ctx.author.id)
+    if entry is None:
+        await ctx.respond(f':x: You have no alert #{number}', ephemeral=True)
+        return
+    await ctx.respond(f'Removed {entry.describe()}', ephemeral=True)
+
+
+@discord.slash_command(name="bot_stats", description='Latency, upstream and cache statistics (admins only)')
+@discord.default_permissions(administrator=True)
+async def bot_stats(ctx):
+    """
+    Report per-command latency, stage timings, Polygon traffic and cache hit rates.
+    """
+    if ctx.guild is None or not ctx.author.guild_permissions.administrator:
+        await ctx.respond(':x: Only server administrators can view bot stats', ephemeral=True)
+        return
+
+    report = metrics.report()
+    if len(report) + 8 <= DISCORD_MESSAGE_LIMIT:
+        await ctx.respond(f'```\n{report}\n```', ephemeral=True)
+    else:
+        await ctx.respond(file=discord.File(io.BytesIO(report.encode()), filename=STATS_FILENAME), ephemeral=True)
+
+
+def create_bot():
+    """
+    Build the bot with every slash command registered.
+
+    Nothing connects to Discord until run() is called, so the module can be
+    imported (and bots created) by tests and tools.
+
+    Returns:
+        StockBot: Bot ready to run
+    """
+    bot = StockBot(intents=discord.Intents.default())
+    for command in (stock_data, timerange_candle_stick_chart, daily_candle_stick_chart, chart,
+                    gap_stats, gap_screen, alert, bot_stats):
+        bot.add_application_command(command)
+    bot.before_invoke(begin_command_metrics)
+    bot.after_invoke(end_command_metrics)
+    return bot
+
+
+def main():
+    """Build the bot and connect to Discord."""
+    if JOB_QUEUE_ADDRESS:
+        try:
+            worker.check_authkey()
+        except RuntimeError as err:
+            sys.exit(str(err))
+    create_bot().run(DISCORD_TOKEN)
+
+
+if __name__ == '__main__':
+    main()
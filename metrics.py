@@ -0,0 +1,358 @@
+"""
+Metrics Module
+In-memory timing histograms and counters, reported by /bot_stats and as Prometheus text
+"""
+import bisect
+import contextlib
+import contextvars
+import functools
+import time
+from collections import Counter, deque
+from urllib.parse import urlsplit
+import numpy as np
+from aiohttp import web
+from config import METRICS_WINDOW
+
+# Upper bounds (seconds) of the cumulative Prometheus histogram buckets
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Slash command the current task runs for; set by the bot's before-invoke hook
+current_command = contextvars.ContextVar('current_command', default=None)
+_command_started = contextvars.ContextVar('command_started', default=None)
+
+
+class Histogram:
+    """
+    Latency histogram with lifetime buckets and a rolling sample window.
+
+    Buckets, count and sum cover the whole process lifetime (what Prometheus
+    expects). Percentiles are taken over the most recent `window` samples so
+    they follow current behaviour rather than averaging in last week.
+    """
+
+    def __init__(self, window=METRICS_WINDOW):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, seconds):
+        """Record one duration in seconds."""
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.recent.append(seconds)
+
+    def percentiles(self, quantiles=(50, 95, 99)):
+        """
+        Percentiles of the recent samples.
+
+        Args:
+            quantiles (tuple): Percentiles to compute (0-100)
+
+        Returns:
+            list: Seconds per percentile, or Nones when nothing was recorded
+        """
+        if not self.recent:
+            return [None] * len(quantiles)
+        return list(np.percentile(self.recent, quantiles))
+
+
+def endpoint_name(url):
+    """
+    Collapse a Polygon URL into a low-cardinality endpoint label.
+
+    Args:
+        url (str): Request path or absolute URL
+
+    Returns:
+        str: e.g. 'aggs_minute', 'aggs_day', 'ticker_details'
+    """
+    parts = urlsplit(url).path.strip('/').split('/')
+    if len(parts) > 1 and parts[1] == 'aggs':
+        if 'grouped' in parts:
+            return 'aggs_grouped'
+        return f'aggs_{parts[6]}' if len(parts) > 6 else 'aggs'
+    if parts[1:3] == ['reference', 'tickers']:
+        return 'ticker_details' if len(parts) > 3 else 'tickers'
+    return '_'.join(parts[1:3]) or 'unknown'
+
+
+def _labels(labels):
+    """Format a label dict the way Prometheus expects."""
+    if not labels:
+        return ''
+    pairs = ','.join(f'{key}="{value}"' for key, value in labels.items())
+    return f'{{{pairs}}}'
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+class Metrics:
+    """
+    Registry for everything the bot measures about itself.
+
+    Histograms are grouped into families (command, span, function,
+    upstream), each keyed by a tuple of label values. Other modules register
+    callbacks reporting their own counters (cache hits, queue depth, ...),
+    so this module never imports them.
+    """
+
+    HISTOGRAM_LABELS = {
+        'command': ('command',),
+        'span': ('command', 'stage'),
+        'function': ('function',),
+        'upstream': ('endpoint',),
+    }
+
+    def __init__(self, window=METRICS_WINDOW):
+        self.window = window
+        self.started = time.time()
+        self.histograms = {family: {} for family in self.HISTOGRAM_LABELS}
+        self.upstream_requests = Counter()
+        self.upstream_bytes = Counter()
+        self.command_errors = Counter()
+        self._caches = {}
+        self._gauges = {}
+        self._runner = None
+
+    def observe(self, family, key, seconds):
+        """
+        Record a duration.
+
+        Args:
+            family (str): Histogram family (see HISTOGRAM_LABELS)
+            key (tuple): Label values in the family's label order
+            seconds (float): Duration
+        """
+        histogram = self.histograms[family].get(key)
+        if histogram is None:
+            histogram = self.histograms[family][key] = Histogram(self.window)
+        histogram.observe(seconds)
+
+    @contextlib.contextmanager
+    def span(self, stage):
+        """
+        Time a block as one stage (fetch, transform, render, upload) of the current command.
+
+        Args:
+            stage (str): Stage name
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            command = current_command.get() or 'background'
+            self.observe('span', (command, stage), time.perf_counter() - started)
+
+    def timed(self, name):
+        """
+        Decorator timing every call of an async data function.
+
+        Args:
+            name (str): Function label
+
+        Returns:
+            callable: Decorator
+        """
+        def decorator(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    self.observe('function', (name,), time.perf_counter() - started)
+            return wrapper
+        return decorator
+
+    def begin_command(self, name):
+        """Mark the start of a slash command in the current task."""
+        current_command.set(name)
+        _command_started.set(time.perf_counter())
+
+    def end_command(self):
+        """Record the duration of the slash command started in the current task."""
+        started = _command_started.get()
+        if started is not None:
+            self.observe('command', (current_command.get(),), time.perf_counter() - started)
+
+    def record_command_error(self, name):
+        """Count a slash command that ended in an unhandled error."""
+        self.command_errors[name] += 1
+
+    def record_upstream(self, url, status, size, seconds):
+        """
+        Record one Polygon request.
+
+        Args:
+            url (str): Request path or URL
+            status (int): HTTP status
+            size (int): Response body bytes
+            seconds (float): Time until the body was read
+        """
+        endpoint = endpoint_name(url)
+        self.upstream_requests[(endpoint, status)] += 1
+        self.upstream_bytes[endpoint] += size
+        self.observe('upstream', (endpoint,), seconds)
+
+    def register_cache(self, name, collect):
+        """
+        Report a cache's hit rate.
+
+        Args:
+            name (str): Cache label
+            collect (callable): Returns (hits, misses)
+        """
+        self._caches[name] = collect
+
+    def register_gauge(self, name, help_text, collect):
+        """
+        Report a value sampled when metrics are read.
+
+        Args:
+            name (str): Metric name (without the stockbot_ prefix)
+            help_text (str): One-line description
+            collect (callable): Returns a list of (labels dict, value)
+        """
+        self._gauges[name] = (help_text, collect)
+
+    def report(self):
+        """
+        Plain-text summary for /bot_stats.
+
+        Returns:
+            str: Tables of command, stage, function and upstream latency,
+                cache hit rates and gauges
+        """
+        from tabulate import tabulate  # Only needed for /bot_stats, so not loaded at startup
+        sections = [f'uptime {int(time.time() - self.started)}s, percentiles over the last {self.window} samples']
+
+        def latency_rows(family):
+            rows = []
+            for key, histogram in sorted(self.histograms[family].items()):
+                p50, p95, p99 = histogram.percentiles()
+                rows.append([*key, histogram.count, _ms(p50), _ms(p95), _ms(p99)])
+            return rows
+
+        latency_headers = ['n', 'p50 ms', 'p95 ms', 'p99 ms']
+        rows = [[*row, self.command_errors[row[0]]] for row in latency_rows('command')]
+        if rows:
+            sections.append(f'Commands\n{tabulate(rows, headers=["command", *latency_headers, "errors"])}')
+        for family, title in (('span', 'Stages'), ('function', 'Data functions'), ('upstream', 'Polygon')):
+            rows = latency_rows(family)
+            if rows:
+                headers = [*self.HISTOGRAM_LABELS[family], *latency_headers]
+                sections.append(f'{title}\n{tabulate(rows, headers=headers)}')
+
+        calls = Counter()
+        failed = Counter()
+        for (endpoint, status), count in self.upstream_requests.items():
+            calls[endpoint] += count
+            if status != 200:
+                failed[endpoint] += count
+        if calls:
+            rows = [[endpoint, count, failed[endpoint], round(self.upstream_bytes[endpoint] / 1e6, 2)]
+                    for endpoint, count in sorted(calls.items())]
+            sections.append(f'Upstream traffic\n{tabulate(rows, headers=["endpoint", "calls", "non-200", "MB"])}')
+
+        rows = []
+        for name, collect in sorted(self._caches.items()):
+            hits, misses = collect()
+            total = hits + misses
+            rows.append([name, hits, misses, f'{hits / total:.0%}' if total else '-'])
+        if rows:
+            sections.append(f'Caches\n{tabulate(rows, headers=["cache", "hits", "misses", "hit rate"])}')
+
+        rows = []
+        for name, (_, collect) in sorted(self._gauges.items()):
+            for labels, value in collect():
+                rows.append([name, ' '.join(f'{k}={v}' for k, v in labels.items()), value])
+        if rows:
+            sections.append(f'Gauges\n{tabulate(rows, headers=["metric", "labels", "value"])}')
+
+        return '\n\n'.join(sections)
+
+    def prometheus(self):
+        """
+        Render every metric in the Prometheus text exposition format.
+
+        Returns:
+            str: Exposition text
+        """
+        lines = []
+        for family, label_names in self.HISTOGRAM_LABELS.items():
+            name = f'stockbot_{family}_seconds'
+            lines.append(f'# TYPE {name} histogram')
+            for key, histogram in sorted(self.histograms[family].items()):
+                labels = dict(zip(label_names, key))
+                cumulative = 0
+                for bound, count in zip((*LATENCY_BUCKETS, '+Inf'), histogram.buckets):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_labels({**labels, "le": bound})} {cumulative}')
+                lines.append(f'{name}_sum{_labels(labels)} {histogram.sum}')
+                lines.append(f'{name}_count{_labels(labels)} {histogram.count}')
+
+        lines.append('# TYPE stockbot_command_errors_total counter')
+        for command, count in sorted(self.command_errors.items()):
+            lines.append(f'stockbot_command_errors_total{_labels({"command": command})} {count}')
+
+        lines.append('# TYPE stockbot_upstream_requests_total counter')
+        for (endpoint, status), count in sorted(self.upstream_requests.items()):
+            lines.append(f'stockbot_upstream_requests_total{_labels({"endpoint": endpoint, "status": status})} {count}')
+        lines.append('# TYPE stockbot_upstream_bytes_total counter')
+        for endpoint, size in sorted(self.upstream_bytes.items()):
+            lines.append(f'stockbot_upstream_bytes_total{_labels({"endpoint": endpoint})} {size}')
+
+        lines.append('# TYPE stockbot_cache_lookups_total counter')
+        for name, collect in sorted(self._caches.items()):
+            hits, misses = collect()
+            lines.append(f'stockbot_cache_lookups_total{_labels({"cache": name, "result": "hit"})} {hits}')
+            lines.append(f'stockbot_cache_lookups_total{_labels({"cache": name, "result": "miss"})} {misses}')
+
+        for name, (help_text, collect) in sorted(self._gauges.items()):
+            lines.append(f'# HELP stockbot_{name} {help_text}')
+            lines.append(f'# TYPE stockbot_{name} gauge')
+            for labels, value in collect():
+                lines.append(f'stockbot_{name}{_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    async def start_server(self, port):
+        """
+        Serve /metrics in Prometheus format on the given port.
+
+        Args:
+            port (int): TCP port; 0 leaves the endpoint disabled
+        """
+        if not port or self._runner is not None:
+            return
+
+        async def handle(request):
+            return web.Response(text=self.prometheus(), content_type='text/plain')
+
+        app = web.Application()
+        app.router.add_get('/metrics', handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, port=port).start()
+
+    async def stop_server(self):
+        """Stop the Prometheus endpoint if it is running."""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+metrics = Metrics()
+
+
+def span(stage):
+    """Time a block as a stage of the current command (see Metrics.span)."""
+    return metrics.span(stage)
+
+
+def timed(name):
+    """Decorator timing an async data function (see Metrics.timed)."""
+    return metrics.timed(name)
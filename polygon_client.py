@@ -0,0 +1,224 @@
+"""
+Polygon Client Module
+Shared async Polygon.io REST client backed by a pooled keep-alive session
+"""
+import asyncio
+import json
+import time
+import aiohttp
+from config import (
+    POLYGON_API_KEY, POLYGON_BASE_URL, POLYGON_MAX_CONNECTIONS, POLYGON_TIMEOUT, POLYGON_MAX_RETRIES
+)
+from scheduler import scheduler, backoff_delay
+from metrics import metrics
+
+# Polygon's compact aggregate keys mapped to the column names used across the bot
+AGG_FIELDS = {
+    'o': 'open',
+    'h': 'high',
+    'l': 'low',
+    'c': 'close',
+    'v': 'volume',
+    'vw': 'vwap',
+    't': 'timestamp',
+    'n': 'transactions',
+}
+
+
+class PolygonError(Exception):
+    """Raised when Polygon.io answers with a non-success status."""
+
+    def __init__(self, status, message):
+        super().__init__(f'Polygon request failed ({status}): {message}')
+        self.status = status
+
+
+def retry_after_seconds(response):
+    """Return a response's Retry-After header in seconds, if it has a numeric one."""
+    try:
+        return float(response.headers['Retry-After'])
+    except (KeyError, ValueError):
+        return None
+
+
+class PolygonClient:
+    """
+    Async Polygon.io client sharing one aiohttp session per process.
+
+    The session keeps TLS connections alive between commands. How many
+    requests are in flight at once is capped by the shared request scheduler,
+    which hands free slots to interactive requests before bulk ones, so a
+    bulk scan cannot monopolise the connection pool.
+    """
+
+    def __init__(self, api_key, base_url=POLYGON_BASE_URL,
+                 max_connections=POLYGON_MAX_CONNECTIONS,
+                 timeout=POLYGON_TIMEOUT):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._session = None
+
+    def _ensure_session(self):
+        """Create the session lazily so it binds to the running event loop."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections,
+                keepalive_timeout=60,
+                ttl_dns_cache=300
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={'Authorization': f'Bearer {self.api_key}'}
+            )
+        return self._session
+
+    async def _send(self, session, url, params):
+        """
+        Send one request once the scheduler admits it.
+
+        Returns:
+            tuple: (status, body bytes, Retry-After seconds or None)
+        """
+        await scheduler.acquire()
+        try:
+            started = time.perf_counter()
+            async with session.get(url, params=params) as response:
+                body = await response.read()
+                metrics.record_upstream(url, response.status, len(body), time.perf_counter() - started)
+                return response.status, body, retry_after_seconds(response)
+        finally:
+            scheduler.release()
+
+    async def _get(self, path, params=None):
+        """
+        Perform a GET request and return the decoded JSON body.
+
+        Every attempt is admitted by the shared request scheduler first. A 429
+        pauses the scheduler for the server's Retry-After (or an exponential
+        backoff) and the request is retried; connection errors and timeouts
+        are retried after the same backoff. Either way, up to
+        POLYGON_MAX_RETRIES times.
+
+        Args:
+            path (str): API path or absolute URL (used for pagination links)
+            params (dict): Query string parameters
+
+        Returns:
+            dict: Decoded JSON response
+        """
+        session = self._ensure_session()
+        url = path if path.startswith('http') else f'{self.base_url}{path}'
+
+        attempt = 0
+        while True:
+            try:
+                status, body, retry_after = await self._send(session, url, params)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt >= POLYGON_MAX_RETRIES:
+                    raise
+                await asyncio.sleep(backoff_delay(attempt))
+                attempt += 1
+                continue
+            if status == 429 and attempt < POLYGON_MAX_RETRIES:
+                scheduler.pause(backoff_delay(attempt, retry_after))
+                attempt += 1
+                continue
+            if status != 200:
+                raise PolygonError(status, body.decode(errors='replace'))
+            return json.loads(body)
+
+    async def get_aggs(self, ticker, multiplier, timespan, from_, to,
+                       adjusted=True, sort='asc', limit=50000):
+        """
+        Fetch aggregate bars, following pagination links until exhausted.
+
+        Args:
+            ticker (str): Stock ticker symbol
+            multiplier (int): Size of the timespan multiplier
+            timespan (str): minute/hour/day/week/month/quarter/year
+            from_ (str | date): Start of the window (YYYY-MM-DD)
+            to (str | date): End of the window (YYYY-MM-DD)
+            adjusted (bool): Whether results are adjusted for splits
+            sort (str): 'asc' or 'desc' by timestamp
+            limit (int): Base aggregates per page (max 50000)
+
+        Returns:
+            list: Bars as dicts keyed by open/high/low/close/volume/vwap/timestamp/transactions
+        """
+        path = f'/v2/aggs/ticker/{ticker}/range/{multiplier}/{timespan}/{from_}/{to}'
+        params = {'adjusted': str(adjusted).lower(), 'sort': sort, 'limit': limit}
+
+        bars = []
+        while path:
+            body = await self._get(path, params)
+            for result in body.get('results', []):
+                bars.append({name: result.get(key) for key, name in AGG_FIELDS.items()})
+            path = body.get('next_url')
+            params = None
+        return bars
+
+    async def get_grouped_daily(self, date, adjusted=True):
+        """
+        Fetch every US stock's daily bar for one date in a single request.
+
+        Args:
+            date (str | date): Session date (YYYY-MM-DD)
+            adjusted (bool): Whether results are adjusted for splits
+
+        Returns:
+            list: Bars as dicts keyed by ticker plus the get_aggs field names
+        """
+        body = await self._get(
+            f'/v2/aggs/grouped/locale/us/market/stocks/{date}',
+            {'adjusted': str(adjusted).lower()}
+        )
+        bars = []
+        for result in body.get('results', []):
+            bar = {name: result.get(key) for key, name in AGG_FIELDS.items()}
+            bar['ticker'] = result.get('T')
+            bars.append(bar)
+        return bars
+
+    async def get_ticker_details(self, ticker):
+        """
+        Fetch reference details (market cap, shares outstanding, ...) for a ticker.
+
+        Args:
+            ticker (str): Stock ticker symbol
+
+        Returns:
+            dict: Ticker details as returned by Polygon
+        """
+        body = await self._get(f'/v3/reference/tickers/{ticker}')
+        return body.get('results', {})
+
+    async def close(self):
+        """Close the underlying session and release pooled connections."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+_client = None
+
+
+def get_client():
+    """
+    Return the process-wide Polygon client, creating it on first use.
+
+    Returns:
+        PolygonClient: Shared client instance
+    """
+    global _client
+    if _client is None:
+        _client = PolygonClient(POLYGON_API_KEY)
+    return _client
+
+
+async def close_client():
+    """Close the process-wide Polygon client if it was created."""
+    if _client is not None:
+        await _client.close()
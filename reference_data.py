@@ -0,0 +1,162 @@
+"""
+Reference Data Module
+TTL cache of ticker reference details (market cap, shares outstanding) persisted across restarts
+"""
+import asyncio
+import json
+import os
+import time
+from config import REFERENCE_CACHE_PATH, REFERENCE_TTL, WATCHLIST
+from polygon_client import get_client
+from singleflight import coalesce
+from scheduler import current_priority, BULK
+from metrics import metrics, span
+
+
+class ReferenceCache:
+    """
+    Ticker details keyed by symbol, each stamped with when it was fetched.
+
+    Entries younger than the TTL are served without a request. Older entries
+    are refetched, but still served if Polygon cannot be reached, since a
+    day-old market cap beats an error. The cache is saved as JSON so a
+    restart does not refetch every ticker.
+    """
+
+    def __init__(self, path=REFERENCE_CACHE_PATH, ttl=REFERENCE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = None
+
+    @property
+    def entries(self):
+        """Cached entries, read from disk on first use."""
+        if self._entries is None:
+            self._entries = self._load()
+        return self._entries
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def save(self):
+        """Write the cache to disk atomically."""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+
+    def get(self, ticker, allow_stale=False):
+        """
+        Look up a ticker's details.
+
+        Args:
+            ticker (str): Stock ticker symbol
+            allow_stale (bool): Return expired entries too
+
+        Returns:
+            dict: Ticker details, or None if missing (or expired)
+        """
+        entry = self.entries.get(ticker.upper())
+        if entry is None or (not allow_stale and time.time() - entry['fetched'] > self.ttl):
+            return None
+        return entry['details']
+
+    def put(self, ticker, details):
+        """
+        Store freshly fetched details.
+
+        Args:
+            ticker (str): Stock ticker symbol
+            details (dict): Ticker details as returned by Polygon
+        """
+        self.entries[ticker.upper()] = {'fetched': time.time(), 'details': details}
+
+
+reference_cache = ReferenceCache()
+metrics.register_cache('ticker_details', lambda: (reference_cache.hits, reference_cache.misses))
+
+
+@coalesce('ticker_details')
+async def fetch_ticker_details(ticker, persist=True):
+    """
+    Fetch a ticker's details from Polygon and cache them.
+
+    Falls back to an expired entry if the request fails.
+
+    Args:
+        ticker (str): Stock ticker symbol
+        persist (bool): Save the cache to disk afterwards
+
+    Returns:
+        dict: Ticker details
+    """
+    try:
+        with span('fetch'):
+            details = await get_client().get_ticker_details(ticker)
+    except Exception:
+        stale = reference_cache.get(ticker, allow_stale=True)
+        if stale is None:
+            raise
+        return stale
+
+    reference_cache.put(ticker, details)
+    if persist:
+        reference_cache.save()
+    return details
+
+
+async def get_ticker_details(ticker):
+    """
+    Get a ticker's reference details, from the cache while they are fresh.
+
+    Args:
+        ticker (str): Stock ticker symbol
+
+    Returns:
+        dict: Ticker details (market_cap, weighted_shares_outstanding, ...)
+    """
+    details = reference_cache.get(ticker)
+    if details is not None:
+        reference_cache.hits += 1
+        return details
+    reference_cache.misses += 1
+    return await fetch_ticker_details(ticker)
+
+
+async def warm_up(tickers=WATCHLIST):
+    """
+    Fetch details for every watchlist ticker not already cached.
+
+    Runs as bulk work so it never delays interactive commands, and saves the
+    cache once at the end rather than after every ticker.
+
+    Args:
+        tickers (list): Ticker symbols to warm
+
+    Returns:
+        int: Number of tickers fetched
+    """
+    stale = [ticker for ticker in tickers if reference_cache.get(ticker) is None]
+    if not stale:
+        return 0
+
+    priority = current_priority.set(BULK)
+    try:
+        results = await asyncio.gather(
+            *[fetch_ticker_details(ticker, persist=False) for ticker in stale],
+            return_exceptions=True
+        )
+    finally:
+        current_priority.reset(priority)
+    reference_cache.save()
+    for ticker, result in zip(stale, results):
+        if isinstance(result, Exception):
+            print(f'Could not warm reference data for {ticker}: {result}')
+    return len(stale)
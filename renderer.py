@@ -0,0 +1,309 @@
+"""
+Chart Renderer Module
+Pool of warm render worker processes that turn figure specs into images with Plotly/Kaleido or matplotlib
+"""
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import lru_cache
+from config import RENDER_TIMEOUT, RENDER_HEALTH_INTERVAL, RENDER_MAX_JOBS_PER_WORKER, CHART_BACKEND
+
+# Render workers start from a fresh interpreter (via a fork server where available), never
+# by forking the bot: a fork taken while another thread holds a lock can deadlock the child
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+_PING = 'ping'
+_PONG = 'pong'
+
+
+class RenderError(Exception):
+    """Raised when a render worker fails, crashes or times out."""
+
+
+@lru_cache(maxsize=None)
+def agg_backend():
+    """
+    The matplotlib backend module if CHART_BACKEND selects it, else None (Plotly).
+
+    Imported on first use inside a render worker, so the bot process never
+    loads matplotlib. matplotlib is optional; without it charts keep
+    rendering through Plotly.
+    """
+    if CHART_BACKEND != 'matplotlib':
+        return None
+    try:
+        import agg_renderer
+    except ImportError:
+        print('CHART_BACKEND is matplotlib but matplotlib is not installed, rendering with Plotly')
+        return None
+    return agg_renderer
+
+
+def build_figure(spec):
+    """
+    Build a Plotly figure from a chart spec.
+
+    Args:
+        spec (dict): layout ('candle_volume' or 'candle'), title and data,
+            where data holds timestamp/open/high/low/close/volume arrays
+
+    Returns:
+        go.Figure: The figure to render
+    """
+    # Plotly is imported in the render workers, not by the bot process at startup
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
+    data = spec['data']
+    candles = go.Candlestick(
+        x=data['timestamp'],
+        open=data['open'],
+        high=data['high'],
+        low=data['low'],
+        close=data['close'],
+        name='OHLC'
+    )
+
+    if spec['layout'] == 'candle':
+        fig = go.Figure(data=[candles])
+        fig.update_layout(title=spec['title'])
+        return fig
+
+    # Create candlestick and volume subplot
+    fig = make_subplots(
+        rows=2, cols=1,
+        shared_xaxes=True,
+        vertical_spacing=0.03,
+        subplot_titles=(spec['title'], 'Volume'),
+        row_width=[0.2, 0.7]
+    )
+    fig.add_trace(candles, row=1, col=1)
+    fig.add_trace(
+        go.Bar(x=data['timestamp'], y=data['volume'], name='Volume'),
+        row=2, col=1
+    )
+    fig.update(layout_xaxis_rangeslider_visible=False)
+    return fig
+
+
+def render_figure(spec):
+    """
+    Render a chart spec to encoded image bytes.
+
+    Runs inside a render worker, with the backend chosen by CHART_BACKEND
+    (Kaleido's Chromium process is already up when Plotly is used).
+
+    Args:
+        spec (dict): Chart spec (see build_figure), optionally with format/width/height
+
+    Returns:
+        bytes: Encoded image
+    """
+    backend = agg_backend()
+    if backend is not None:
+        return backend.render_figure(spec)
+    import plotly.io as pio
+    return pio.to_image(
+        build_figure(spec),
+        format=spec.get('format', 'jpeg'),
+        width=spec.get('width'),
+        height=spec.get('height')
+    )
+
+
+def _warm_up():
+    """Load the chart backend, starting Kaleido's Chromium subprocess for Plotly, so the first real render is fast."""
+    if agg_backend() is not None:
+        return
+    import plotly.graph_objects as go
+    import plotly.io as pio
+    pio.kaleido.scope.chromium_args = tuple(
+        [arg for arg in pio.kaleido.scope.chromium_args if arg != "--disable-dev-shm-usage"]
+    )
+    pio.to_image(go.Figure(), format='jpeg', width=16, height=16)
+
+
+def _worker_main(conn):
+    """Render worker loop: warm up once, then run jobs until the pipe closes."""
+    _warm_up()
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            return
+        if message is None:
+            return
+        if message == _PING:
+            conn.send(_PONG)
+            continue
+
+        fn, args, kwargs = message
+        try:
+            conn.send((True, fn(*args, **kwargs)))
+        except Exception as err:
+            conn.send((False, RenderError(f'{type(err).__name__}: {err}')))
+
+
+class RenderWorker:
+    """One long-lived render process and the pipe used to talk to it."""
+
+    def __init__(self, context):
+        self._context = context
+        self.process = None
+        self.conn = None
+        self.jobs = 0
+        self.start()
+
+    def start(self):
+        """Spawn the worker process."""
+        parent, child = self._context.Pipe()
+        self.process = self._context.Process(
+            target=_worker_main, args=(child,), name='stockbot-render', daemon=True
+        )
+        self.process.start()
+        child.close()
+        self.conn = parent
+        self.jobs = 0
+
+    def stop(self):
+        """Terminate the worker process."""
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.conn.close()
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout=1)
+
+    def restart(self):
+        """Replace the worker process with a fresh one."""
+        self.stop()
+        self.start()
+
+    @property
+    def alive(self):
+        """Whether the worker process is still running."""
+        return self.process.is_alive()
+
+    def call(self, fn, args, kwargs, timeout):
+        """
+        Run a function in the worker and wait for its result.
+
+        Raises:
+            TimeoutError: If the worker does not answer within timeout seconds
+            EOFError: If the worker died while running the job
+        """
+        self.conn.send((fn, args, kwargs))
+        if not self.conn.poll(timeout):
+            raise TimeoutError(f'render worker did not answer within {timeout}s')
+        ok, value = self.conn.recv()
+        self.jobs += 1
+        if not ok:
+            raise value
+        return value
+
+    def ping(self, timeout):
+        """Check that the worker answers a ping within timeout seconds."""
+        try:
+            self.conn.send(_PING)
+            return self.conn.poll(timeout) and self.conn.recv() == _PONG
+        except (EOFError, OSError):
+            return False
+
+
+class RenderPool(Executor):
+    """
+    Executor backed by warm, long-lived render processes.
+
+    Each worker starts its renderer (Chromium, for Plotly) once and keeps it
+    for many renders. A worker
+    that crashes or hangs is replaced and a crashed job is retried once on the
+    fresh worker. Workers are also recycled after RENDER_MAX_JOBS_PER_WORKER
+    renders to cap Chromium's memory growth, and a background thread pings
+    idle workers every RENDER_HEALTH_INTERVAL seconds. Workers are started
+    with START_METHOD, so replacing one from a pool thread mid-run is safe.
+    """
+
+    def __init__(self, workers, timeout=RENDER_TIMEOUT,
+                 health_interval=RENDER_HEALTH_INTERVAL,
+                 max_jobs_per_worker=RENDER_MAX_JOBS_PER_WORKER):
+        self.timeout = timeout
+        self.health_interval = health_interval
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.restarts = 0
+        self._context = multiprocessing.get_context(START_METHOD)
+        if START_METHOD == 'forkserver':
+            self._context.set_forkserver_preload(['renderer'])
+        self._workers = [RenderWorker(self._context) for _ in range(workers)]
+        self._idle = queue.Queue()
+        for worker in self._workers:
+            self._idle.put(worker)
+        self._threads = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='stockbot-render')
+        self._closed = threading.Event()
+        self._health = threading.Thread(target=self._health_loop, name='stockbot-render-health', daemon=True)
+        self._health.start()
+
+    def submit(self, fn, /, *args, **kwargs):
+        return self._threads.submit(self._run, fn, args, kwargs)
+
+    def _restart(self, worker):
+        worker.restart()
+        self.restarts += 1
+
+    def _run(self, fn, args, kwargs):
+        """Run one job on an idle worker (called on a dispatch thread)."""
+        worker = self._idle.get()
+        try:
+            if not worker.alive or worker.jobs >= self.max_jobs_per_worker:
+                self._restart(worker)
+            try:
+                return worker.call(fn, args, kwargs, self.timeout)
+            except (EOFError, OSError):
+                # The worker died mid-job: replace it and retry once
+                self._restart(worker)
+                try:
+                    return worker.call(fn, args, kwargs, self.timeout)
+                except (EOFError, OSError, TimeoutError) as err:
+                    self._restart(worker)
+                    raise RenderError(f'render worker crashed: {err}') from err
+            except TimeoutError as err:
+                self._restart(worker)
+                raise RenderError(str(err)) from err
+        finally:
+            self._idle.put(worker)
+
+    def _health_loop(self):
+        """Ping idle workers periodically and replace any that do not answer."""
+        while not self._closed.wait(self.health_interval):
+            checked = []
+            try:
+                while len(checked) < len(self._workers):
+                    checked.append(self._idle.get_nowait())
+            except queue.Empty:
+                pass
+            for worker in checked:
+                if not worker.ping(timeout=5):
+                    self._restart(worker)
+                self._idle.put(worker)
+
+    def status(self):
+        """
+        Summarize pool health.
+
+        Returns:
+            dict: Worker count, live workers and restarts so far
+        """
+        return {
+            'workers': len(self._workers),
+            'alive': sum(worker.alive for worker in self._workers),
+            'restarts': self.restarts,
+        }
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        self._closed.set()
+        self._threads.shutdown(wait=wait)
+        for worker in self._workers:
+            worker.stop()
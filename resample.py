@@ -0,0 +1,265 @@
+"""
+Resample Module
+Builds any multiplier x minute/hour/day/week bars locally from one minute or daily base series
+"""
+from datetime import date as d, timedelta
+import numpy as np
+import pandas as pd
+from config import (
+    CHART_SESSIONS, CHART_MORE_SESSIONS, CHART_DAYS, CHART_MORE_DAYS,
+    RESAMPLE_CACHE_MAX_BYTES, CHART_CACHE_LIVE_TTL
+)
+from bar_store import eastern, get_minute_bars, get_minute_bar_range, is_session_closed, session_days
+from bars import MinuteBars, RTH_OPEN, RTH_CLOSE
+from daily_history import get_daily_history
+from chart_cache import ChartCache
+from metrics import metrics, span
+
+# Base series each timespan is built from
+TIMESPANS = {'minute': 'minute', 'hour': 'minute', 'day': 'daily', 'week': 'daily'}
+
+# Intraday bars restart at each session boundary, so none straddles the open or close
+SESSION_ANCHORS = np.array([0, RTH_OPEN, RTH_CLOSE])
+
+# Standard bar sizes a chart steps up through when it has more bars than it can draw
+CHART_STEPS = {
+    'minute': [(1, 'minute'), (2, 'minute'), (3, 'minute'), (5, 'minute'), (10, 'minute'), (15, 'minute'),
+               (30, 'minute'), (1, 'hour'), (2, 'hour'), (4, 'hour')],
+    'daily': [(1, 'day'), (2, 'day'), (3, 'day'), (1, 'week'), (2, 'week'), (4, 'week')],
+}
+MINUTES_PER = {'minute': 1, 'hour': 60, 'day': 1440, 'week': 10080}
+
+# Base and resampled series, keyed like charts; closed sessions never change
+series_cache = ChartCache(RESAMPLE_CACHE_MAX_BYTES, CHART_CACHE_LIVE_TTL, sizeof=lambda bars: bars.nbytes)
+metrics.register_cache('resampled_series', lambda: (series_cache.hits, series_cache.misses))
+
+
+def group_starts(keys):
+    """Indices where a sorted key array changes value (the first bar of each group)."""
+    if not len(keys):
+        return np.array([], dtype=np.int64)
+    return np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+
+
+def aggregate(bars, starts, minute):
+    """
+    OHLCV of consecutive groups of bars.
+
+    Args:
+        bars (MinuteBars): Source bars, sorted by time
+        starts (np.ndarray): Index of each group's first bar
+        minute (np.ndarray): Minute of day each group is labelled with
+
+    Returns:
+        MinuteBars: One bar per group
+    """
+    stops = np.r_[starts[1:], len(bars)]
+    return MinuteBars(
+        bars.timestamp[starts] - (bars.minute[starts] - minute).astype(np.int64) * 60000,
+        bars.day[starts],
+        minute.astype(np.int32),
+        bars.open[starts],
+        np.maximum.reduceat(bars.high, starts),
+        np.minimum.reduceat(bars.low, starts),
+        bars.close[stops - 1],
+        np.add.reduceat(bars.volume, starts),
+    )
+
+
+def resample(bars, multiplier, timespan):
+    """
+    Resample bars to multiplier x timespan.
+
+    Minute and hour bars are built from minute bars. They are aligned to the
+    start of their session segment (premarket from midnight, regular hours
+    from 09:30, after hours from 16:00) and never span two segments or days.
+    Day bars group `multiplier` sessions counting back from the last one, so
+    the latest bar is complete. Week bars start on Mondays.
+
+    Args:
+        bars (MinuteBars): Minute bars, or daily bars for day/week
+        multiplier (int): Timespans per bar
+        timespan (str): 'minute', 'hour', 'day' or 'week'
+
+    Returns:
+        MinuteBars: Resampled bars, labelled with their start time
+    """
+    if not len(bars) or (timespan == 'minute' and multiplier == 1):
+        return bars
+
+    if timespan in ('minute', 'hour'):
+        size = multiplier * (60 if timespan == 'hour' else 1)
+        anchor = SESSION_ANCHORS[np.searchsorted(SESSION_ANCHORS, bars.minute, side='right') - 1]
+        bucket = anchor + (bars.minute - anchor) // size * size
+        starts = group_starts(bars.day.astype(np.int64) * 1440 + bucket)
+        return aggregate(bars, starts, bucket[starts])
+
+    if timespan == 'day':
+        keys = (np.arange(len(bars)) + (-len(bars)) % multiplier) // multiplier
+    else:
+        # Day 0 (1970-01-01) is a Thursday, so shifting by 3 starts weeks on Monday
+        keys = (bars.day.astype(np.int64) + 3) // 7 // multiplier
+    starts = group_starts(keys)
+    return aggregate(bars, starts, bars.minute[starts])
+
+
+def fit_bars(base, multiplier, timespan, max_bars):
+    """
+    Resample to multiplier x timespan, or a coarser standard size if that is too many bars.
+
+    Steps up through CHART_STEPS (5 minute, 10 minute, ... 1 hour, ...) to
+    the smallest size giving at most max_bars bars. Bars still come from
+    resample, so none straddles a session boundary, a day or a week.
+
+    Args:
+        base (MinuteBars): Minute bars, or daily bars for day/week
+        multiplier (int): Requested timespans per bar
+        timespan (str): Requested 'minute', 'hour', 'day' or 'week'
+        max_bars (int): Most bars wanted
+
+    Returns:
+        tuple: (bars, multiplier, timespan) actually used; the coarsest step if none fits
+    """
+    bars = resample(base, multiplier, timespan)
+    size = multiplier * MINUTES_PER[timespan]
+    for step_multiplier, step_timespan in CHART_STEPS[TIMESPANS[timespan]]:
+        if len(bars) <= max_bars:
+            break
+        if step_multiplier * MINUTES_PER[step_timespan] > size:
+            multiplier, timespan = step_multiplier, step_timespan
+            bars = resample(base, multiplier, timespan)
+    return bars, multiplier, timespan
+
+
+def daily_bars(history):
+    """
+    Daily history rows as MinuteBars labelled at midnight Eastern.
+
+    Args:
+        history (np.ndarray): Rows with dtype HISTORY_DTYPE
+
+    Returns:
+        MinuteBars: One bar per session
+    """
+    day = history['date'].astype(np.int64)
+    timestamp = pd.DatetimeIndex(history['date']).tz_localize(eastern).asi8 // 1_000_000
+    return MinuteBars(
+        np.asarray(timestamp, dtype=np.int64),
+        day.astype(np.int32),
+        np.zeros(len(history), dtype=np.int32),
+        history['open'],
+        history['high'],
+        history['low'],
+        history['close'],
+        history['volume'],
+    )
+
+
+async def cached_series(key, date, load):
+    """Return a cached series, or load it and cache the result."""
+    bars = series_cache.get(key)
+    if bars is None:
+        bars = await load()
+        series_cache.put(key, bars, date)
+    return bars
+
+
+async def get_base_bars(ticker, source, date, more_data=False):
+    """
+    Get the base series charts of every timespan on that source are built from.
+
+    Minute charts read the last CHART_SESSIONS sessions up to the date
+    (CHART_MORE_SESSIONS with more_data) from the minute bar store; day and
+    week charts read CHART_DAYS (or CHART_MORE_DAYS) of the stored daily history.
+
+    Args:
+        ticker (str): Stock ticker symbol
+        source (str): 'minute' or 'daily'
+        date (str): Last session date (YYYY-MM-DD)
+        more_data (bool): Use the extended lookback
+
+    Returns:
+        MinuteBars: Base bars, oldest first
+    """
+    end = d.fromisoformat(date)
+
+    async def load():
+        if source == 'daily':
+            history = await get_daily_history(ticker)
+            start = end - timedelta(days=CHART_MORE_DAYS if more_data else CHART_DAYS)
+            dates = history['date']
+            with span('transform'):
+                return daily_bars(history[(dates > np.datetime64(start)) & (dates <= np.datetime64(end))])
+
+        sessions = CHART_MORE_SESSIONS if more_data else CHART_SESSIONS
+        days = session_days(end - timedelta(days=sessions * 2 + 7), end)[-sessions:]
+        if is_session_closed(days[-1]):
+            records = await get_minute_bar_range(ticker, days[0], days[-1])
+        else:
+            # The session in progress may come from the live feed
+            closed = [await get_minute_bar_range(ticker, days[0], days[-2])] if len(days) > 1 else []
+            records = np.concatenate(closed + [await get_minute_bars(ticker, days[-1])])
+        with span('transform'):
+            return MinuteBars.from_records(records)
+
+    return await cached_series((ticker.upper(), source, date, bool(more_data)), date, load)
+
+
+async def get_resampled_bars(ticker, multiplier, timespan, date, more_data=False):
+    """
+    Get multiplier x timespan bars for a chart ending on a date.
+
+    Every timespan on the same base series shares one fetch, so switching a
+    chart between 5-minute, 15-minute and 1-hour bars costs no API calls.
+
+    Args:
+        ticker (str): Stock ticker symbol
+        multiplier (int): Timespans per bar
+        timespan (str): 'minute', 'hour', 'day' or 'week'
+        date (str): Last session date (YYYY-MM-DD)
+        more_data (bool): Use the extended lookback
+
+    Returns:
+        MinuteBars: Resampled bars, oldest first
+
+    Raises:
+        ValueError: If the timespan is unknown or the multiplier below 1
+    """
+    if timespan not in TIMESPANS:
+        raise ValueError(f'Unknown timespan {timespan!r}, expected one of {", ".join(TIMESPANS)}')
+    if multiplier < 1:
+        raise ValueError('Multiplier must be at least 1')
+    source = TIMESPANS[timespan]
+
+    async def load():
+        bars = await get_base_bars(ticker, source, date, more_data)
+        with span('transform'):
+            return resample(bars, multiplier, timespan)
+
+    return await cached_series((ticker.upper(), source, date, bool(more_data), multiplier, timespan), date, load)
+
+
+async def get_chart_bars(ticker, multiplier, timespan, date, more_data=False, max_bars=None):
+    """
+    Get bars for a chart, at a coarser standard size if the requested one has too many.
+
+    Args:
+        ticker (str): Stock ticker symbol
+        multiplier (int): Timespans per bar
+        timespan (str): 'minute', 'hour', 'day' or 'week'
+        date (str): Last session date (YYYY-MM-DD)
+        more_data (bool): Use the extended lookback
+        max_bars (int): Most bars the chart can draw, or None for no limit
+
+    Returns:
+        tuple: (MinuteBars, multiplier, timespan) of the bars returned
+
+    Raises:
+        ValueError: If the timespan is unknown or the multiplier below 1
+    """
+    bars = await get_resampled_bars(ticker, multiplier, timespan, date, more_data)
+    if max_bars is None or len(bars) <= max_bars:
+        return bars, multiplier, timespan
+    base = await get_base_bars(ticker, TIMESPANS[timespan], date, more_data)
+    with span('transform'):
+        return fit_bars(base, multiplier, timespan, max_bars)
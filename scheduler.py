@@ -0,0 +1,213 @@
+"""
+Request Scheduler Module
+Token-bucket, concurrency-capped, priority-ordered admission for every Polygon API call
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import random
+import time
+from config import POLYGON_RATE_LIMIT, POLYGON_RATE_BURST, POLYGON_MAX_CONCURRENCY
+from metrics import metrics
+
+# Priority classes: lower numbers are served first
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BULK: 'bulk'}
+
+# Priority of upstream calls made from the current task; bulk scans lower it
+current_priority = contextvars.ContextVar('polygon_priority', default=INTERACTIVE)
+
+
+class SharedPriority:
+    """Priority of work done for several callers: the best any of them asked for so far."""
+
+    __slots__ = ('priority',)
+
+    def __init__(self, priority):
+        self.priority = priority
+
+    def raise_to(self, priority):
+        """Serve the work at `priority` if that is better; returns whether it changed."""
+        if priority < self.priority:
+            self.priority = priority
+            return True
+        return False
+
+
+# Set in tasks that fetch on behalf of several callers (see singleflight.py)
+shared_priority = contextvars.ContextVar('shared_priority', default=None)
+
+
+def effective_priority():
+    """Priority for an upstream call from the current task."""
+    shared = shared_priority.get()
+    priority = current_priority.get()
+    return priority if shared is None else min(priority, shared.priority)
+
+
+def backoff_delay(attempt, retry_after=None, base=1.0, cap=60.0):
+    """
+    Delay before retrying a throttled request.
+
+    Args:
+        attempt (int): Zero-based retry attempt
+        retry_after (float): Server-provided Retry-After seconds, if any
+        base (float): Delay of the first attempt without Retry-After
+        cap (float): Upper bound on the exponential delay
+
+    Returns:
+        float: Seconds to wait, with up to 25% random jitter added
+    """
+    delay = retry_after if retry_after is not None else min(cap, base * 2 ** attempt)
+    return delay * (1 + random.random() * 0.25)
+
+
+class RequestScheduler:
+    """
+    Admits upstream requests at a sustained rate, highest priority first.
+
+    Tokens refill continuously at `rate` per second up to `burst`, and at
+    most `max_concurrency` admitted requests may be in flight (each must be
+    given back with release()). When either limit is reached, callers wait
+    in a heap ordered by (priority, arrival), so an interactive lookup queued
+    behind a bulk scan is admitted first. A 429 pauses admission for everyone
+    until the server's Retry-After has passed. A rate of 0 disables the token
+    bucket and a max_concurrency of None the in-flight cap.
+    """
+
+    def __init__(self, rate=POLYGON_RATE_LIMIT, burst=POLYGON_RATE_BURST, max_concurrency=None):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.granted = 0
+        self.throttled = 0
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._timer = None
+
+    def queue_depth(self):
+        """
+        Callers currently waiting for admission, by priority class.
+
+        Returns:
+            dict: Priority name -> waiting callers
+        """
+        depth = {name: 0 for name in PRIORITY_NAMES.values()}
+        for priority, _, future, _ in self._waiters:
+            if not future.done():
+                depth[PRIORITY_NAMES.get(priority, str(priority))] += 1
+        return depth
+
+    def _refill(self, now):
+        if self.rate > 0:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _take(self, now):
+        """Take a token and an in-flight slot if admission is open; returns whether it succeeded."""
+        if now < self._paused_until or self._full():
+            return False
+        if self.rate > 0:
+            self._refill(now)
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+        self.in_flight += 1
+        return True
+
+    def _full(self):
+        return self.max_concurrency is not None and self.in_flight >= self.max_concurrency
+
+    async def acquire(self, priority=None):
+        """
+        Wait until a request may be sent.
+
+        Args:
+            priority (int): INTERACTIVE or BULK (defaults to effective_priority())
+        """
+        if priority is None:
+            priority = effective_priority()
+        now = time.monotonic()
+        if not self._waiters and self._take(now):
+            self.granted += 1
+            return
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future, shared_priority.get()))
+        self._schedule(loop)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # Admitted just as the caller was cancelled
+            raise
+
+    def release(self):
+        """Give back an admitted request's in-flight slot (once it completed or failed)."""
+        self.in_flight -= 1
+        if self._waiters and self._timer is None:
+            self._release(asyncio.get_running_loop())
+
+    def _schedule(self, loop):
+        """Arm a timer for when the next waiter can be admitted (release() wakes them when slots are full)."""
+        if self._timer is not None or not self._waiters or self._full():
+            return
+        now = time.monotonic()
+        delay = max(0.0, self._paused_until - now)
+        if self.rate > 0:
+            self._refill(now)
+            delay = max(delay, (1 - self._tokens) / self.rate)
+        self._timer = loop.call_later(delay, self._release, loop)
+
+    def _release(self, loop):
+        """Admit as many waiters as there are tokens and slots, best priority first."""
+        self._timer = None
+        now = time.monotonic()
+        while self._waiters:
+            if self._waiters[0][2].done():
+                heapq.heappop(self._waiters)
+                continue
+            if not self._take(now):
+                break
+            future = heapq.heappop(self._waiters)[2]
+            future.set_result(None)
+            self.granted += 1
+        self._schedule(loop)
+
+    def reprioritize(self):
+        """Re-rank waiting callers whose SharedPriority was raised after they queued."""
+        self._waiters = [
+            (priority if shared is None else min(priority, shared.priority), sequence, future, shared)
+            for priority, sequence, future, shared in self._waiters
+        ]
+        heapq.heapify(self._waiters)
+
+    def pause(self, seconds):
+        """
+        Stop admitting requests for a while (after a 429 response).
+
+        Args:
+            seconds (float): How long to hold admission closed
+        """
+        self.throttled += 1
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        if self.rate > 0:
+            self._tokens = 0
+
+
+scheduler = RequestScheduler(max_concurrency=POLYGON_MAX_CONCURRENCY)
+metrics.register_gauge(
+    'scheduler_waiting', 'Polygon requests waiting for admission by priority',
+    lambda: [({'priority': name}, depth) for name, depth in scheduler.queue_depth().items()]
+)
+metrics.register_gauge(
+    'scheduler_throttled', 'Times a 429 paused Polygon admission',
+    lambda: [({}, scheduler.throttled)]
+)
@@ -0,0 +1,117 @@
+"""
+Single-Flight Module
+Coalesces identical in-flight data requests into one shared upstream fetch
+"""
+import asyncio
+import contextvars
+import functools
+from collections import Counter
+from scheduler import scheduler, current_priority, shared_priority, effective_priority, SharedPriority
+from metrics import metrics
+
+
+async def _run_shared(priority, fetch):
+    """Run a shared fetch at its callers' best priority (set in its own, otherwise empty, context)."""
+    shared_priority.set(priority)
+    current_priority.set(priority.priority)
+    return await fetch()
+
+
+def _finished(task):
+    # Retrieve the exception even when every caller was cancelled, so it is not reported as lost
+    if not task.cancelled():
+        task.exception()
+
+
+class SingleFlight:
+    """
+    Lets concurrent callers with the same key share one running coroutine.
+
+    The first caller (the leader) starts the fetch. Callers arriving while it
+    is in flight await the same task instead of starting their own. Keys are
+    forgotten as soon as the fetch finishes, so this never serves stale data;
+    it only removes duplicate work during bursts.
+
+    The fetch runs in a fresh context, so it carries no caller's guild or
+    command, at the best priority of the callers waiting on it: an
+    interactive caller joining a bulk fetch promotes it.
+    """
+
+    def __init__(self):
+        self.calls = Counter()
+        self.coalesced = Counter()
+        self._inflight = {}
+
+    def stats(self):
+        """
+        Per-endpoint counters for the requests seen so far.
+
+        Returns:
+            dict: endpoint -> calls, upstream fetches and coalesced callers
+        """
+        return {
+            endpoint: {
+                'calls': calls,
+                'fetches': calls - self.coalesced[endpoint],
+                'coalesced': self.coalesced[endpoint],
+            }
+            for endpoint, calls in self.calls.items()
+        }
+
+    async def do(self, key, fetch):
+        """
+        Run fetch() once for all concurrent callers sharing key.
+
+        Args:
+            key (tuple): Identifies the request; key[0] names the endpoint
+            fetch (callable): Coroutine function performing the real fetch
+
+        Returns:
+            Any: fetch()'s result (or raises its exception) for every caller
+        """
+        self.calls[key[0]] += 1
+        flight = self._inflight.get(key)
+        if flight is not None:
+            self.coalesced[key[0]] += 1
+            task, priority = flight
+            if priority.raise_to(effective_priority()):
+                scheduler.reprioritize()
+        else:
+            priority = SharedPriority(effective_priority())
+            task = contextvars.Context().run(asyncio.ensure_future, _run_shared(priority, fetch))
+            self._inflight[key] = (task, priority)
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+            task.add_done_callback(_finished)
+        # Shield the shared task so one caller's cancellation doesn't cancel the others
+        return await asyncio.shield(task)
+
+
+singleflight = SingleFlight()
+metrics.register_gauge(
+    'singleflight_calls', 'Data requests by endpoint, split into fetches and coalesced callers',
+    lambda: [({'endpoint': endpoint, 'kind': kind}, stats[kind])
+             for endpoint, stats in singleflight.stats().items()
+             for kind in ('fetches', 'coalesced')]
+)
+
+
+def coalesce(endpoint):
+    """
+    Decorator routing an async data function through the shared SingleFlight.
+
+    The key is the endpoint name plus the call's arguments, so callers asking
+    for the same ticker and range share one fetch.
+
+    Args:
+        endpoint (str): Name distinguishing the decorated function
+
+    Returns:
+        callable: Decorator
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            key = (endpoint, args, tuple(sorted(kwargs.items())))
+            return await singleflight.do(key, lambda: fn(*args, **kwargs))
+        return wrapper
+    return decorator
@@ -0,0 +1,107 @@
+"""
+Startup Profile Module
+Import-time report for the bot's cold start, from python -X importtime
+
+Usage:
+    python startup_profile.py [--module main] [--runs 5] [--top 15] [--budget SECONDS]
+
+Imports the module in fresh interpreters and reports the fastest run's wall
+time (minus a bare interpreter's), the heaviest imports and whether any
+dependency meant to load on first use (pandas, plotly, ...) was imported at
+startup. With --budget it exits non-zero when startup is slower, so it can
+guard a deploy.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from tabulate import tabulate
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Heavy dependencies the bot imports only when a command first needs them
+LAZY_MODULES = ('pandas', 'plotly', 'kaleido', 'matplotlib', 'tabulate')
+
+
+def parse_importtime(stderr):
+    """
+    Parse -X importtime output.
+
+    Args:
+        stderr (str): The interpreter's stderr
+
+    Returns:
+        list: (name, depth, self seconds, cumulative seconds) per imported module, in output order
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((name.strip(), depth, int(own) / 1e6, int(cumulative) / 1e6))
+    return imports
+
+
+def run_import(module):
+    """
+    Import a module in a fresh interpreter.
+
+    Returns:
+        tuple: (wall seconds, parsed import times, names of every loaded module)
+    """
+    code = f'import sys, {module}; print(" ".join(sys.modules))'
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            cwd=HERE, capture_output=True, text=True)
+    wall = time.perf_counter() - started
+    if result.returncode:
+        raise RuntimeError(f'importing {module} failed:\n{result.stderr[-2000:]}')
+    return wall, parse_importtime(result.stderr), set(result.stdout.split())
+
+
+def bare_interpreter_seconds(runs):
+    """Fastest wall time of an interpreter that imports nothing."""
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'], check=True)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile the bot's import time")
+    parser.add_argument('--module', default='main', help='Module to import (default: main)')
+    parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters to time; the fastest is reported')
+    parser.add_argument('--top', type=int, default=15, help='Imports listed per table')
+    parser.add_argument('--budget', type=float, help='Fail if importing takes longer than this many seconds')
+    args = parser.parse_args()
+
+    runs = [run_import(args.module) for _ in range(args.runs)]
+    wall, imports, loaded = min(runs, key=lambda run: run[0])
+    startup = wall - bare_interpreter_seconds(args.runs)
+
+    direct = sorted((entry for entry in imports if entry[1] == 1), key=lambda entry: -entry[3])
+    packages = sorted((entry for entry in imports if '.' not in entry[0]), key=lambda entry: -entry[3])
+    print(f'Imported by {args.module}')
+    print(tabulate([(name, f'{cumulative * 1000:.1f}') for name, _, _, cumulative in direct[:args.top]],
+                   headers=['module', 'cumulative ms']))
+    print('\nHeaviest packages')
+    print(tabulate([(name, f'{own * 1000:.1f}', f'{cumulative * 1000:.1f}')
+                    for name, _, own, cumulative in packages[:args.top]],
+                   headers=['package', 'self ms', 'cumulative ms']))
+
+    eager = [name for name in LAZY_MODULES if name in loaded]
+    print(f'\nimport {args.module}: {startup * 1000:.0f} ms over a bare interpreter '
+          f'(fastest of {args.runs}), {len(loaded)} modules loaded')
+    if eager:
+        print(f'Loaded at startup but meant to load on first use: {", ".join(eager)}')
+    if args.budget is not None and startup > args.budget:
+        print(f'Over the {args.budget:.2f} s budget')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,18 +2,33 @@
 Stock Data Module
 Fetches stock market data from Polygon.io API
 """
-from polygon import RESTClient
+import asyncio
+import io
+from datetime import datetime
 import pandas as pd
-from datetime import datetime, timedelta
-from config import POLYGON_API_KEY
+from config import STOCK_DATA_CONCURRENCY, STOCK_DATA_TICKER_TIMEOUT
+from polygon_client import get_client
+from reference_data import get_ticker_details
+from bar_store import eastern, get_minute_bars, get_minute_bar_range
+from daily_snapshot import get_daily_bar, get_daily_bars
+from streaming import live_session
+from bars import MinuteBars, summarize_sessions
+from singleflight import coalesce
+from metrics import span, timed
+from jobs import JobQueueFull
 
 pd.options.mode.chained_assignment = None
 
 
-def get_ticker_data(ticker, date):
+@timed('get_ticker_data')
+@coalesce('ticker_data')
+async def get_ticker_data(ticker, date):
     """
     Fetch comprehensive stock data for a given ticker and date.
 
+    A session still in progress has a row only when the ticker is streamed,
+    built from the stream's live state so far.
+
     Args:
         ticker (str): Stock ticker symbol (e.g., 'AAPL')
         date (str): Date in YYYY-MM-DD format
@@ -21,143 +36,193 @@ def get_ticker_data(ticker, date):
     Returns:
         pd.DataFrame: DataFrame containing OHLC data, volume, market cap, etc.
     """
-    client = RESTClient(POLYGON_API_KEY)
-
-    # Get minute-level aggregate data
-    minute_data = client.get_aggs(ticker, 1, "minute", date, date)
-    minute_data = pd.DataFrame(minute_data)
-    multiple_timestamp_to_time(minute_data)
+    # Get minute-level aggregate data and summarize every session in one pass
+    minute_aggs = await get_minute_bars(ticker, date)
+    with span('transform'):
+        session = summarize_minute_data(minute_aggs)
+
+    if session is None:
+        live = live_session(ticker, date)
+        if live is None:
+            return pd.DataFrame()  # Market not yet closed
+        session = live.summary()
+        ticker_details = await get_ticker_details(ticker)
+        return pd.DataFrame([session_row(ticker, date, session, session['volume'], ticker_details)])
+
+    # Get the daily bar (shared grouped snapshot) and ticker details (market cap, shares outstanding)
+    day_bar, ticker_details = await asyncio.gather(
+        get_daily_bar(ticker, date),
+        get_ticker_details(ticker)
+    )
+    volume = day_bar['volume'] if day_bar else None
 
-    # Filter for regular market hours (9:30 AM - 4:00 PM ET)
-    daily_data = minute_data.loc['09:30:00':'15:59:00']
+    # Build result DataFrame
+    return pd.DataFrame([session_row(ticker, date, session, volume, ticker_details)])
 
-    # Verify market is closed (last timestamp should be 15:59)
-    if daily_data.tail(1).timestamp.item() != '15:59:00':
-        return pd.DataFrame()  # Market not yet closed
 
-    # Calculate daily statistics
-    daily_high = daily_data.high.max()
-    daily_low = daily_data.low.min()
-    daily_open = daily_data.head(1).open.item()
-    daily_close = daily_data.tail(1).close.item()
+@timed('get_ticker_range_data')
+@coalesce('ticker_range_data')
+async def get_ticker_range_data(ticker, start, end):
+    """
+    Fetch one row of stock data per closed session from start to end.
 
-    # Get daily OHLC data
-    olhc = client.get_aggs(ticker, 1, "day", date, date)
-    olhc = pd.DataFrame(olhc)
+    Minute bars for the whole range come from at most one paginated request,
+    and every session is summarized in a single vectorized pass.
 
-    # Get additional metrics
-    high_time, low_time = get_high_low_times(minute_data, daily_high, daily_low)
-    pm_high, pm_low, pm_vol, pm_high_time, pm_low_time = get_pm_data(minute_data)
-    ah_high, ah_low, ah_vol, ah_high_time, ah_low_time = get_ah_data(minute_data)
+    Args:
+        ticker (str): Stock ticker symbol (e.g., 'AAPL')
+        start (str): First date in YYYY-MM-DD format
+        end (str): Last date in YYYY-MM-DD format
 
-    # Get ticker details (market cap, shares outstanding)
-    ticker_details = client.get_ticker_details(ticker)
-    market_cap = ticker_details.market_cap
-    weighted_shares_outstanding = ticker_details.weighted_shares_outstanding
+    Returns:
+        pd.DataFrame: One row per closed session (empty if none has closed yet)
+    """
+    client = get_client()
+
+    minute_aggs = await get_minute_bar_range(ticker, start, end)
+    if not len(minute_aggs):
+        raise ValueError('no minute bars in this date range')
+    with span('transform'):
+        sessions = [
+            (str(date), session)
+            for date, session in summarize_sessions(MinuteBars.from_records(minute_aggs))
+            if session is not None
+        ]
+
+    if not sessions:
+        return pd.DataFrame()  # Market not yet closed
 
-    # Build result DataFrame
-    df_dict = {
-        'ticker': ticker,
-        'date': date,
-        'open': daily_open,
-        'close': daily_close,
-        'high': daily_high,
-        'low': daily_low,
-        'high time': high_time,
-        'low time': low_time,
-        'volume': olhc.volume.item(),
-        'pm high': pm_high,
-        'pm low': pm_low,
-        'pm high time': pm_high_time,
-        'pm low time': pm_low_time,
-        'pm volume': pm_vol,
-        'ah high': ah_high,
-        'ah low': ah_low,
-        'ah high time': ah_high_time,
-        'ah low time': ah_low_time,
-        'ah volume': ah_vol,
-        'market cap': market_cap,
-        'shares outstanding': weighted_shares_outstanding
+    # Daily volumes come from the grouped snapshots of each session when they cover the ticker
+    day_aggs, ticker_details = await asyncio.gather(
+        get_daily_bars(ticker, [date for date, _ in sessions]),
+        get_ticker_details(ticker)
+    )
+    if day_aggs is None:
+        with span('fetch'):
+            day_aggs = await client.get_aggs(ticker, 1, "day", start, end)
+    volumes = {
+        str(datetime.fromtimestamp(bar['timestamp'] / 1000, eastern).date()): bar['volume']
+        for bar in day_aggs
     }
 
-    return pd.DataFrame([df_dict])
+    return pd.DataFrame([
+        session_row(ticker, date, session, volumes.get(date), ticker_details)
+        for date, session in sessions
+    ])
 
 
-def multiple_timestamp_to_time(df):
+async def get_many_ticker_data(tickers, date, end_date=None):
     """
-    Convert Unix timestamps to Eastern Time and create time indices.
+    Fetch stock data for many tickers concurrently, keeping whatever succeeds.
 
-    Args:
-        df (pd.DataFrame): DataFrame with 'timestamp' column in Unix milliseconds
-    """
-    df.timestamp = pd.to_datetime(df.timestamp, unit='ms').dt.tz_localize('UTC').dt.tz_convert('US/Eastern')
-    df['t_index_only'] = df.timestamp.dt.time
-    df.timestamp = df.timestamp.astype(str)
-    df.t_index_only = df.t_index_only.astype(str)
-    df['timestamp_idx'] = df.t_index_only
-    df.set_index('timestamp_idx', inplace=True)
+    At most STOCK_DATA_CONCURRENCY tickers are fetched at once and each gets
+    STOCK_DATA_TICKER_TIMEOUT seconds, so one slow or missing ticker costs
+    its own row rather than the whole request.
 
+    Args:
+        tickers (list): Stock ticker symbols
+        date (str): Date (or first date of the range) in YYYY-MM-DD format
+        end_date (str): Last date of the range, or None for a single day
 
-def get_high_low_times(minute_data, daily_high, daily_low):
+    Returns:
+        tuple: (DataFrames for successful tickers in request order,
+            list of (ticker, reason) for the rest)
+    """
+    semaphore = asyncio.Semaphore(STOCK_DATA_CONCURRENCY)
+
+    async def fetch(ticker):
+        async with semaphore:
+            if end_date is None:
+                request = get_ticker_data(ticker=ticker, date=date)
+            else:
+                request = get_ticker_range_data(ticker, date, end_date)
+            return await asyncio.wait_for(request, STOCK_DATA_TICKER_TIMEOUT)
+
+    results = await asyncio.gather(*[fetch(ticker) for ticker in tickers], return_exceptions=True)
+
+    frames, failures = [], []
+    for ticker, result in zip(tickers, results):
+        if isinstance(result, asyncio.TimeoutError):
+            failures.append((ticker, 'timed out'))
+        elif isinstance(result, JobQueueFull):
+            failures.append((ticker, 'bot busy'))
+        elif isinstance(result, Exception):
+            print(f"Error fetching {ticker}: {result}")
+            failures.append((ticker, 'data not found'))
+        elif result.empty:
+            failures.append((ticker, 'market not closed yet'))
+        else:
+            frames.append(result)
+    return frames, failures
+
+
+def session_row(ticker, date, session, volume, ticker_details):
     """
-    Find the times when daily high and low occurred.
+    Build one spreadsheet row from a session summary.
 
     Args:
-        minute_data (pd.DataFrame): Minute-level data
-        daily_high (float): Daily high price
-        daily_low (float): Daily low price
+        ticker (str): Stock ticker symbol
+        date (str): Session date in YYYY-MM-DD format
+        session (dict): Summary from summarize_sessions
+        volume (float): Consolidated daily volume
+        ticker_details (dict): Reference details (market cap, shares outstanding)
 
     Returns:
-        tuple: (high_time, low_time) as strings
+        dict: Column name -> value
     """
-    high_time = minute_data.loc[minute_data['high'] == daily_high].head(1).timestamp.item()
-    low_time = minute_data.loc[minute_data['low'] == daily_low].head(1).timestamp.item()
-    return high_time, low_time
+    return {
+        'ticker': ticker,
+        'date': date,
+        'open': session['open'],
+        'close': session['close'],
+        'high': session['high'],
+        'low': session['low'],
+        'high time': session['high time'],
+        'low time': session['low time'],
+        'volume': volume,
+        'pm high': session['pm high'],
+        'pm low': session['pm low'],
+        'pm high time': session['pm high time'],
+        'pm low time': session['pm low time'],
+        'pm volume': session['pm volume'],
+        'ah high': session['ah high'],
+        'ah low': session['ah low'],
+        'ah high time': session['ah high time'],
+        'ah low time': session['ah low time'],
+        'ah volume': session['ah volume'],
+        'market cap': ticker_details.get('market_cap'),
+        'shares outstanding': ticker_details.get('weighted_shares_outstanding')
+    }
 
 
-def get_pm_data(minute_data):
+def summarize_minute_data(minute_aggs):
     """
-    Get pre-market data (before 9:30 AM ET).
+    Reduce a day of minute bars to regular, pre-market and after-hours statistics.
 
     Args:
-        minute_data (pd.DataFrame): Minute-level data
+        minute_aggs (np.ndarray): Minute bars from the bar store
 
     Returns:
-        tuple: (high, low, volume, high_time, low_time)
+        dict: Session statistics, or None if the regular session has not closed
     """
-    pm_data = minute_data.loc[:'09:29:00']
+    sessions = summarize_sessions(MinuteBars.from_records(minute_aggs))
+    if not sessions:
+        raise ValueError('no minute bars for this date')
+    return sessions[-1][1]
 
-    if pm_data.empty:
-        return None, None, None, None, None
 
-    pm_high = pm_data.high.max()
-    pm_low = pm_data.low.min()
-    pm_vol = pm_data.volume.sum()
-    pm_high_time = pm_data.loc[pm_data['high'] == pm_high].head(1).timestamp.item()
-    pm_low_time = pm_data.loc[pm_data['low'] == pm_low].head(1).timestamp.item()
-
-    return pm_high, pm_low, pm_vol, pm_high_time, pm_low_time
-
-
-def get_ah_data(minute_data):
+def df_to_excel(dfs):
     """
-    Get after-hours data (after 4:00 PM ET).
+    Combine multiple DataFrames and export to an in-memory Excel workbook.
 
     Args:
-        minute_data (pd.DataFrame): Minute-level data
+        dfs (list): List of pandas DataFrames to combine
 
     Returns:
-        tuple: (high, low, volume, high_time, low_time)
+        io.BytesIO: Workbook bytes, rewound for reading
     """
-    ah_data = minute_data.loc['16:00:00':]
-
-    if ah_data.empty:
-        return None, None, None, None, None
-
-    ah_high = ah_data.high.max()
-    ah_low = ah_data.low.min()
-    ah_vol = ah_data.volume.sum()
-    ah_high_time = ah_data.loc[ah_data['high'] == ah_high].head(1).timestamp.item()
-    ah_low_time = ah_data.loc[ah_data['low'] == ah_low].head(1).timestamp.item()
-
-    return ah_high, ah_low, ah_vol, ah_high_time, ah_low_time
+    combined_df = pd.concat(dfs)
+    buffer = io.BytesIO()
+    combined_df.to_excel(buffer, index=False)
+    buffer.seek(0)
+    return buffer
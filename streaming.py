@@ -0,0 +1,459 @@
+"""
+Streaming Module
+Live minute/second aggregates from the Polygon websocket, folded into per-ticker session state
+"""
+import asyncio
+import json
+from datetime import datetime
+import aiohttp
+import numpy as np
+from config import POLYGON_API_KEY, STREAM_URL, STREAM_FEED
+from polygon_client import get_client
+from bar_store import BAR_DTYPE, eastern, set_live_source
+from bars import RTH_OPEN, RTH_CLOSE
+from scheduler import backoff_delay, current_priority, BULK
+from metrics import metrics
+
+# Websocket event names: minute and second aggregates
+MINUTE_EVENT = 'AM'
+SECOND_EVENT = 'A'
+
+
+def time_label(timestamp):
+    """Format an epoch-ms timestamp like MinuteBars.time_label."""
+    return datetime.fromtimestamp(timestamp / 1000, eastern).isoformat(sep=' ')
+
+
+class Segment:
+    """Running OHLCV and first high/low times of one part (pm, rth, ah) of a session."""
+
+    __slots__ = ('open', 'high', 'low', 'close', 'volume', 'high_time', 'low_time')
+
+    def __init__(self):
+        self.open = self.high = self.low = self.close = None
+        self.high_time = self.low_time = None
+        self.volume = 0.0
+
+    def update(self, timestamp, open, high, low, close, volume):
+        """Fold in one bar."""
+        if self.open is None:
+            self.open, self.high, self.low = open, high, low
+            self.high_time = self.low_time = timestamp
+        else:
+            # Strict comparisons keep the first time a high/low was reached, like segment_stats
+            if high > self.high:
+                self.high, self.high_time = high, timestamp
+            if low < self.low:
+                self.low, self.low_time = low, timestamp
+        self.close = close
+        self.volume += volume
+
+
+class SessionState:
+    """
+    Rolling premarket/regular/after-hours statistics for one ticker's session.
+
+    Every bar updates a fixed number of fields, so keeping the state current
+    costs O(1) per bar no matter how far into the session the stream is.
+    """
+
+    __slots__ = ('pm', 'rth', 'ah', 'volume', 'dollar_volume', 'last_timestamp')
+
+    def __init__(self):
+        self.pm = Segment()
+        self.rth = Segment()
+        self.ah = Segment()
+        self.volume = 0.0
+        self.dollar_volume = 0.0
+        self.last_timestamp = None
+
+    def update(self, timestamp, minute, open, high, low, close, volume, vwap):
+        """
+        Fold in one minute or second aggregate.
+
+        Args:
+            timestamp (int): Bar start, epoch milliseconds
+            minute (int): Eastern minute of day of the bar start
+            open, high, low, close (float): Bar prices
+            volume (float): Bar volume
+            vwap (float): Bar volume-weighted average price
+        """
+        if minute < RTH_OPEN:
+            segment = self.pm
+        elif minute < RTH_CLOSE:
+            segment = self.rth
+        else:
+            segment = self.ah
+        segment.update(timestamp, open, high, low, close, volume)
+        self.volume += volume
+        self.dollar_volume += (vwap if vwap == vwap else close) * volume  # vwap may be NaN
+        self.last_timestamp = timestamp
+
+    @property
+    def last_price(self):
+        """Close of the latest bar folded in, or None before the first."""
+        for segment in (self.ah, self.rth, self.pm):
+            if segment.close is not None:
+                return segment.close
+        return None
+
+    @property
+    def vwap(self):
+        """Volume-weighted average price of the session so far."""
+        return self.dollar_volume / self.volume if self.volume else None
+
+    def summary(self):
+        """
+        The session so far, keyed like a summarize_sessions summary.
+
+        Returns:
+            dict: Regular-session OHLC, HOD/LOD times and volume, the same
+                for pm/ah, plus 'volume' and 'vwap' for the whole session
+        """
+        rth = self.rth
+        summary = {
+            'open': rth.open,
+            'close': rth.close,
+            'high': rth.high,
+            'low': rth.low,
+            'high time': None if rth.high_time is None else time_label(rth.high_time),
+            'low time': None if rth.low_time is None else time_label(rth.low_time),
+            'rth volume': rth.volume if rth.open is not None else None,
+            'volume': self.volume,
+            'vwap': self.vwap,
+        }
+        for prefix, segment in (('pm', self.pm), ('ah', self.ah)):
+            started = segment.open is not None
+            summary[f'{prefix} high'] = segment.high
+            summary[f'{prefix} low'] = segment.low
+            summary[f'{prefix} volume'] = segment.volume if started else None
+            summary[f'{prefix} high time'] = time_label(segment.high_time) if started else None
+            summary[f'{prefix} low time'] = time_label(segment.low_time) if started else None
+        return summary
+
+
+class LiveBars:
+    """Minute bars of the session in progress in a growable BAR_DTYPE array (amortized O(1) appends)."""
+
+    def __init__(self, capacity=1024):
+        self._array = np.empty(capacity, dtype=BAR_DTYPE)
+        self.size = 0
+        self.partial = False  # Last bar is still being built from second aggregates
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def last_timestamp(self):
+        return self._array['timestamp'][self.size - 1] if self.size else -1
+
+    def append(self, timestamp, open, high, low, close, volume, vwap, transactions, partial=False):
+        """Add a bar after the last one."""
+        if self.size == len(self._array):
+            grown = np.empty(len(self._array) * 2, dtype=BAR_DTYPE)
+            grown[:self.size] = self._array[:self.size]
+            self._array = grown
+        self._array[self.size] = (timestamp, open, high, low, close, volume, vwap, transactions)
+        self.size += 1
+        self.partial = partial
+
+    def merge_last(self, high, low, close, volume, vwap, transactions):
+        """Fold a second aggregate into the minute bar being built."""
+        last = self._array[self.size - 1]
+        total = last['volume'] + volume
+        if total:
+            last['vwap'] = (last['vwap'] * last['volume'] + vwap * volume) / total
+        last['high'] = max(last['high'], high)
+        last['low'] = min(last['low'], low)
+        last['close'] = close
+        last['volume'] = total
+        last['transactions'] += transactions
+
+    def snapshot(self):
+        """Copy of the bars so far (callers may hold it while the stream appends)."""
+        return self._array[:self.size].copy()
+
+
+class LiveTicker:
+    """Stream state of one subscribed ticker for one session date."""
+
+    def __init__(self, ticker, day):
+        self.ticker = ticker
+        self.reset(day, ready=False)
+
+    def reset(self, day, ready):
+        self.day = day
+        self.state = SessionState()
+        self.bars = LiveBars()
+        self.ready = ready  # False until the session so far has been backfilled
+        self.pending = []   # Events received while backfilling
+
+    def add(self, timestamp, minute, open, high, low, close, volume, vwap, transactions, second=False):
+        """
+        Fold one aggregate into the bars and session state, skipping duplicates.
+
+        Minute aggregates start a new bar. Second aggregates are rolled into
+        the bar of their minute.
+        """
+        bar_start = timestamp - timestamp % 60_000
+        last = self.bars.last_timestamp
+        if bar_start < last or (bar_start == last and not (second and self.bars.partial)):
+            return False  # Already covered by the backfill or an earlier event
+        if bar_start == last:
+            self.bars.merge_last(high, low, close, volume, vwap, transactions)
+        else:
+            self.bars.append(bar_start, open, high, low, close, volume, vwap, transactions, partial=second)
+        self.state.update(timestamp, minute, open, high, low, close, volume, vwap)
+        return True
+
+
+def eastern_day_minute(timestamp):
+    """Eastern session date and minute of day of an epoch-ms timestamp."""
+    local = datetime.fromtimestamp(timestamp / 1000, eastern)
+    return local.date(), local.hour * 60 + local.minute
+
+
+class PolygonStream:
+    """
+    Client for Polygon's aggregate websocket feed.
+
+    Subscribed tickers are backfilled with one REST request for the session
+    so far, then kept current from the feed. On disconnect it reconnects with
+    backoff and backfills again, so bars missed while offline are recovered.
+    """
+
+    def __init__(self, url=STREAM_URL, api_key=POLYGON_API_KEY, feed=STREAM_FEED):
+        self.url = url
+        self.api_key = api_key
+        self.feed = feed
+        self.tickers = {}
+        self.connected = False
+        self.events = 0
+        self.reconnects = 0
+        self.lag = None
+        self.listeners = []
+        self._ws = None
+        self._task = None
+        self._backfills = set()
+
+    def start(self, tickers):
+        """
+        Connect in the background and stream the given tickers.
+
+        Args:
+            tickers (list): Ticker symbols to subscribe to
+        """
+        today = datetime.now(eastern).date()
+        for ticker in tickers:
+            self.tickers.setdefault(ticker.upper(), LiveTicker(ticker.upper(), today))
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def add_listener(self, listener):
+        """
+        Call a function for every streamed aggregate (backfilled bars are not replayed).
+
+        Args:
+            listener (callable): Takes (ticker, timestamp, minute, open, high, low, close)
+        """
+        self.listeners.append(listener)
+
+    async def stop(self):
+        """Disconnect and stop reconnecting."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, *self._backfills, return_exceptions=True)
+            self._task = None
+
+    async def subscribe(self, tickers):
+        """
+        Add tickers to a running stream.
+
+        Args:
+            tickers (list): Ticker symbols
+        """
+        today = datetime.now(eastern).date()
+        added = [ticker.upper() for ticker in tickers if ticker.upper() not in self.tickers]
+        for ticker in added:
+            self.tickers[ticker] = LiveTicker(ticker, today)
+        if added and self._ws is not None:
+            await self._send_subscribe(self._ws, added)
+
+    def bars(self, ticker, date):
+        """
+        Minute bars of a streamed session so far.
+
+        Args:
+            ticker (str): Stock ticker symbol
+            date (str | date): Date in YYYY-MM-DD format
+
+        Returns:
+            np.ndarray: Bars with dtype BAR_DTYPE, or None if the ticker is not
+                live for that date
+        """
+        live = self._live(ticker, date)
+        return None if live is None else live.bars.snapshot()
+
+    def session(self, ticker, date):
+        """
+        Rolling session state of a streamed ticker.
+
+        Args:
+            ticker (str): Stock ticker symbol
+            date (str | date): Date in YYYY-MM-DD format
+
+        Returns:
+            SessionState: Current state, or None if the ticker is not live for that date
+        """
+        live = self._live(ticker, date)
+        return None if live is None else live.state
+
+    def _live(self, ticker, date):
+        live = self.tickers.get(ticker.upper())
+        if live is None or not live.ready or str(live.day) != str(date):
+            return None
+        return live
+
+    async def _run(self):
+        attempt = 0
+        while True:
+            try:
+                async with aiohttp.ClientSession() as session:
+                    async with session.ws_connect(self.url, heartbeat=30) as ws:
+                        await self._authenticate(ws)
+                        attempt = 0
+                        self._ws = ws
+                        self.connected = True
+                        await self._send_subscribe(ws, list(self.tickers))
+                        async for message in ws:
+                            if message.type == aiohttp.WSMsgType.TEXT:
+                                self._dispatch(json.loads(message.data))
+                            elif message.type == aiohttp.WSMsgType.ERROR:
+                                break
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                print(f'Stream error: {type(err).__name__}: {err}')
+            finally:
+                self._ws = None
+                self.connected = False
+            self.reconnects += 1
+            await asyncio.sleep(backoff_delay(attempt))
+            attempt += 1
+
+    async def _authenticate(self, ws):
+        await ws.send_json({'action': 'auth', 'params': self.api_key})
+        async for message in ws:
+            for event in json.loads(message.data):
+                if event.get('ev') != 'status':
+                    continue
+                if event.get('status') == 'auth_success':
+                    return
+                if event.get('status') == 'auth_failed':
+                    raise ConnectionError(event.get('message', 'authentication failed'))
+        raise ConnectionError('stream closed during authentication')
+
+    async def _send_subscribe(self, ws, tickers):
+        if not tickers:
+            return
+        # Events arriving before the backfill finishes are queued, so nothing is lost in between
+        today = datetime.now(eastern).date()
+        for ticker in tickers:
+            self.tickers[ticker].reset(today, ready=False)
+        await ws.send_json({'action': 'subscribe', 'params': ','.join(f'{self.feed}.{t}' for t in tickers)})
+        for ticker in tickers:
+            task = asyncio.create_task(self._backfill(self.tickers[ticker]))
+            self._backfills.add(task)
+            task.add_done_callback(self._backfills.discard)
+
+    async def _backfill(self, live):
+        day = live.day
+        priority = current_priority.set(BULK)
+        try:
+            bars = await get_client().get_aggs(live.ticker, 1, 'minute', day, day)
+        except Exception as err:
+            print(f'Stream backfill failed for {live.ticker}: {err}')
+            bars = []
+        finally:
+            current_priority.reset(priority)
+        if live.day != day:
+            return  # The session rolled over meanwhile
+        for bar in bars:
+            _, minute = eastern_day_minute(bar['timestamp'])
+            live.add(bar['timestamp'], minute, bar['open'], bar['high'], bar['low'], bar['close'],
+                     bar['volume'], bar.get('vwap', np.nan), bar.get('transactions') or 0)
+        live.ready = True
+        pending, live.pending = live.pending, []
+        for event in pending:
+            self._ingest(live, event)
+
+    def _dispatch(self, events):
+        for event in events:
+            kind = event.get('ev')
+            if kind not in (MINUTE_EVENT, SECOND_EVENT):
+                continue
+            live = self.tickers.get(event.get('sym'))
+            if live is None:
+                continue
+            self.events += 1
+            self.lag = datetime.now().timestamp() - event.get('e', event['s']) / 1000
+            if not live.ready:
+                live.pending.append(event)
+            else:
+                self._ingest(live, event)
+
+    def _ingest(self, live, event):
+        day, minute = eastern_day_minute(event['s'])
+        if day != live.day:
+            live.reset(day, ready=True)  # A new session starts from its first streamed bar
+        # The feed has no trade count ('z' is the average trade size), so streamed bars record 0 (unknown)
+        added = live.add(event['s'], minute, event['o'], event['h'], event['l'], event['c'], event['v'],
+                         event.get('vw', np.nan), 0, second=event['ev'] == SECOND_EVENT)
+        if added:
+            for listener in self.listeners:
+                listener(live.ticker, event['s'], minute, event['o'], event['h'], event['l'], event['c'])
+
+
+stream = PolygonStream()
+metrics.register_gauge(
+    'stream_status', 'Websocket feed connection, live tickers, events and reconnects',
+    lambda: [
+        ({'kind': 'connected'}, int(stream.connected)),
+        ({'kind': 'tickers'}, sum(live.ready for live in stream.tickers.values())),
+        ({'kind': 'events'}, stream.events),
+        ({'kind': 'reconnects'}, stream.reconnects),
+    ]
+)
+metrics.register_gauge(
+    'stream_lag_seconds', 'Delay between the end of the last streamed bar and its arrival',
+    lambda: [({}, round(stream.lag, 3))] if stream.lag is not None else []
+)
+
+
+def start(tickers):
+    """
+    Stream tickers and serve their sessions in progress from live state.
+
+    Args:
+        tickers (list): Ticker symbols
+    """
+    set_live_source(stream.bars)
+    stream.start(tickers)
+
+
+async def follow(tickers):
+    """
+    Stream more tickers, starting the stream if it is not running yet.
+
+    Args:
+        tickers (list): Ticker symbols
+    """
+    if stream._task is None:
+        start(tickers)
+    else:
+        await stream.subscribe(tickers)
+
+
+def live_session(ticker, date):
+    """Rolling session state of a streamed ticker, or None (see PolygonStream.session)."""
+    return stream.session(ticker, date)
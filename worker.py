@@ -0,0 +1,450 @@
+"""
+Worker Tier Module
+Command jobs run by worker processes that take them from the bot's shared job queue
+
+Usage:
+    python worker.py    # with JOB_QUEUE_ADDRESS set to the bot's job queue (host:port)
+
+With JOB_QUEUE_ADDRESS set, the bot (the gateway) serves a job queue and a
+result queue on that address. Worker processes, on the same machine or
+others, connect to it. They run the jobs (data fetching, pandas analytics,
+chart rendering) and put each result back under its job ID. Without
+JOB_QUEUE_ADDRESS the bot runs every job itself.
+"""
+import asyncio
+import itertools
+import multiprocessing
+import pickle
+import queue
+import signal
+import sys
+import threading
+import time
+from multiprocessing.managers import BaseManager
+from config import (
+    JOB_QUEUE_ADDRESS, JOB_QUEUE_AUTHKEY, JOB_TIMEOUT, JOB_WORKER_CONCURRENCY, MAX_PENDING_JOBS
+)
+import jobs
+from jobs import current_guild, run_io, JobQueueFull
+from scheduler import backoff_delay
+from renderer import START_METHOD
+from metrics import metrics
+
+
+class JobTimeout(JobQueueFull):
+    """Raised when no worker returned a job's result in time (handled like a busy bot)."""
+
+
+# Former built-in authkey, published in the README; never accepted
+PUBLIC_AUTHKEY = b'stockbot'
+
+
+def check_authkey(authkey=JOB_QUEUE_AUTHKEY):
+    """
+    Refuse to serve or join a job queue without a private authkey.
+
+    Jobs and results cross the queue as pickles, so anyone who can
+    authenticate to it can run code in the bot and in every worker.
+
+    Raises:
+        RuntimeError: If the authkey is missing or the public default
+    """
+    if not authkey or authkey == PUBLIC_AUTHKEY:
+        raise RuntimeError(
+            'JOB_QUEUE_AUTHKEY must be set to a private secret shared by the bot and its workers '
+            'when JOB_QUEUE_ADDRESS is set'
+        )
+
+
+# Jobs take picklable arguments and return picklable results. The modules
+# they use pull in pandas and Plotly, so they are imported on first use.
+
+async def stock_data_job(tickers, date, end_date):
+    """
+    Fetch /stock_data rows and export them to a workbook.
+
+    Returns:
+        tuple: (xlsx bytes, or None if no ticker succeeded, list of (ticker, reason) failures)
+    """
+    from stock_data import get_many_ticker_data, df_to_excel
+    frames, failures = await get_many_ticker_data(tickers, date, end_date)
+    if not frames:
+        return None, failures
+    workbook = await run_io(df_to_excel, frames)
+    return workbook.getvalue(), failures
+
+
+async def candle_chart_job(ticker, date, time1, time2):
+    from candle_chart import make_candle_chart
+    return await make_candle_chart(ticker, date, time1, time2)
+
+
+async def daily_candle_chart_job(ticker, date):
+    from candle_chart import make_daily_candle_chart
+    return await make_daily_candle_chart(ticker, date)
+
+
+async def timespan_chart_job(ticker, multiplier, timespan, date, more_data):
+    from candle_chart import timespan_candle_chart
+    return await timespan_candle_chart(ticker, multiplier, timespan, date=date, more_data=more_data)
+
+
+async def gap_stats_job(ticker, percent):
+    """
+    Compute /gap_stats for a ticker.
+
+    Returns:
+        dict: Statistic name to value
+    """
+    from gap_data import get_gap_data
+    results = await get_gap_data(ticker, percent)
+    return results.iloc[0].to_dict()
+
+
+JOBS = {
+    'stock_data': stock_data_job,
+    'candle_chart': candle_chart_job,
+    'daily_candle_chart': daily_candle_chart_job,
+    'timespan_chart': timespan_chart_job,
+    'gap_stats': gap_stats_job,
+}
+
+
+class StampedQueue(queue.Queue):
+    """
+    Job queue that reports how long each job waited in it.
+
+    Items are stamped with the manager process's monotonic clock when put
+    and come out as (seconds waited, item), so the wait is measured on one
+    clock however far apart the bot's and workers' clocks are.
+    """
+
+    def _put(self, item):
+        self.queue.append((time.monotonic(), item))
+
+    def _get(self):
+        queued_at, item = self.queue.popleft()
+        return time.monotonic() - queued_at, item
+
+
+# Queues served by the bot's manager process
+_job_queue = StampedQueue(MAX_PENDING_JOBS)
+_result_queue = queue.Queue()
+
+
+def _get_job_queue():
+    return _job_queue
+
+
+def _get_result_queue():
+    return _result_queue
+
+
+class JobQueueManager(BaseManager):
+    """Shares the job and result queues between the bot and its workers."""
+
+
+JobQueueManager.register('jobs', callable=_get_job_queue)
+JobQueueManager.register('results', callable=_get_result_queue)
+
+
+def parse_address(address):
+    """Split 'host:port' into a (host, port) tuple."""
+    host, _, port = address.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def portable_error(err):
+    """The exception itself if it survives pickling, else a RuntimeError describing it."""
+    try:
+        return pickle.loads(pickle.dumps(err))
+    except Exception:
+        return RuntimeError(f'{type(err).__name__}: {err}')
+
+
+class JobDispatcher:
+    """
+    Bot side of the worker tier: enqueues jobs and routes results back.
+
+    Every job gets an ID and a future. A reader thread takes results off the
+    shared result queue and resolves the future registered under the result's
+    ID, so each command gets its own result whichever worker ran the job.
+    Jobs carry the command's timeout; workers skip jobs that waited in the
+    queue longer than that, and results arriving after the command stopped
+    waiting are dropped.
+    """
+
+    def __init__(self, address=JOB_QUEUE_ADDRESS, authkey=JOB_QUEUE_AUTHKEY, timeout=JOB_TIMEOUT):
+        self.address = parse_address(address)
+        self.authkey = authkey
+        self.timeout = timeout
+        self.completed = 0
+        self.timeouts = 0
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._manager = None
+        self._jobs = None
+        self._loop = None
+        self._reader = None
+        self._stopped = threading.Event()
+
+    @property
+    def pending(self):
+        """Jobs waiting for a result."""
+        return len(self._pending)
+
+    def start(self):
+        """Start serving the queues (in a manager process, not forked from the bot) and reading results."""
+        self._loop = asyncio.get_running_loop()
+        self._manager = JobQueueManager(self.address, self.authkey, ctx=multiprocessing.get_context(START_METHOD))
+        self._manager.start()
+        self._jobs = self._manager.jobs()
+        self._stopped.clear()
+        self._reader = threading.Thread(
+            target=self._read_results, args=(self._manager.results(),),
+            name='stockbot-job-results', daemon=True
+        )
+        self._reader.start()
+
+    def stop(self):
+        """Stop reading results, shut the queues down and cancel jobs still waiting."""
+        if self._manager is None:
+            return
+        self._stopped.set()
+        self._reader.join(timeout=2)
+        self._manager.shutdown()
+        self._manager = None
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+
+    def _read_results(self, results):
+        while not self._stopped.is_set():
+            try:
+                job_id, ok, value = results.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                return
+            self._loop.call_soon_threadsafe(self._resolve, job_id, ok, value)
+
+    def _resolve(self, job_id, ok, value):
+        future = self._pending.pop(job_id, None)
+        if future is None or future.done():
+            return
+        self.completed += 1
+        if ok:
+            future.set_result(value)
+        else:
+            future.set_exception(value)
+
+    def _put(self, job):
+        try:
+            self._jobs.put(job, block=False)
+        except queue.Full:
+            raise JobQueueFull(f'{MAX_PENDING_JOBS} jobs already queued for workers')
+
+    async def submit(self, kind, args, guild_id=None):
+        """
+        Run a job on the worker tier and wait for its result.
+
+        Args:
+            kind (str): Job name (key of JOBS)
+            args (tuple): Picklable job arguments
+            guild_id (int): Guild the job runs for (kept for fair scheduling on the worker)
+
+        Returns:
+            Any: The job's result
+
+        Raises:
+            JobQueueFull: If the job queue is full
+            JobTimeout: If no result arrived within the timeout
+            Exception: Whatever the job raised on the worker
+        """
+        job_id = next(self._ids)
+        future = self._loop.create_future()
+        self._pending[job_id] = future
+        try:
+            await self._loop.run_in_executor(
+                None, self._put, (job_id, kind, args, guild_id, self.timeout)
+            )
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise JobTimeout(f'{kind} job {job_id} got no result within {self.timeout:.0f}s')
+        finally:
+            self._pending.pop(job_id, None)
+
+
+_dispatcher = None
+
+
+def dispatcher_status():
+    """Worker tier jobs, as (labels, value) metric samples."""
+    if _dispatcher is None:
+        return []
+    return [
+        ({'state': 'pending'}, _dispatcher.pending),
+        ({'state': 'completed'}, _dispatcher.completed),
+        ({'state': 'timed_out'}, _dispatcher.timeouts),
+    ]
+
+
+metrics.register_gauge('worker_jobs', 'Jobs sent to the worker tier', dispatcher_status)
+
+
+def start_dispatcher():
+    """
+    Serve the job queue on JOB_QUEUE_ADDRESS (called by the bot once connected).
+
+    Raises:
+        RuntimeError: If JOB_QUEUE_AUTHKEY is missing or the public default
+    """
+    global _dispatcher
+    check_authkey()
+    if _dispatcher is None:
+        _dispatcher = JobDispatcher()
+        _dispatcher.start()
+
+
+def stop_dispatcher():
+    """Shut the job queue down."""
+    global _dispatcher
+    if _dispatcher is not None:
+        _dispatcher.stop()
+        _dispatcher = None
+
+
+async def run_job(kind, *args):
+    """
+    Run a command job on the worker tier, or in this process when there is none.
+
+    Args:
+        kind (str): Job name (key of JOBS)
+        *args: Picklable job arguments
+
+    Returns:
+        Any: The job's result
+    """
+    if _dispatcher is None:
+        return await JOBS[kind](*args)
+    return await _dispatcher.submit(kind, args, current_guild.get())
+
+
+async def execute(job, waited, results):
+    """
+    Run one job from the queue and put its outcome on the result queue.
+
+    Args:
+        job (tuple): (job ID, job name, arguments, guild ID, timeout in seconds)
+        waited (float): Seconds the job spent in the queue
+        results: The shared result queue
+    """
+    job_id, kind, args, guild_id, timeout = job
+    if waited >= timeout:
+        return  # The bot has stopped waiting for it
+    current_guild.set(guild_id)
+    try:
+        outcome = (job_id, True, await JOBS[kind](*args))
+    except Exception as err:
+        outcome = (job_id, False, portable_error(err))
+
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(None, results.put, outcome)
+    except (EOFError, OSError) as err:
+        print(f'Could not return result of {kind} job {job_id}: {err}')
+    except Exception as err:
+        # e.g. an unpicklable result
+        await loop.run_in_executor(None, results.put, (job_id, False, portable_error(err)))
+
+
+def take(job_queue):
+    """
+    Wait up to a second for the next job, so shutdown is never blocked for long.
+
+    Returns:
+        tuple: (seconds the job waited in the queue, job), or None if no job came
+    """
+    try:
+        return job_queue.get(timeout=1)
+    except queue.Empty:
+        return None
+
+
+async def serve(address=JOB_QUEUE_ADDRESS, authkey=JOB_QUEUE_AUTHKEY, concurrency=JOB_WORKER_CONCURRENCY):
+    """
+    Take jobs from the bot's queue and run up to `concurrency` at once.
+
+    Reconnects with backoff when the bot is not up yet or restarts.
+
+    Args:
+        address (str): host:port of the bot's job queue
+        authkey (bytes): Secret shared with the bot
+        concurrency (int): Jobs run at once
+    """
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(concurrency)
+    running = set()
+
+    def finished(task):
+        running.discard(task)
+        slots.release()
+
+    attempt = 0
+    while True:
+        try:
+            manager = JobQueueManager(parse_address(address), authkey)
+            await loop.run_in_executor(None, manager.connect)
+            job_queue, results = manager.jobs(), manager.results()
+            print(f'Worker connected to job queue at {address}')
+            attempt = 0
+            while True:
+                await slots.acquire()
+                try:
+                    taken = await loop.run_in_executor(None, take, job_queue)
+                except BaseException:
+                    slots.release()
+                    raise
+                if taken is None:
+                    slots.release()
+                    continue
+                waited, job = taken
+                task = asyncio.create_task(execute(job, waited, results))
+                running.add(task)
+                task.add_done_callback(finished)
+        except (EOFError, OSError) as err:
+            delay = backoff_delay(attempt, cap=10.0)
+            attempt += 1
+            print(f'Job queue at {address} unavailable ({type(err).__name__}), retrying in {delay:.1f}s')
+            await asyncio.sleep(delay)
+
+
+async def run_worker():
+    """Run a worker until SIGINT/SIGTERM, with warm render workers and a shared Polygon client."""
+    from polygon_client import close_client
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, asyncio.current_task().cancel)
+    jobs.start()
+    try:
+        await serve()
+    except asyncio.CancelledError:
+        print('Worker shutting down')
+    finally:
+        await close_client()
+        jobs.shutdown()
+
+
+def main():
+    if not JOB_QUEUE_ADDRESS:
+        sys.exit("Set JOB_QUEUE_ADDRESS to the bot's job queue (host:port)")
+    try:
+        check_authkey()
+    except RuntimeError as err:
+        sys.exit(str(err))
+    asyncio.run(run_worker())
+
+
+if __name__ == '__main__':
+    main()